@@ -4,13 +4,33 @@ from __future__ import print_function
 
 import time
 import os
+import re
 import shutil
-from xml.etree import cElementTree as ET
+import binascii
+import copy
+import errno
 import plistlib
+from xml.parsers import expat
 import textwrap
 import datetime
 import glob
+import hashlib
+import heapq
+import itertools
+import json
+import marshal
+import multiprocessing
+import stat
+import threading
 from collections import OrderedDict
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 """
 - filter out unknown attributes and subelements
@@ -30,32 +50,81 @@ structure and file naming scheme.
 def main(args=None):
     import argparse
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument("input", help="Path to a UFO to normalize.", nargs="?")
+    parser.add_argument("input", help="Paths to the UFOs or designspace files to normalize. The source UFOs of a designspace file are normalized.", nargs="*")
     parser.add_argument("-t", "--test", help="Run the normalizer's internal tests.", action="store_true")
     parser.add_argument("-o", "--output", help="Output path. If not given, the input path will be used.")
     parser.add_argument("-a", "--all", help="Normalize all files in the UFO. By default, only files modified since the previous normalization will be processed.", action="store_true")
+    parser.add_argument("--content-hash", help="Detect modified files by comparing content hashes instead of modification times. This allows unchanged files to be skipped after the UFO has been copied or checked out.", action="store_true")
+    parser.add_argument("--state-file", help="Path to a file for storing the data used to find modified files. By default, this is stored in the UFO's lib.plist and layerinfo.plist files.")
+    parser.add_argument("--trust-directory-mod-times", help="Skip layers whose directory modification time has not changed since the previous normalization. This requires --state-file. Files that are modified in place instead of being replaced will not be noticed.", action="store_true")
+    parser.add_argument("--durability", help="How written files are made durable. none leaves this to the operating system, file syncs each file as it is written and batch syncs everything that was written once at the end. Files are always replaced in one step, so an interrupted run doesn't leave partly written files. Defaults to none.", choices=list(writeDurabilities))
+    parser.add_argument("-j", "--jobs", help="Number of processes to use for normalizing GLIF files. The processes are shared by all of the UFOs. Use 0 for one process per CPU. Defaults to 1.", type=int, default=1)
+    parser.add_argument("--glif-engine", help="How GLIF files are processed. expat writes the outline from parser events, numpy converts each glyph's coordinates together with NumPy, which can be faster for glyphs with up to a few thousand points, streaming keeps memory use low for very large glyphs and tree parses the whole file. By default, expat is used for files smaller than 4 MB and streaming for larger files.", choices=list(glifEngines))
+    parser.add_argument("--xml-backend", help="XML parser to use. By default, lxml is used if it is installed.", choices=list(xmlBackends.keys()))
+    parser.add_argument("--benchmark", help="Report how many GLIF files per second each XML backend and GLIF engine can normalize in the input UFO. The UFO is not modified.", action="store_true")
     args = parser.parse_args(args)
     if args.test:
         runTests()
         return
-    inputPath = args.input
+    if args.xml_backend:
+        setXMLBackend(args.xml_backend)
+    if args.durability:
+        setWriteDurability(args.durability)
+    inputPaths = args.input
     outputPath = args.output
     onlyModified = not args.all
-    if inputPath is None:
+    if not inputPaths:
         print("No input path was specified.")
         return
-    if not os.path.exists(inputPath):
-        print("Input path does not exist:", inputPath)
-        return
-    if os.path.splitext(inputPath)[-1].lower() != ".ufo":
-        print("Input path is not a UFO:", inputPath)
+    for inputPath in inputPaths:
+        if not os.path.exists(inputPath):
+            print("Input path does not exist:", inputPath)
+            return
+        if os.path.splitext(inputPath)[-1].lower() not in (".ufo", ".designspace"):
+            print("Input path is not a UFO or designspace file:", inputPath)
+            return
+    ufoPaths = getUFOPaths(inputPaths)
+    for ufoPath in ufoPaths:
+        if not os.path.exists(ufoPath):
+            print("Source UFO does not exist:", ufoPath)
+            return
+    isSingleUFO = len(inputPaths) == 1 and len(ufoPaths) == 1 and ufoPaths[0] == inputPaths[0]
+    if not isSingleUFO:
+        if outputPath is not None:
+            print("--output requires a single UFO.")
+            return
+        if args.benchmark:
+            print("--benchmark requires a single UFO.")
+            return
+    if args.benchmark:
+        benchmarkXMLBackends(inputPath)
+        benchmarkCoordinateFormatting(inputPath)
         return
-    message = "Normalizing \"%s\"." % os.path.basename(inputPath)
+    if isSingleUFO:
+        message = "Normalizing \"%s\"." % os.path.basename(inputPath)
+    else:
+        message = "Normalizing %d UFOs." % len(ufoPaths)
     if not onlyModified:
         message += " Processing all files."
     print(message)
     start = time.time()
-    normalizeUFO(inputPath, outputPath=outputPath, onlyModified=onlyModified)
+    changeDetector = "modTime"
+    if args.content_hash:
+        changeDetector = "contentHash"
+    stateStore = None
+    if args.state_file:
+        stateStore = SQLiteStateStore(args.state_file)
+    elif args.trust_directory_mod_times:
+        print("--trust-directory-mod-times requires --state-file.")
+        return
+    try:
+        if isSingleUFO:
+            normalizeUFO(inputPath, outputPath=outputPath, onlyModified=onlyModified, jobs=args.jobs, changeDetector=changeDetector, stateStore=stateStore, trustDirectoryModTimes=args.trust_directory_mod_times, glifEngine=args.glif_engine)
+        else:
+            normalizeUFOs(ufoPaths, onlyModified=onlyModified, jobs=args.jobs, changeDetector=changeDetector, stateStore=stateStore, trustDirectoryModTimes=args.trust_directory_mod_times, glifEngine=args.glif_engine)
+    finally:
+        if stateStore is not None:
+            stateStore.close()
     runtime = time.time() - start
     print("Normalization complete (%.4f seconds)." % runtime)
 
@@ -84,22 +153,10 @@ try:
 except NameError:
     unicode = str
 
-# Python2 does not have plistlib.readPlistFromBytes it has
-# plistlib.readPlistFromString instead.
 try:
-    plistlib.readPlistFromBytes
-
-    def _readPlistFromBytes(data):
-        return plistlib.readPlistFromBytes(tobytes(data))
-
-    def _writePlistToBytes(plist):
-        return plistlib.writePlistToBytes(plist)
-except AttributeError:
-    def _readPlistFromBytes(data):
-        return plistlib.readPlistFromString(data)
-
-    def _writePlistToBytes(plist):
-        return plistlib.writePlistToString(plist)
+    unichr
+except NameError:
+    unichr = chr
 
 
 # from fontTools.misc.py23
@@ -122,18 +179,330 @@ if str == bytes:
 else:
     tostr = tounicode
 
+# ------------
+# XML Backends
+# ------------
+
+class ElementTreeBackend(object):
+
+    """
+    The parts of the ElementTree API that are used to parse
+    GLIF files and property list elements, implemented with
+    the standard library.
+
+    >>> backend = ElementTreeBackend()
+    >>> element = backend.fromstring("<a><!-- comment --><b/></a>")
+    >>> [child.tag for child in element]
+    ['b']
+    """
+
+    name = "etree"
+
+    def __init__(self):
+        try:
+            from xml.etree import cElementTree as module
+        except ImportError:
+            from xml.etree import ElementTree as module
+        self.Element = module.Element
+        self.TreeBuilder = module.TreeBuilder
+        self.ParseError = module.ParseError
+        self.fromstring = module.fromstring
+        self.iterparse = module.iterparse
+
+    def makeParseError(self, message, code, line, column):
+        error = self.ParseError(message)
+        error.code = code
+        error.position = (line, column)
+        return error
+
+
+class LXMLBackend(ElementTreeBackend):
+
+    """
+    The same API implemented with lxml. Comments and
+    processing instructions are dropped while parsing
+    so that, like ElementTree, only elements are found
+    when iterating over an element.
+
+    >>> try:
+    ...     backend = LXMLBackend()
+    ... except ImportError:
+    ...     backend = ElementTreeBackend()
+    >>> element = backend.fromstring("<a><!-- comment --><?pi?><b/></a>")
+    >>> [child.tag for child in element]
+    ['b']
+
+    External entities are not loaded.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> subpathWriteFile(b"secret", directory, "secret.txt")
+    >>> url = "file:///" + subpathJoin(directory, "secret.txt").replace(os.sep, "/").lstrip("/")
+    >>> text = '<!DOCTYPE a [<!ENTITY e SYSTEM "%s">]><a>&e;</a>' % url
+    >>> try:
+    ...     element = backend.fromstring(text)
+    ... except backend.ParseError:
+    ...     element = None
+    >>> element is None or element.text != "secret"
+    True
+    >>> shutil.rmtree(directory)
+    """
+
+    name = "lxml"
+
+    def __init__(self):
+        from lxml import etree
+        self._etree = etree
+        self.Element = etree.Element
+        self.TreeBuilder = etree.TreeBuilder
+        self.ParseError = etree.ParseError
+        # external entities and DTDs are never loaded. lxml 5
+        # can still expand internal entities, like ElementTree.
+        # before that, all entities are left unexpanded.
+        if etree.LXML_VERSION >= (5,):
+            resolveEntities = "internal"
+        else:
+            resolveEntities = False
+        self._parserOptions = dict(
+            remove_comments=True,
+            remove_pis=True,
+            huge_tree=True,
+            resolve_entities=resolveEntities,
+            no_network=True
+        )
+
+    def fromstring(self, text):
+        # parsers can't be shared between threads
+        parser = self._etree.XMLParser(**self._parserOptions)
+        return self._etree.fromstring(text, parser)
+
+    def iterparse(self, source, events=("end",)):
+        return self._etree.iterparse(source, events=events, **self._parserOptions)
+
+    def makeParseError(self, message, code, line, column):
+        return self._etree.XMLSyntaxError(message, code, line, column)
+
+
+xmlBackends = OrderedDict([
+    ("lxml", LXMLBackend),
+    ("etree", ElementTreeBackend)
+])
+
+def getXMLBackendNames():
+    """
+    Get the names of the XML backends that can be used
+    in this environment, in order of preference.
+
+    >>> "etree" in getXMLBackendNames()
+    True
+    """
+    names = []
+    for name, backendClass in xmlBackends.items():
+        try:
+            backendClass()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+def setXMLBackend(name=None):
+    """
+    Set the XML backend used for parsing. If no name is
+    given, the first backend that can be used is selected.
+    The backend is available as ``ET``.
+
+    >>> previous = getXMLBackend().name
+    >>> setXMLBackend("etree").name
+    'etree'
+    >>> getXMLBackend().name
+    'etree'
+    >>> setXMLBackend("foo")
+    Traceback (most recent call last):
+        ...
+    UFONormalizerError: Unknown XML backend: foo
+    >>> setXMLBackend(previous).name == previous
+    True
+    """
+    global ET
+    if name is None:
+        name = getXMLBackendNames()[0]
+    if name not in xmlBackends:
+        raise UFONormalizerError("Unknown XML backend: %s" % name)
+    try:
+        ET = xmlBackends[name]()
+    except ImportError:
+        raise UFONormalizerError("XML backend is not available: %s" % name)
+    return ET
+
+def getXMLBackend():
+    """
+    Get the XML backend used for parsing.
+    """
+    return ET
+
+setXMLBackend()
+
 
 class UFONormalizerError(Exception): pass
 
 
-def normalizeUFO(ufoPath, outputPath=None, onlyModified=True):
+def normalizeUFO(ufoPath, outputPath=None, onlyModified=True, jobs=1, changeDetector="modTime", stateStore=None, trustDirectoryModTimes=False, glifEngine=None):
+    if changeDetector not in changeDetectors:
+        raise UFONormalizerError("Unknown change detector: %s" % changeDetector)
+    if glifEngine is not None and glifEngine not in glifEngines:
+        raise UFONormalizerError("Unknown GLIF engine: %s" % glifEngine)
+    if stateStore is None:
+        stateStore = LibStateStore()
+    pool = createWorkerPool(jobs)
+    try:
+        _normalizeUFO(ufoPath, outputPath, onlyModified, pool, changeDetector, stateStore, trustDirectoryModTimes, glifEngine)
+        syncWrites()
+    finally:
+        # all results have been collected at this point
+        # so the workers can be shut down immediately.
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def normalizeUFOs(paths, onlyModified=True, jobs=1, changeDetector="modTime", stateStore=None, trustDirectoryModTimes=False, glifEngine=None):
+    """
+    Normalize several UFOs in place. The paths may be UFOs or
+    designspace files. The GLIF files of all of the UFOs are
+    normalized by one worker pool. When there is a pool, the
+    UFOs are normalized at the same time so that the workers
+    are kept busy while the top level files of a UFO are
+    being normalized. The UFO paths are returned.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> ufoPaths = [_makeTestUFO(directory, glyphCount=5, fileName="%s.ufo" % name) for name in ("Light", "Bold")]
+    >>> designspacePath = os.path.join(directory, "Test.designspace")
+    >>> subpathWriteFile(_testDesignspace, directory, "Test.designspace")
+    >>> stateStore = SQLiteStateStore(os.path.join(directory, "state.db"))
+    >>> normalized = normalizeUFOs([designspacePath, ufoPaths[1]], jobs=2, stateStore=stateStore)
+    >>> [os.path.basename(ufoPath) for ufoPath in normalized]
+    ['Light.ufo', 'Bold.ufo']
+    >>> [_countNormalizedGLIFs(ufoPath, stateStore=stateStore) for ufoPath in ufoPaths]
+    [0, 0]
+    >>> subpathReadFile(ufoPaths[0], "glyphs", "a1.glif") == subpathReadFile(ufoPaths[1], "glyphs", "a1.glif")
+    True
+    >>> normalizeUFOs(ufoPaths, glifEngine="dom")
+    Traceback (most recent call last):
+        ...
+    UFONormalizerError: Unknown GLIF engine: dom
+    >>> stateStore.close()
+    >>> shutil.rmtree(directory)
+    """
+    ufoPaths = getUFOPaths(paths)
+    if changeDetector not in changeDetectors:
+        raise UFONormalizerError("Unknown change detector: %s" % changeDetector)
+    if glifEngine is not None and glifEngine not in glifEngines:
+        raise UFONormalizerError("Unknown GLIF engine: %s" % glifEngine)
+    if stateStore is None:
+        stateStore = LibStateStore()
+    jobs = getWorkerCount(jobs)
+    pool = createWorkerPool(jobs)
+    try:
+        def normalize(ufoPath):
+            _normalizeUFO(ufoPath, None, onlyModified, pool, changeDetector, stateStore, trustDirectoryModTimes, glifEngine)
+        if pool is None or len(ufoPaths) < 2:
+            for ufoPath in ufoPaths:
+                normalize(ufoPath)
+        else:
+            # the threads only wait for the pool while the
+            # GLIF files are being normalized.
+            from multiprocessing.pool import ThreadPool
+            threads = ThreadPool(min(jobs, len(ufoPaths)))
+            try:
+                threads.map(normalize, ufoPaths, 1)
+            finally:
+                threads.close()
+                threads.join()
+        syncWrites()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return ufoPaths
+
+def getUFOPaths(paths):
+    """
+    Get the UFO paths from a list of UFO and designspace
+    file paths. A UFO that is listed more than once is
+    only returned the first time.
+    """
+    ufoPaths = []
+    found = set()
+    for path in paths:
+        if os.path.splitext(path)[-1].lower() == ".designspace":
+            sourcePaths = readDesignspaceSourcePaths(path)
+        else:
+            sourcePaths = [path]
+        for ufoPath in sourcePaths:
+            key = os.path.realpath(ufoPath)
+            if key in found:
+                continue
+            found.add(key)
+            ufoPaths.append(ufoPath)
+    return ufoPaths
+
+def readDesignspaceSourcePaths(designspacePath):
+    """
+    Get the paths of the source UFOs in a designspace file.
+    The paths are relative to the designspace file. A source
+    can be listed once for each of its layers, so the paths
+    are only returned the first time they are found.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> designspacePath = os.path.join(directory, "Test.designspace")
+    >>> subpathWriteFile(_testDesignspace, directory, "Test.designspace")
+    >>> [os.path.relpath(path, directory) for path in readDesignspaceSourcePaths(designspacePath)]
+    ['Light.ufo', 'Bold.ufo']
+    >>> shutil.rmtree(directory)
+    """
+    directory = os.path.dirname(os.path.abspath(designspacePath))
+    f = open(designspacePath, "rb")
+    try:
+        tree = ET.fromstring(f.read())
+    finally:
+        f.close()
+    paths = []
+    sources = tree.find("sources")
+    if sources is not None:
+        for source in sources.findall("source"):
+            fileName = source.attrib.get("filename")
+            if fileName is None:
+                continue
+            path = os.path.normpath(os.path.join(directory, fileName))
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+def _normalizeUFO(ufoPath, outputPath, onlyModified, pool, changeDetector, stateStore, trustDirectoryModTimes, glifEngine=None):
     # if the output is going to a different location,
-    # duplicate the UFO to the new place and work
-    # on the new file instead of trying to reconstruct
+    # bring the output up to date with the UFO and work
+    # on the output instead of trying to reconstruct
     # the file one piece at a time.
     if outputPath is not None:
-        duplicateUFO(ufoPath, outputPath)
+        mirrorUFO(ufoPath, outputPath)
         ufoPath = outputPath
+        # the output's directory mod times say
+        # nothing about changes in the source.
+        trustDirectoryModTimes = False
+    # the files that several steps need are
+    # only read once.
+    with UFOSession(ufoPath):
+        _normalizeUFOInSession(ufoPath, onlyModified, pool, changeDetector, stateStore, trustDirectoryModTimes, glifEngine)
+
+def _normalizeUFOInSession(ufoPath, onlyModified, pool, changeDetector, stateStore, trustDirectoryModTimes, glifEngine=None):
+    # if nothing has changed since the previous run,
+    # there is nothing to do.
+    useSummaries = not stateStore.storesStateInUFO
+    if onlyModified and useSummaries:
+        summary = stateStore.readSummary(ufoPath, "")
+        if summary is not None and summary == getUFOSummary(ufoPath, changeDetector, trustDirectoryModTimes):
+            return
     # get the UFO format version
     if not subpathExists(ufoPath, "metainfo.plist"):
         raise UFONormalizerError("Required metainfo.plist file not in %s." % ufoPath)
@@ -148,29 +517,22 @@ def normalizeUFO(ufoPath, outputPath=None, onlyModified=True):
         raise UFONormalizerError("Required formatVersion value not properly formatted in metainfo.plist in %s." % ufoPath)
     if formatVersion > 3:
         raise UFONormalizerError("Unsupported UFO format (%d) in %s." % (formatVersion, ufoPath))
-    # load the font lib
-    if not subpathExists(ufoPath, "lib.plist"):
-        fontLib = {}
-    else:
-        fontLib = subpathReadPlist(ufoPath, "lib.plist")
     # get the modification times
     if onlyModified:
-        modTimes = readModTimes(fontLib)
+        modTimes = stateStore.readModTimes(ufoPath, "", changeDetector)
     else:
-        modTimes = {}
+        modTimes = FileSignatures(changeDetector)
     # normalize layers
     if formatVersion < 3:
         if subpathExists(ufoPath, "glyphs"):
-            normalizeUFO1And2GlyphsDirectory(ufoPath, modTimes)
+            normalizeUFO1And2GlyphsDirectory(ufoPath, modTimes, pool=pool, glifEngine=glifEngine)
     else:
         availableImages = readImagesDirectory(ufoPath)
         referencedImages = set()
-        normalizeGlyphsDirectoryNames(ufoPath)
-        if subpathExists(ufoPath, "layercontents.plist"):
-            layerContents = subpathReadPlist(ufoPath, "layercontents.plist")
-            for layerName, layerDirectory in layerContents:
-                layerReferencedImages = normalizeGlyphsDirectory(ufoPath, layerDirectory, onlyModified=onlyModified)
-                referencedImages |= layerReferencedImages
+        layerContents = normalizeGlyphsDirectoryNames(ufoPath, modTimes)
+        for layerName, layerDirectory in layerContents:
+            layerReferencedImages = normalizeGlyphsDirectory(ufoPath, layerDirectory, onlyModified=onlyModified, pool=pool, changeDetector=changeDetector, stateStore=stateStore, trustDirectoryModTimes=trustDirectoryModTimes, glifEngine=glifEngine)
+            referencedImages |= layerReferencedImages
         imagesToPurge = availableImages - referencedImages
         purgeImagesDirectory(ufoPath, imagesToPurge)
     # normalize top level files
@@ -184,20 +546,32 @@ def normalizeUFO(ufoPath, outputPath=None, onlyModified=True):
     if subpathExists(ufoPath, "layercontents.plist"):
         normalizeLayerContentsPlist(ufoPath, modTimes)
     # update the mod time storage, write, normalize
-    storeModTimes(fontLib, modTimes)
-    subpathWritePlist(fontLib, ufoPath, "lib.plist")
-    if subpathExists(ufoPath, "lib.plist"):
-        normalizeLibPlist(ufoPath)
+    if stateStore.storesStateInUFO:
+        # the state is written to lib.plist so
+        # it must be normalized after storing.
+        stateStore.storeState(ufoPath, "", modTimes)
+        if subpathExists(ufoPath, "lib.plist"):
+            normalizeLibPlist(ufoPath)
+    else:
+        if subpathExists(ufoPath, "lib.plist"):
+            normalizeLibPlist(ufoPath, modTimes)
+        stateStore.storeState(ufoPath, "", modTimes)
+        stateStore.storeSummary(ufoPath, "", getUFOSummary(ufoPath, changeDetector, trustDirectoryModTimes))
+    stateStore.commit()
 
 # ------
 # Layers
 # ------
 
-def normalizeGlyphsDirectoryNames(ufoPath):
+def normalizeGlyphsDirectoryNames(ufoPath, modTimes=None):
     """
     Normalize glyphs directory names following
     UFO 3 user name to file name convention.
 
+    If modTimes shows that layercontents.plist hasn't
+    changed since it was written, the directories already
+    have normalized names and nothing is done.
+
     non-standard directory names
     -----------------------------
     >>> oldLayers = [
@@ -228,39 +602,37 @@ def normalizeGlyphsDirectoryNames(ufoPath):
     """
     # INVALID DATA POSSIBILITY: directory for layer name may not exist
     # INVALID DATA POSSIBILITY: directory may not be stored in layer contents
+    if modTimes is None:
+        modTimes = {}
+    subpath = ("layercontents.plist",)
     oldLayerMapping = OrderedDict()
-    if subpathExists(ufoPath, "layercontents.plist"):
-        layerContents = subpathReadPlist(ufoPath, "layercontents.plist")
+    if subpathExists(ufoPath, *subpath):
+        text = subpathReadFile(ufoPath, *subpath)
+        layerContents = subpathReadPlist(ufoPath, *subpath)
         for layerName, layerDirectory in layerContents:
             oldLayerMapping[layerName] = layerDirectory
+        if not subpathNeedsRefresh(modTimes, ufoPath, *subpath):
+            return list(oldLayerMapping.items())
     if not oldLayerMapping:
-        return
+        return []
     # INVALID DATA POSSIBILITY: no default layer
     # INVALID DATA POSSIBILITY: public.default used for directory other than "glyphs"
     newLayerMapping = OrderedDict()
-    newLayerDirectories = set()
+    fileNameMapper = FileNameMapper(prefix="glyphs.")
     for layerName, oldLayerDirectory in oldLayerMapping.items():
         if oldLayerDirectory == "glyphs":
             newLayerDirectory = "glyphs"
+            fileNameMapper.addFileName(newLayerDirectory)
         else:
-            newLayerDirectory = userNameToFileName(unicode(layerName), newLayerDirectories, prefix="glyphs.")
-        newLayerDirectories.add(newLayerDirectory)
+            newLayerDirectory = fileNameMapper.makeFileName(unicode(layerName))
         newLayerMapping[layerName] = newLayerDirectory
-    # don't do a direct rename because an old directory
-    # may have the same name as a new directory.
-    fromTempMapping = {}
-    for index, (layerName, newLayerDirectory) in enumerate(newLayerMapping.items()):
-        oldLayerDirectory = oldLayerMapping[layerName]
-        if newLayerDirectory == oldLayerDirectory:
-            continue
-        tempDirectory = "org.unifiedfontobject.normalizer.%d" % index
-        subpathRenameDirectory(ufoPath, oldLayerDirectory, tempDirectory)
-        fromTempMapping[tempDirectory] = newLayerDirectory
-    for tempDirectory, newLayerDirectory in fromTempMapping.items():
-        subpathRenameDirectory(ufoPath, tempDirectory, newLayerDirectory)
+    # an old directory may have the same name as a new
+    # directory so the renames are planned.
+    renames = [(oldLayerMapping[layerName], newLayerDirectory) for layerName, newLayerDirectory in newLayerMapping.items()]
+    subpathRenameMany(ufoPath, (), renames, subpathRenameDirectory)
     # update layercontents.plist
     newLayerMapping = list(newLayerMapping.items())
-    subpathWritePlist(newLayerMapping, ufoPath, "layercontents.plist")
+    _writeNormalizedPlist(modTimes, newLayerMapping, ufoPath, subpath, existing=text)
     return newLayerMapping
 
 def _test_normalizeGlyphsDirectoryNames(oldLayers, expectedLayers):
@@ -281,50 +653,131 @@ def _test_normalizeGlyphsDirectoryNames(oldLayers, expectedLayers):
 # Glyphs
 # ------
 
-def normalizeUFO1And2GlyphsDirectory(ufoPath, modTimes):
+def normalizeUFO1And2GlyphsDirectory(ufoPath, modTimes, pool=None, glifEngine=None):
     glyphMapping = normalizeGlyphNames(ufoPath, "glyphs")
+    stats = subpathScanDirectory(ufoPath, "glyphs")
+    toNormalize = []
     for fileName in sorted(glyphMapping.values()):
+        if _needsRefresh(modTimes, ufoPath, ("glyphs", fileName), stats.get(fileName)):
+            toNormalize.append(fileName)
+    changeDetector = _getChangeDetector(modTimes)
+    for fileName, imageFileName, signature in normalizeGLIFFiles(ufoPath, "glyphs", toNormalize, pool=pool, changeDetector=changeDetector, glifEngine=glifEngine):
         location = subpathJoin("glyphs", fileName)
-        if subpathNeedsRefresh(modTimes, ufoPath, location):
-            normalizeGLIF(ufoPath, "glyphs", fileName)
-            modTimes[location] = subpathGetModTime(ufoPath, "glyphs", fileName)
+        modTimes[location] = signature
 
-def normalizeGlyphsDirectory(ufoPath, layerDirectory, onlyModified=True):
-    if subpathExists(ufoPath, layerDirectory, "layerinfo.plist"):
-        layerInfo = subpathReadPlist(ufoPath, layerDirectory, "layerinfo.plist")
-        layerLib = layerInfo.get("lib", {})
-    else:
-        layerLib = {}
+def normalizeGlyphsDirectory(ufoPath, layerDirectory, onlyModified=True, pool=None, changeDetector="modTime", stateStore=None, trustDirectoryModTimes=False, glifEngine=None):
+    """
+    Normalize the GLIF files in a layer directory.
+
+    The mod times and image references are stored in the
+    layer lib so that the next run can skip unchanged files.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> ufoPath = _makeTestUFO(directory, glyphCount=5)
+    >>> _countNormalizedGLIFs(ufoPath)
+    10
+    >>> _countNormalizedGLIFs(ufoPath)
+    0
+    >>> layerInfo = subpathReadPlist(ufoPath, "glyphs", "layerinfo.plist")
+    >>> sorted(readModTimes(layerInfo["lib"]).keys()) == ["a0.glif", "a1.glif", "a2.glif", "a3.glif", "a4.glif", "contents.plist"]
+    True
+    >>> readImageReferences(layerInfo["lib"]) == {"a0.glif": "sketch.png"}
+    True
+    >>> subpathWriteFile(_testGLIF % dict(name="a3", x=1), ufoPath, "glyphs", "a3.glif")
+    >>> os.utime(subpathJoin(ufoPath, "glyphs", "a3.glif"), (0, 0))
+    >>> _countNormalizedGLIFs(ufoPath)
+    1
+
+    content hashes
+    --------------
+    >>> _countNormalizedGLIFs(ufoPath, changeDetector="contentHash")
+    10
+    >>> _countNormalizedGLIFs(ufoPath, changeDetector="contentHash")
+    0
+    >>> for fileName in os.listdir(subpathJoin(ufoPath, "glyphs")):
+    ...     os.utime(subpathJoin(ufoPath, "glyphs", fileName), (0, 0))
+    >>> _countNormalizedGLIFs(ufoPath, changeDetector="contentHash")
+    0
+    >>> subpathWriteFile(_testGLIF % dict(name="a3", x=2), ufoPath, "glyphs", "a3.glif")
+    >>> _countNormalizedGLIFs(ufoPath, changeDetector="contentHash")
+    1
+
+    rule changes
+    ------------
+    >>> normalizationRuleVersions["fontInfo"] += 1
+    >>> _countNormalizedGLIFs(ufoPath, changeDetector="contentHash")
+    0
+    >>> normalizationRuleVersions["glifOutline"] += 1
+    >>> _countNormalizedGLIFs(ufoPath, changeDetector="contentHash")
+    10
+    >>> _countNormalizedGLIFs(ufoPath, changeDetector="contentHash")
+    0
+    >>> normalizationRuleVersions["fontInfo"] -= 1
+    >>> normalizationRuleVersions["glifOutline"] -= 1
+    >>> shutil.rmtree(directory)
+    """
+    if stateStore is None:
+        stateStore = LibStateStore()
+    layerPath = subpathJoin(ufoPath, layerDirectory)
+    useSummaries = not stateStore.storesStateInUFO
     imageReferences = {}
     if onlyModified:
-        stored = readImageReferences(layerLib)
+        stored = stateStore.readImageReferences(ufoPath, layerDirectory)
+        # skip the layer if nothing in it has changed
+        if stored is not None and useSummaries:
+            summary = stateStore.readSummary(ufoPath, layerDirectory)
+            if summary is not None and summary == getDirectorySummary(layerPath, changeDetector, trustDirectoryModTimes):
+                return set(stored.values())
         if stored is not None:
             imageReferences = stored
         else:
             # we don't know what has a reference so we must check everything
             onlyModified = False
     if onlyModified:
-        modTimes = readModTimes(layerLib)
+        modTimes = stateStore.readModTimes(ufoPath, layerDirectory, changeDetector)
     else:
-        modTimes = {}
-    glyphMapping = normalizeGlyphNames(ufoPath, layerDirectory)
-    for fileName in glyphMapping.values():
-        if subpathNeedsRefresh(modTimes, ufoPath, layerDirectory, fileName):
-            imageFileName = normalizeGLIF(ufoPath, layerDirectory, fileName)
-            if imageFileName is not None:
-                imageReferences[fileName] = imageFileName
-            elif fileName in imageReferences:
-                del imageReferences[fileName]
-            modTimes[fileName] = subpathGetModTime(ufoPath, layerDirectory, fileName)
-    storeModTimes(layerLib, modTimes)
-    storeImageReferences(layerLib, imageReferences)
-    normalizeLayerInfoPlist(ufoPath, layerDirectory)
+        modTimes = FileSignatures(changeDetector)
+    glyphMapping = normalizeGlyphNames(ufoPath, layerDirectory, modTimes, stateStore)
+    # the files are checked against one listing of the
+    # directory instead of being looked up one by one.
+    stats = subpathScanDirectory(ufoPath, layerDirectory)
+    toNormalize = []
+    for fileName in sorted(glyphMapping.values()):
+        if _needsRefresh(modTimes, ufoPath, (layerDirectory, fileName), stats.get(fileName)):
+            toNormalize.append(fileName)
+    for fileName, imageFileName, signature in normalizeGLIFFiles(ufoPath, layerDirectory, toNormalize, pool=pool, changeDetector=changeDetector, glifEngine=glifEngine):
+        if imageFileName is not None:
+            imageReferences[fileName] = imageFileName
+        elif fileName in imageReferences:
+            del imageReferences[fileName]
+        modTimes[fileName] = signature
+    # forget about GLIF files that are no longer in the layer
+    fileNames = set(glyphMapping.values())
+    for fileName in list(modTimes.keys()):
+        if fileName.endswith(".glif") and fileName not in fileNames:
+            del modTimes[fileName]
+    for fileName in list(imageReferences.keys()):
+        if fileName not in fileNames:
+            del imageReferences[fileName]
+    # store the state
+    if stateStore.storesStateInUFO:
+        # the state is written to layerinfo.plist so
+        # it must be normalized after storing.
+        stateStore.storeState(ufoPath, layerDirectory, modTimes, imageReferences)
+        normalizeLayerInfoPlist(ufoPath, layerDirectory)
+    else:
+        normalizeLayerInfoPlist(ufoPath, layerDirectory, modTimes)
+        stateStore.storeState(ufoPath, layerDirectory, modTimes, imageReferences)
+        stateStore.storeSummary(ufoPath, layerDirectory, getDirectorySummary(layerPath, changeDetector, trustDirectoryModTimes))
     referencedImages = set(imageReferences.values())
     return referencedImages
 
-def normalizeLayerInfoPlist(ufoPath, layerDirectory):
+def normalizeLayerInfoPlist(ufoPath, layerDirectory, modTimes=None):
+    if modTimes is None:
+        modTimes = {}
     if subpathExists(ufoPath, layerDirectory, "layerinfo.plist"):
-        _normalizePlistFile({}, ufoPath, *[layerDirectory, "layerinfo.plist"], preprocessor=_normalizeLayerInfoColor)
+        _normalizePlistFile(modTimes, ufoPath, *[layerDirectory, "layerinfo.plist"], preprocessor=_normalizeLayerInfoColor)
 
 def _normalizeLayerInfoColor(obj):
     """
@@ -346,11 +799,15 @@ def _normalizeLayerInfoColor(obj):
         if color is not None:
             obj["color"] = color
 
-def normalizeGlyphNames(ufoPath, layerDirectory):
+def normalizeGlyphNames(ufoPath, layerDirectory, modTimes=None, stateStore=None):
     """
     Normalize GLIF file names following
     UFO 3 user name to file name convention.
 
+    If modTimes shows that contents.plist hasn't changed
+    since it was written, the files already have normalized
+    names and nothing is done.
+
     non-standard file names
     -----------------------
     >>> oldNames = {
@@ -376,37 +833,169 @@ def normalizeGlyphNames(ufoPath, layerDirectory):
     ... }
     >>> _test_normalizeGlyphNames(oldNames, expectedNames)
     True
+
+    unchanged contents.plist
+    ------------------------
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> ufoPath = _makeTestUFO(directory, glyphCount=5)
+    >>> _countCalls("planRenames", ufoPath)
+    3
+    >>> _countCalls("planRenames", ufoPath)
+    0
+    >>> _countCalls("planRenames", ufoPath, changeDetector="contentHash")
+    3
+    >>> _countCalls("planRenames", ufoPath, changeDetector="contentHash")
+    0
+    >>> subpathWritePlist({"a0" : "a0.glif", "B" : "a1.glif"}, ufoPath, "glyphs", "contents.plist")
+    >>> _countCalls("planRenames", ufoPath, changeDetector="contentHash")
+    1
+    >>> subpathReadPlist(ufoPath, "glyphs", "contents.plist") == {"B": "B_.glif", "a0": "a0.glif"}
+    True
+    >>> shutil.rmtree(directory)
     """
     # INVALID DATA POSSIBILITY: no contents.plist
     # INVALID DATA POSSIBILITY: file for glyph name may not exist
     # INVALID DATA POSSIBILITY: file for glyph may not be stored in contents
-    if not subpathExists(ufoPath, layerDirectory, "contents.plist"):
+    if modTimes is None:
+        modTimes = {}
+    subpath = (layerDirectory, "contents.plist")
+    if not subpathExists(ufoPath, *subpath):
         return {}
-    oldGlyphMapping = subpathReadPlist(ufoPath, layerDirectory, "contents.plist")
-    newGlyphMapping = {}
-    newFileNames = set()
-    for glyphName in sorted(oldGlyphMapping.keys()):
-        newFileName = userNameToFileName(unicode(glyphName), newFileNames, suffix=".glif")
-        newFileNames.add(newFileName)
-        newGlyphMapping[glyphName] = newFileName
-    # don't do a direct rewrite in case an old file has
-    # the same name as a new file.
-    fromTempMapping = {}
-    for index, (glyphName, newFileName) in enumerate(sorted(newGlyphMapping.items())):
-        oldFileName = oldGlyphMapping[glyphName]
-        if newFileName == oldFileName:
-            continue
-        tempFileName = "org.unifiedfontobject.normalizer.%d" % index
-        subpathRenameFile(ufoPath, (layerDirectory, oldFileName), (layerDirectory, tempFileName))
-        fromTempMapping[tempFileName] = newFileName
-    for tempFileName, newFileName in fromTempMapping.items():
-        subpathRenameFile(ufoPath, (layerDirectory, tempFileName), (layerDirectory, newFileName))
+    text = subpathReadFile(ufoPath, *subpath)
+    oldGlyphMapping = subpathReadPlist(ufoPath, *subpath)
+    if not subpathNeedsRefresh(modTimes, ufoPath, *subpath):
+        return oldGlyphMapping
+    newGlyphMapping = getGlyphFileNames(oldGlyphMapping.keys(), stateStore, ufoPath, layerDirectory)
+    # an old file may have the same name as a
+    # new file so the renames are planned.
+    renames = [(oldGlyphMapping[glyphName], newFileName) for glyphName, newFileName in sorted(newGlyphMapping.items())]
+    subpathRenameMany(ufoPath, (layerDirectory,), renames)
     # update contents.plist
-    subpathWritePlist(newGlyphMapping, ufoPath, layerDirectory, "contents.plist")
-    # normalize contents.plist
-    _normalizePlistFile({}, ufoPath, layerDirectory, "contents.plist")
+    _writeNormalizedPlist(modTimes, newGlyphMapping, ufoPath, subpath, existing=text)
     return newGlyphMapping
 
+# The file names of the most recently used glyph sets.
+# Masters and layers often have the same glyphs, so
+# their file names only need to be made once. Each
+# glyph set's file names are also kept in the state
+# store, if it can hold them, for the next run.
+glyphFileNameCacheSize = 4
+_glyphFileNameCache = OrderedDict()
+_glyphFileNameCacheLock = threading.Lock()
+
+def getGlyphFileNames(glyphNames, stateStore=None, ufoPath=None, layerDirectory=None):
+    """
+    Get a dict of glyph names to GLIF file names following
+    the UFO 3 user name to file name convention.
+
+    >>> getGlyphFileNames(["a", "A", "A_"]) == {"A": "A_.glif", "A_": "A__.glif", "a": "a.glif"}
+    True
+    >>> getGlyphFileNames(["a", "A_", "A"]) == getGlyphFileNames(["A", "A_", "a"])
+    True
+
+    Names that only differ by case are given different file names.
+
+    >>> getGlyphFileNames(["A", "A*", "A|", "a_"]) == {"A": "A_.glif", "A*": "A__.glif", "A|": "A__000000000000001.glif", "a_": "a_000000000000001.glif"}
+    True
+
+    stored file names
+    -----------------
+    If a state store is given, the file names are read from
+    it when they have been made for the same glyph set before.
+    Otherwise, if the file names that were last made for the
+    layer had no clashes, only the file names of the glyphs
+    that have been added to the layer are made.
+
+    >>> stateStore = SQLiteStateStore(":memory:")
+    >>> glyphNames = ["a%d" % i for i in range(100)]
+    >>> _countCallsTo("_filterUserName", getGlyphFileNames, glyphNames, stateStore, "Light.ufo", "glyphs")
+    100
+    >>> _glyphFileNameCache.clear()
+    >>> _countCallsTo("_filterUserName", getGlyphFileNames, glyphNames, stateStore, "Bold.ufo", "glyphs")
+    0
+    >>> _glyphFileNameCache.clear()
+    >>> _countCallsTo("_filterUserName", getGlyphFileNames, glyphNames[1:] + ["b"], stateStore, "Bold.ufo", "glyphs")
+    1
+    >>> _glyphFileNameCache.clear()
+    >>> expected = getGlyphFileNames(glyphNames + ["A*", "A|"])
+    >>> _glyphFileNameCache.clear()
+    >>> getGlyphFileNames(glyphNames + ["A*", "A|"], stateStore, "Light.ufo", "glyphs") == expected
+    True
+
+    The file names that were last made for the layer are not
+    used if they were made with another version of the rules.
+
+    >>> oldVersion = normalizationRuleVersions["fileNames"] - 1
+    >>> oldFileNames = dict((glyphName, "old" + glyphName + ".glif") for glyphName in glyphNames)
+    >>> stateStore.storeFileNames("Old.ufo", "glyphs", "old", oldVersion, oldFileNames, True)
+    >>> _glyphFileNameCache.clear()
+    >>> expected = getGlyphFileNames(glyphNames[1:])
+    >>> _glyphFileNameCache.clear()
+    >>> getGlyphFileNames(glyphNames[1:], stateStore, "Old.ufo", "glyphs") == expected
+    True
+    >>> stateStore.close()
+    """
+    glyphNames = sorted(glyphNames)
+    key = _getGlyphSetKey(glyphNames)
+    with _glyphFileNameCacheLock:
+        cached = _glyphFileNameCache.pop(key, None)
+    if cached is None and stateStore is not None:
+        cached = stateStore.readFileNames(key)
+        if cached is None:
+            previousKey = stateStore.readFileNamesKey(ufoPath, layerDirectory, normalizationRuleVersions["fileNames"])
+            if previousKey is not None:
+                with _glyphFileNameCacheLock:
+                    previous = _glyphFileNameCache.get(previousKey)
+                if previous is None:
+                    previous = stateStore.readFileNames(previousKey)
+                if previous is not None and previous[1]:
+                    glyphFileNames = _updateGlyphFileNames(previous[0], glyphNames)
+                    if glyphFileNames is not None:
+                        cached = (glyphFileNames, True)
+    if cached is None:
+        glyphFileNames = {}
+        fileNameMapper = FileNameMapper(suffix=".glif")
+        for glyphName in glyphNames:
+            glyphFileNames[glyphName] = fileNameMapper.makeFileName(unicode(glyphName))
+        cached = (glyphFileNames, not fileNameMapper.clashCount)
+    with _glyphFileNameCacheLock:
+        _glyphFileNameCache[key] = cached
+        while len(_glyphFileNameCache) > glyphFileNameCacheSize:
+            _glyphFileNameCache.popitem(last=False)
+    if stateStore is not None:
+        glyphFileNames, isClashFree = cached
+        stateStore.storeFileNames(ufoPath, layerDirectory, key, normalizationRuleVersions["fileNames"], glyphFileNames, isClashFree)
+    return dict(cached[0])
+
+def _getGlyphSetKey(glyphNames):
+    # the names are sorted. the key includes the version
+    # of the rules that the file names are made with.
+    data = tobytes("%d\0" % normalizationRuleVersions["fileNames"] + "\0".join(glyphNames), "utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+def _updateGlyphFileNames(previous, glyphNames):
+    # make the file names for glyphNames from the file names
+    # of another glyph set that had no clashes. if none of
+    # the added glyphs clash, each glyph gets the file name
+    # that it would get on its own no matter the order that
+    # the glyphs are named in. otherwise None is returned.
+    added = [glyphName for glyphName in glyphNames if glyphName not in previous]
+    if len(added) > len(glyphNames) // 2:
+        return None
+    if len(glyphNames) - len(added) == len(previous):
+        glyphFileNames = dict(previous)
+    else:
+        glyphFileNames = dict((glyphName, previous[glyphName]) for glyphName in glyphNames if glyphName in previous)
+    fileNames = set(fileName.lower() for fileName in glyphFileNames.values())
+    for glyphName in added:
+        fileName = _filterUserName(unicode(glyphName), "", ".glif") + ".glif"
+        if fileName.lower() in fileNames:
+            return None
+        fileNames.add(fileName.lower())
+        glyphFileNames[glyphName] = fileName
+    return glyphFileNames
+
 def _test_normalizeGlyphNames(oldGlyphMapping, expectedGlyphMapping):
     import tempfile
     directory = tempfile.mkdtemp()
@@ -437,17 +1026,47 @@ def _test_normalizeGlyphNames(oldGlyphMapping, expectedGlyphMapping):
 def _normalizePlistFile(modTimes, ufoPath, *subpath, **kwargs):
     if subpathNeedsRefresh(modTimes, ufoPath, *subpath):
         preprocessor = kwargs.get("preprocessor")
-        data = subpathReadPlist(ufoPath, *subpath)
-        if data:
-            text = normalizePropertyList(data, preprocessor=preprocessor)
-            subpathWriteFile(text, ufoPath, *subpath)
-            modTimes[subpath[-1]] = subpathGetModTime(ufoPath, *subpath)
+        path = subpathJoin(ufoPath, *subpath)
+        # the normalized data if it is kept in memory
+        normalized = None
+        streamed = False
+        if preprocessor is None and os.path.getsize(path) >= plistStreamingThreshold:
+            try:
+                hasData = _normalizePlistStreaming(path)
+                streamed = True
+            except _PlistStreamingError:
+                pass
+            _invalidateUFOSession(path)
+        if not streamed:
+            text = subpathReadFile(ufoPath, *subpath)
+            data = subpathReadPlist(ufoPath, *subpath)
+            hasData = bool(data)
+            if hasData:
+                normalized = _normalizePropertyListToBytes(data, preprocessor=preprocessor)
+                subpathWriteFile(normalized, ufoPath, *subpath, existing=text)
+        if hasData:
+            changeDetector = _getChangeDetector(modTimes)
+            modTimes[subpath[-1]] = _getSignature(changeDetector, ufoPath, subpath, data=normalized)
         # Don't write empty plist files.
         else:
             subpathRemoveFile(ufoPath, *subpath)
             if subpath[-1] in modTimes:
                 del modTimes[subpath[-1]]
 
+def _writeNormalizedPlist(modTimes, data, ufoPath, subpath, existing=None):
+    # write data that has already been normalized, like
+    # _normalizePlistFile would, and store its signature.
+    if data:
+        normalized = _normalizePropertyListToBytes(data)
+        subpathWriteFile(normalized, ufoPath, *subpath, existing=existing)
+        changeDetector = _getChangeDetector(modTimes)
+        modTimes[subpath[-1]] = _getSignature(changeDetector, ufoPath, subpath, data=normalized)
+    # Don't write empty plist files.
+    else:
+        subpathRemoveFile(ufoPath, *subpath)
+        if subpath[-1] in modTimes:
+            del modTimes[subpath[-1]]
+
 # metainfo.plist
 
 def normalizeMetaInfoPlist(ufoPath, modTimes):
@@ -686,8 +1305,10 @@ def normalizeLayerContentsPlist(ufoPath, modTimes):
 
 # lib.plist
 
-def normalizeLibPlist(ufoPath):
-    _normalizePlistFile({}, ufoPath, "lib.plist")
+def normalizeLibPlist(ufoPath, modTimes=None):
+    if modTimes is None:
+        modTimes = {}
+    _normalizePlistFile(modTimes, ufoPath, "lib.plist")
 
 # -----------------
 # XML Normalization
@@ -696,20 +1317,303 @@ def normalizeLibPlist(ufoPath):
 # Property List
 
 def normalizePropertyList(data, preprocessor=None):
+    return _writePropertyList(data, preprocessor).getText()
+
+def _normalizePropertyListToBytes(data, preprocessor=None):
+    return _writePropertyList(data, preprocessor).getBytes()
+
+def _writePropertyList(data, preprocessor):
     if preprocessor is not None:
         preprocessor(data)
     writer = XMLWriter(isPropertyList=True)
     writer.beginElement("plist", attrs=dict(version="1.0"))
     writer.propertyListObject(data)
     writer.endElement("plist")
-    return writer.getText()
+    return writer
+
+# Property List streaming
+
+# Property list files at least this many bytes are
+# normalized while they are parsed instead of being
+# read into memory.
+plistStreamingThreshold = 4 * 1024 * 1024
+
+# The normalized entries of a dict are held in memory up to
+# this many bytes and in a temporary file after that.
+plistStreamingSpoolSize = 1024 * 1024
+
+# The most dict entries that are sorted in memory. Bigger
+# dicts are sorted in runs that are merged when they end.
+plistStreamingRunLength = 100000
+
+class _PlistStreamingError(Exception): pass
+
+def _normalizePlistStreaming(path, runLength=None):
+    r"""
+    Normalize a property list file with ET.iterparse. Array
+    values are written as soon as they have been parsed. Dict
+    entries are written to a spool and copied out in key order
+    when the dict ends. The output is the same as the output
+    of normalizePropertyList and the file is only rewritten
+    when it has changed. False is returned if the file has no
+    data. _PlistStreamingError is raised, before anything is
+    written, if the file has a structure that is left to the
+    in-memory reader.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> data = dict(
+    ...     b=[1, 2.5, "x&y", [], {}, PlistData(b"abc")],
+    ...     a=dict(("k%d" % i, dict(z=i, y=[i, None])) for i in range(20)),
+    ...     c="",
+    ... )
+    >>> expected = _normalizePropertyListToBytes(data)
+    >>> subpathWriteFile(expected.replace(b"\\t", b"").replace(b"\\n", b""), directory, "a.plist")
+    >>> _normalizePlistStreaming(subpathJoin(directory, "a.plist"), runLength=3)
+    True
+    >>> subpathReadFile(directory, "a.plist") == expected
+    True
+    >>> os.utime(subpathJoin(directory, "a.plist"), (0, 0))
+    >>> _normalizePlistStreaming(subpathJoin(directory, "a.plist"))
+    True
+    >>> subpathGetModTime(directory, "a.plist")
+    0.0
+
+    The last value of a repeated key is used.
+
+    >>> subpathWriteFile(b'<plist><dict><key>a</key><integer>1</integer><key>b</key><true/><key>a</key><integer>2</integer></dict></plist>', directory, "a.plist")
+    >>> _normalizePlistStreaming(subpathJoin(directory, "a.plist"))
+    True
+    >>> subpathReadPlist(directory, "a.plist") == {"a": 2, "b": True}
+    True
+
+    >>> subpathWriteFile(b'<plist version="1.0"><dict/></plist>', directory, "a.plist")
+    >>> _normalizePlistStreaming(subpathJoin(directory, "a.plist"))
+    False
+    >>> subpathWriteFile(b'<plist version="1.0"><dict><string>a</string></dict></plist>', directory, "a.plist")
+    >>> _normalizePlistStreaming(subpathJoin(directory, "a.plist"))
+    Traceback (most recent call last):
+        ...
+    _PlistStreamingError
+    >>> shutil.rmtree(directory)
+    """
+    import tempfile
+    if runLength is None:
+        runLength = plistStreamingRunLength
+    f = open(path, "rb")
+    output = tempfile.SpooledTemporaryFile(max_size=plistStreamingSpoolSize)
+    try:
+        reader = _HashingReader(f)
+        writer = XMLWriter(isPropertyList=True, stream=output)
+        writer.beginElement("plist", attrs=dict(version="1.0"))
+        writer.flush()
+        plistElement = None
+        hasData = False
+        # the open dicts and arrays
+        containers = []
+        depth = 0
+        for event, element in ET.iterparse(reader, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    if element.tag != "plist":
+                        raise _PlistStreamingError
+                    plistElement = element
+                elif depth != len(containers) + 2:
+                    # an element in a value
+                    raise _PlistStreamingError
+                elif depth == 2:
+                    # like the in-memory reader, only dicts and
+                    # arrays are handled and only the first object
+                    # is used. anything else is rare and small.
+                    if plistElement is None or len(plistElement) > 1 or element.tag not in ("dict", "array"):
+                        raise _PlistStreamingError
+                    containers.append(_PlistStreamingContainer(element, output, 1, runLength))
+                else:
+                    parent = containers[-1]
+                    parent.beginValue(element)
+                    if element.tag in ("dict", "array"):
+                        containers.append(_PlistStreamingContainer(element, parent.valueStream, depth - 1, runLength))
+                continue
+            if depth == 2:
+                container = containers.pop()
+                hasData = container.end()
+                element.clear()
+                plistElement.remove(element)
+            elif depth > 2:
+                if element is containers[-1].element:
+                    containers.pop().end()
+                containers[-1].endValue(element)
+            depth -= 1
+        if not hasData:
+            return False
+        writer.endElement("plist")
+        writer.flush()
+        # compare with the input
+        outputHash = hashlib.sha1()
+        outputLength = 0
+        for chunk in _iterSpool(output):
+            outputHash.update(chunk)
+            outputLength += len(chunk)
+        if (outputLength, outputHash.digest()) != (reader.length, reader.hash.digest()):
+            f.close()
+            _writeFileAtomically(path, _iterSpool(output))
+    finally:
+        f.close()
+        output.close()
+        for container in containers:
+            container.close()
+    return True
+
+def _makePlistStreamingWriter(stream, indentLevel):
+    writer = XMLWriter(declaration=None, indentLevel=indentLevel, stream=stream)
+    # every line follows a line that was written by another writer
+    writer._lineCount = 1
+    return writer
+
+class _PlistStreamingContainer(object):
+
+    """
+    A dict or array that is being normalized by
+    _normalizePlistStreaming. Its lines are written
+    to stream at indentLevel. A dict sorts up to
+    runLength entries in memory at a time.
+    """
+
+    def __init__(self, element, stream, indentLevel, runLength):
+        import tempfile
+        self.element = element
+        self.isDict = element.tag == "dict"
+        self.stream = stream
+        self.writer = _makePlistStreamingWriter(stream, indentLevel)
+        self.writer.raw("<%s>" % element.tag)
+        self.writer.flush()
+        self.count = 0
+        if self.isDict:
+            # (key, count, offset, length) for each entry in the spool
+            self.entries = []
+            self.runs = []
+            self.runLength = runLength
+            self.key = None
+            self.entryOffset = 0
+            self.spool = tempfile.SpooledTemporaryFile(max_size=plistStreamingSpoolSize)
+            self.valueStream = self.spool
+        else:
+            self.spool = None
+            self.valueStream = stream
+        self.valueWriter = _makePlistStreamingWriter(self.valueStream, indentLevel + 1)
+
+    def beginValue(self, element):
+        if self.isDict:
+            if element.tag == "key":
+                return
+            if self.key is None:
+                raise _PlistStreamingError
+            self.valueWriter.simpleElement("key", value=xmlEscapeText(self.key))
+        if element.tag in ("dict", "array"):
+            # the dict or array writes to the value stream itself
+            self.valueWriter.flush()
+
+    def endValue(self, element):
+        # INVALID DATA POSSIBILITY: invalid value string
+        tag = element.tag
+        if self.isDict and tag == "key":
+            self.key = element.text or ""
+        else:
+            if tag not in ("dict", "array"):
+                self.valueWriter.propertyListObject(_convertPlistValue(tag, element.text or ""))
+                self.valueWriter.flush()
+            if self.isDict:
+                offset = self.spool.tell()
+                self.entries.append((self.key, self.count, self.entryOffset, offset - self.entryOffset))
+                self.entryOffset = offset
+                if len(self.entries) >= self.runLength:
+                    self._writeRun()
+            self.count += 1
+        element.clear()
+        self.element.remove(element)
+
+    def _writeRun(self):
+        import tempfile
+        self.entries.sort()
+        run = tempfile.TemporaryFile()
+        for i in range(0, len(self.entries), 1024):
+            marshal.dump(self.entries[i:i + 1024], run)
+        run.seek(0)
+        self.runs.append(run)
+        del self.entries[:]
+
+    def _iterEntries(self):
+        # sort the entries and keep the last
+        # entry for each key.
+        if self.runs:
+            self._writeRun()
+            entries = heapq.merge(*[_iterPlistStreamingRun(run) for run in self.runs])
+        else:
+            self.entries.sort()
+            entries = self.entries
+        previous = None
+        for entry in entries:
+            if previous is not None and previous[0] != entry[0]:
+                yield previous
+            previous = entry
+        if previous is not None:
+            yield previous
+
+    def end(self):
+        # returns True if the container has any values.
+        if self.isDict:
+            self.valueWriter.flush()
+            for key, count, offset, length in self._iterEntries():
+                self.spool.seek(offset)
+                while length:
+                    chunk = self.spool.read(min(length, 65536))
+                    self.stream.write(chunk)
+                    length -= len(chunk)
+        self.writer.raw("</%s>" % self.element.tag)
+        self.writer.flush()
+        self.close()
+        return self.count > 0
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+        if self.isDict:
+            for run in self.runs:
+                run.close()
+
+def _iterPlistStreamingRun(run):
+    while True:
+        try:
+            entries = marshal.load(run)
+        except EOFError:
+            break
+        for entry in entries:
+            yield entry
 
 # GLIF
 
-def normalizeGLIF(ufoPath, *subpath):
+def normalizeGLIF(ufoPath, *subpath, **kwargs):
     """
     - Normalize the mark color if specified.
 
+    The engine keyword argument selects how the file is
+    processed. "tree" parses the whole file before writing.
+    "streaming" processes the outline one contour at a time
+    so that memory use doesn't grow with the point count.
+    "expat" writes the outline directly from parser events
+    without building elements or dicts for the points.
+    "numpy" works like "expat" but converts all of the
+    coordinates together, with NumPy if it is installed. All
+    engines produce the same output.
+    By default files smaller than glifStreamingThreshold
+    bytes use "expat" and larger files use "streaming".
+    "numpy" is only faster than "expat" for glyphs with a
+    few thousand points or less, and only when NumPy is
+    installed. It is slower for glyphs with tens of
+    thousands of points and it keeps whole files in memory,
+    so it is never selected by default.
+
     TO DO: need doctests
     The best way to test this is going to be have a GLIF
     that contains all of the element types. This can be
@@ -798,17 +1702,19 @@ def normalizeGLIF(ufoPath, *subpath):
 
     formats 1 & 2
     -------------
-    >>> glifFolderPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'glif')
+    >>> glifFolderPath = os.path.join(_testDataDirectory, 'glif')
+    >>> previousDirectory = os.getcwd()
     >>> os.chdir(glifFolderPath)
     >>> for i in [1, 2]:
     ...     glifFileName = 'format%s.glif' % i
-    ...     normalizeGLIF(glifFolderPath, glifFileName)
+    ...     imageFileName = normalizeGLIF(glifFolderPath, glifFileName)
     ...     glifFile = open(glifFileName, 'r')
     ...     glifFileData = glifFile.read()
     ...     glifFile.close()
     ...     glifFileData == glifFormat[i]
     True
-    'period sketch.png'
+    True
+    >>> imageFileName == 'period sketch.png'
     True
 
     no format
@@ -818,11 +1724,42 @@ def normalizeGLIF(ufoPath, *subpath):
     Traceback (most recent call last):
         ...
     UFONormalizerError: Undefined GLIF format: ...formatNone.glif
+    >>> os.chdir(previousDirectory)
     """
+    imageFileName, data = _normalizeGLIFFile(ufoPath, subpath, kwargs.get("engine"))
+    return imageFileName
+
+glifEngines = ("tree", "streaming", "expat", "numpy")
+
+# GLIF files at least this many bytes are normalized with
+# the streaming engine unless an engine is specified.
+glifStreamingThreshold = 4 * 1024 * 1024
+
+def _normalizeGLIFFile(ufoPath, subpath, engine=None):
+    # this returns the image reference and the normalized
+    # data so that a content hash can be made without
+    # reading the file again. the data is None if the
+    # engine didn't keep it in memory.
+    glifPath = subpathJoin(ufoPath, *subpath)
+    f = open(glifPath, "rb")
+    try:
+        if engine is None:
+            engine = "expat"
+            if os.fstat(f.fileno()).st_size >= glifStreamingThreshold:
+                engine = "streaming"
+        if engine == "streaming":
+            return _normalizeGLIFStreaming(f, glifPath)
+        elif engine not in glifEngines:
+            raise UFONormalizerError("Unknown GLIF engine: %s" % engine)
+        text = f.read()
+    finally:
+        f.close()
+    if engine in ("expat", "numpy"):
+        data, imageFileName = _normalizeGLIFExpat(text, glifPath, vectorized=engine == "numpy")
+        subpathWriteFile(data, ufoPath, *subpath, existing=text)
+        return imageFileName, data
     # INVALID DATA POSSIBILITY: format version that can't be converted to int
     # read and parse
-    glifPath = subpathJoin(ufoPath, *subpath)
-    text = subpathReadFile(ufoPath, *subpath)
     tree = ET.fromstring(text)
     glifVersion = tree.attrib.get("format")
     if glifVersion is None:
@@ -885,85 +1822,706 @@ def normalizeGLIF(ufoPath, *subpath):
         _normalizeGlifNote(note, writer)
     writer.endElement("glyph")
     # write to the file
-    text = writer.getText()
-    subpathWriteFile(text, ufoPath, *subpath)
+    data = writer.getBytes()
+    subpathWriteFile(data, ufoPath, *subpath, existing=text)
     # return the image reference
-    return imageFileName
-
-def _normalizeGlifUnicode(element, writer):
-    """
-    - Don't write unicode element if hex attribute is not defined.
-    - Don't write unicode element if value for hex value is not a proper hex value.
-    - Write hex value as all uppercase, zero padded string.
+    return imageFileName, data
 
-    without hex
-    -----------
-    >>> element = ET.fromstring("<unicode />")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u''
-    True
-
-    >>> element = ET.fromstring("<unicode hex=''/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u''
-    True
-
-    >>> element = ET.fromstring("<unicode hexagon=''/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u''
-    True
-
-    >>> element = ET.fromstring("<unicode hex='xyz'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u''
-    True
+# streaming
 
-    with hex
-    --------
-    >>> element = ET.fromstring("<unicode hex='0041'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u'<unicode hex="0041"/>'
-    True
+# The normalized outline is held in memory up to this many
+# bytes and in a temporary file after that.
+glifStreamingSpoolSize = 1024 * 1024
 
-    >>> element = ET.fromstring("<unicode hex='41'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u'<unicode hex="0041"/>'
-    True
+# This is never in normalized output because XML can't contain it.
+_glifOutlineMarker = "\t\t\0"
 
-    >>> element = ET.fromstring("<unicode hex='ea'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u'<unicode hex="00EA"/>'
+def _normalizeGLIFStreaming(f, glifPath):
+    r"""
+    Normalize an open GLIF file with ET.iterparse. Each
+    contour and component is normalized and written to a
+    spool as soon as it has been parsed and then removed
+    from the tree. The other top level elements are small,
+    so they are kept until the end and written the same
+    way that the tree engine writes them. The input and
+    output are compared by hash so that the file is only
+    rewritten when it has changed.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> glifFolderPath = os.path.join(_testDataDirectory, 'glif')
+    >>> for fileName in ("format1.glif", "format2.glif"):
+    ...     text = _testUnnormalizeGLIF(subpathReadFile(glifFolderPath, fileName))
+    ...     for engine in glifEngines:
+    ...         subpathWriteFile(text, directory, engine + fileName)
+    ...         imageFileName = normalizeGLIF(directory, engine + fileName, engine=engine)
+    ...     subpathReadFile(directory, "streaming" + fileName) == subpathReadFile(directory, "tree" + fileName)
+    ...     subpathReadFile(directory, "streaming" + fileName) == subpathReadFile(glifFolderPath, fileName)
     True
-
-    >>> element = ET.fromstring("<unicode hex='2Af'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u'<unicode hex="02AF"/>'
     True
-
-    >>> element = ET.fromstring("<unicode hex='0000fFfF'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u'<unicode hex="FFFF"/>'
     True
-
-    >>> element = ET.fromstring("<unicode hex='10000'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u'<unicode hex="10000"/>'
     True
-
-    >>> element = ET.fromstring("<unicode hex='abcde'/>")
-    >>> writer = XMLWriter(declaration=None)
-    >>> _normalizeGlifUnicode(element, writer)
-    >>> writer.getText() == u'<unicode hex="ABCDE"/>'
+    >>> subpathWriteFile(_testGLIF % dict(name="a", x=1) + "\n", directory, "a.glif")
+    >>> imageFileName, data = _normalizeGLIFFile(directory, ("a.glif",), "streaming")
+    >>> data is None
+    True
+    >>> modTime = subpathGetModTime(directory, "a.glif")
+    >>> os.utime(subpathJoin(directory, "a.glif"), (0, 0))
+    >>> imageFileName, data = _normalizeGLIFFile(directory, ("a.glif",), "streaming")
+    >>> subpathGetModTime(directory, "a.glif")
+    0.0
+    >>> normalizeGLIF(directory, "a.glif", engine="dom")
+    Traceback (most recent call last):
+        ...
+    UFONormalizerError: Unknown GLIF engine: dom
+    >>> shutil.rmtree(directory)
+    """
+    import tempfile
+    reader = _HashingReader(f)
+    spool = tempfile.SpooledTemporaryFile(max_size=glifStreamingSpoolSize)
+    try:
+        glifVersion = None
+        name = None
+        # the top-level elements other than the outline
+        elements = []
+        hasOutline = False
+        # the outline state
+        outlineElement = None
+        outlineIsEmpty = True
+        impliedAnchors = []
+        depth = 0
+        for event, element in ET.iterparse(reader, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    # INVALID DATA POSSIBILITY: format version that can't be converted to int
+                    glifVersion = element.attrib.get("format")
+                    if glifVersion is None:
+                        raise UFONormalizerError("Undefined GLIF format: %s" % glifPath)
+                    glifVersion = int(glifVersion)
+                    name = element.attrib.get("name")
+                elif depth == 2 and element.tag == "outline":
+                    # like the tree engine, only the last outline is used
+                    outlineElement = element
+                    outlineIsEmpty = True
+                    impliedAnchors = []
+                    spool.seek(0)
+                    spool.truncate()
+                continue
+            if depth == 3 and outlineElement is not None:
+                obj = None
+                if element.tag == "contour":
+                    if glifVersion == 1:
+                        obj = _normalizeGlifContourFormat1(element)
+                    else:
+                        obj = _normalizeGlifContourFormat2(element)
+                elif element.tag == "component":
+                    if glifVersion == 1:
+                        obj = _normalizeGlifComponentFormat1(element)
+                    else:
+                        obj = _normalizeGlifComponentFormat2(element)
+                if obj is not None:
+                    if obj.tag == "anchor":
+                        impliedAnchors.append(obj)
+                    else:
+                        _spoolGlifOutlineObjects(spool, [obj], _writeGlifOutlineObject, outlineIsEmpty)
+                        outlineIsEmpty = False
+                # the contour's points are no longer needed
+                element.clear()
+                outlineElement.remove(element)
+            elif depth == 2:
+                tag = element.tag
+                if tag == "outline":
+                    if impliedAnchors:
+                        _spoolGlifOutlineObjects(spool, impliedAnchors, _writeGlifImpliedAnchor, outlineIsEmpty)
+                        outlineIsEmpty = False
+                    hasOutline = not outlineIsEmpty
+                    outlineElement = None
+                else:
+                    elements.append(element)
+            depth -= 1
+        text, imageFileName = _writeGLIFWithOutlineMarker(glifVersion, name, elements, hasOutline)
+        parts = text.split(tobytes(_glifOutlineMarker), 1)
+        # compare with the input
+        outputHash = hashlib.sha1()
+        outputLength = 0
+        for chunk in _iterGlifOutput(parts, spool):
+            outputHash.update(chunk)
+            outputLength += len(chunk)
+        if (outputLength, outputHash.digest()) != (reader.length, reader.hash.digest()):
+            # the file can't be replaced while it is open on Windows
+            f.close()
+            _writeFileAtomically(glifPath, _iterGlifOutput(parts, spool))
+    finally:
+        spool.close()
+    return imageFileName, None
+
+def _writeGLIFWithOutlineMarker(glifVersion, name, elements, hasOutline):
+    # write the top level elements other than the outline
+    # the same way that the tree engine does. if there is an
+    # outline, a marker is written where it belongs. the
+    # encoded text and the image reference are returned.
+    advance = None
+    unicodes = []
+    note = None
+    image = None
+    guidelines = []
+    anchors = []
+    lib = None
+    for element in elements:
+        tag = element.tag
+        if tag == "advance":
+            advance = element
+        elif tag == "unicode":
+            unicodes.append(element)
+        elif tag == "note":
+            note = element
+        elif tag == "image":
+            image = element
+        elif tag == "guideline":
+            guidelines.append(element)
+        elif tag == "anchor":
+            anchors.append(element)
+        elif tag == "lib":
+            lib = element
+    imageFileName = None
+    writer = XMLWriter()
+    writer.beginElement("glyph", attrs=dict(name=name, format=glifVersion))
+    for uni in unicodes:
+        _normalizeGlifUnicode(uni, writer)
+    if advance is not None:
+        _normalizeGlifAdvance(advance, writer)
+    if glifVersion >= 2 and image is not None:
+        imageFileName = image.attrib.get("fileName")
+        _normalizeGlifImage(image, writer)
+    if hasOutline:
+        writer.beginElement("outline")
+        writer.raw("\0")
+        writer.endElement("outline")
+    if glifVersion >= 2:
+        for anchor in anchors:
+            _normalizeGlifAnchor(anchor, writer)
+    if glifVersion >= 2:
+        for guideline in guidelines:
+            _normalizeGlifGuideline(guideline, writer)
+    if lib is not None:
+        _normalizeGlifLib(lib, writer)
+    if note is not None:
+        _normalizeGlifNote(note, writer)
+    writer.endElement("glyph")
+    return writer.getBytes(), imageFileName
+
+def _spoolGlifOutlineObjects(spool, objects, function, isFirst):
+    if not isFirst:
+        spool.write(tobytes(xmlLineBreak))
+    # indent to the outline's level
+    writer = XMLWriter(declaration=None, indentLevel=2, stream=spool)
+    for obj in objects:
+        function(obj, writer)
+    writer.flush()
+
+def _iterGlifOutput(parts, spool):
+    yield parts[0]
+    if len(parts) > 1:
+        for chunk in _iterSpool(spool):
+            yield chunk
+        yield parts[1]
+
+def _iterSpool(spool):
+    spool.seek(0)
+    while True:
+        chunk = spool.read(65536)
+        if not chunk:
+            break
+        yield chunk
+
+class _HashingReader(object):
+
+    """
+    A file wrapper that hashes and counts the bytes read.
+    """
+
+    def __init__(self, f):
+        self._file = f
+        self.hash = hashlib.sha1()
+        self.length = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.hash.update(data)
+        self.length += len(data)
+        return data
+
+# expat
+
+# the point attributes in xmlAttributeOrder order
+_glifPointAttributeOrder = ("name", "x", "y", "type", "smooth", "identifier")
+_glifPointTypes = ("move", "line", "curve", "qcurve", "offcurve")
+
+def _normalizeGLIFExpat(text, glifPath, vectorized=False):
+    r"""
+    Normalize GLIF data with callbacks from an expat parser.
+    The points are checked and written as they are parsed.
+    Components and the top level elements other than the
+    outline are rare or small, so elements are built for
+    them and the tree engine's functions are used.
+    If vectorized is True, the coordinates are converted
+    together after parsing instead.
+    Returns the normalized data and the image reference.
+
+    >>> _glifPointAttributeOrder == tuple(sorted(_glifPointAttributeOrder, key=xmlAttributeOrder.get))
+    True
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> glif = '''
+    ... <glyph name="a" format="2">
+    ...   <note>note</note>
+    ...   <outline>
+    ...     <contour identifier="c&amp;1">
+    ...       <point x="1.50" y="-0" type="curve" smooth="yes" name="p1" identifier="i1"/>
+    ...       <point x="2" y="3" smooth="yes"/>
+    ...       <ignored><point x="10" y="10"/></ignored>
+    ...     </contour>
+    ...     <contour>
+    ...       <point x="1" y="a"/>
+    ...     </contour>
+    ...     <contour>
+    ...       <point y="1" identifier="i2"/>
+    ...     </contour>
+    ...     <contour/>
+    ...     <component base="b" xScale="1" xOffset="10.0"/>
+    ...     <component/>
+    ...   </outline>
+    ...   <advance width="100"/>
+    ...   <unicode hex="0061"/>
+    ... </glyph>
+    ... '''.strip()
+    >>> glif1 = '''
+    ... <glyph name="a" format="1">
+    ...   <outline>
+    ...     <contour>
+    ...       <point x="1" y="2" type="move" smooth="yes" name="top"/>
+    ...     </contour>
+    ...     <contour identifier="c1">
+    ...       <point x="1" y="2" type="line" identifier="i1"/>
+    ...       <point x="3" y="4" type="line"/>
+    ...     </contour>
+    ...     <component base="b" identifier="c2"/>
+    ...   </outline>
+    ... </glyph>
+    ... '''.strip()
+    >>> for text in (glif, glif1):
+    ...     for engine in glifEngines:
+    ...         subpathWriteFile(text, directory, engine + ".glif")
+    ...         imageFileName = normalizeGLIF(directory, engine + ".glif", engine=engine)
+    ...     [subpathReadFile(directory, engine + ".glif") == subpathReadFile(directory, "tree.glif") for engine in glifEngines]
+    [True, True, True, True]
+    [True, True, True, True]
+    >>> print(tounicode(subpathReadFile(directory, "expat.glif"), "utf-8").replace("\t", "  "))
+    <?xml version="1.0" encoding="UTF-8"?>
+    <glyph name="a" format="1">
+      <outline>
+        <contour>
+          <point x="1" y="2" type="line"/>
+          <point x="3" y="4" type="line"/>
+        </contour>
+        <component base="b"/>
+        <contour>
+          <point name="top" x="1" y="2" type="move"/>
+        </contour>
+      </outline>
+    </glyph>
+
+    A format 2 point with an identifier but no coordinates is
+    written with only its identifier.
+
+    >>> subpathWriteFile(glif, directory, "expat.glif")
+    >>> normalizeGLIF(directory, "expat.glif", engine="expat")
+    >>> b'<point identifier="i2"/>' in subpathReadFile(directory, "expat.glif")
+    True
+
+    An undefined entity is an error in all engines, even
+    when the document has an external DTD. External entities
+    are not loaded and are treated as undefined.
+
+    >>> entityGlif = '''
+    ... <!DOCTYPE glyph SYSTEM "glyph.dtd">
+    ... <glyph name="a" format="2">
+    ...   <note>a &foo; b</note>
+    ... </glyph>
+    ... '''.strip()
+    >>> errors = []
+    >>> for engine in glifEngines:
+    ...     subpathWriteFile(entityGlif, directory, engine + ".glif")
+    ...     try:
+    ...         normalizeGLIF(directory, engine + ".glif", engine=engine)
+    ...     except ET.ParseError:
+    ...         errors.append(engine)
+    >>> errors == list(glifEngines)
+    True
+    >>> subpathWriteFile(b"secret", directory, "secret.txt")
+    >>> url = "file:///" + subpathJoin(directory, "secret.txt").replace(os.sep, "/").lstrip("/")
+    >>> entityGlif = '''
+    ... <!DOCTYPE glyph [<!ENTITY e SYSTEM "%s">]>
+    ... <glyph name="a" format="2">
+    ...   <note>a &e; b</note>
+    ... </glyph>
+    ... '''.strip() % url
+    >>> errors = []
+    >>> for engine in glifEngines:
+    ...     subpathWriteFile(entityGlif, directory, engine + ".glif")
+    ...     try:
+    ...         normalizeGLIF(directory, engine + ".glif", engine=engine)
+    ...     except ET.ParseError:
+    ...         errors.append(engine)
+    >>> errors == list(glifEngines)
+    True
+    >>> shutil.rmtree(directory)
+    """
+    if vectorized:
+        handler = _GLIFVectorizedHandler(glifPath)
+    else:
+        handler = _GLIFExpatHandler(glifPath)
+    parser = expat.ParserCreate(namespace_separator="}")
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.startElement
+    parser.EndElementHandler = handler.endElement
+    parser.CharacterDataHandler = handler.characterData
+
+    def undefinedEntity(name):
+        line = parser.CurrentLineNumber
+        column = parser.CurrentColumnNumber
+        message = "undefined entity &%s;: line %d, column %d" % (name, line, column)
+        # 11 is XML_ERROR_UNDEFINED_ENTITY
+        raise ET.makeParseError(message, 11, line, column)
+
+    def skippedEntity(name, isParameterEntity):
+        # expat skips undefined entities instead of failing
+        # when the document has an external DTD. the tree
+        # engine's parsers raise an error.
+        if not isParameterEntity:
+            undefinedEntity(name)
+
+    def externalEntityRef(context, base, systemId, publicId):
+        # external entities are never loaded. the tree
+        # engine's parsers treat them as undefined. the
+        # context ends with the entity name.
+        undefinedEntity(context.split("\f")[-1])
+
+    parser.SkippedEntityHandler = skippedEntity
+    parser.ExternalEntityRefHandler = externalEntityRef
+    try:
+        parser.Parse(text, True)
+    except expat.ExpatError as e:
+        # raise the same error as the tree engine
+        raise ET.makeParseError(str(e), e.code, e.lineno, e.offset)
+    outline = handler.outline
+    if outline is not None:
+        outline.extend(handler.impliedAnchors)
+        if vectorized:
+            try:
+                outline = handler.formatOutline(outline)
+            except ValueError:
+                # an invalid coordinate removes its contour.
+                # leave finding it to the point by point path.
+                return _normalizeGLIFExpat(text, glifPath)
+    hasOutline = bool(outline)
+    text, imageFileName = _writeGLIFWithOutlineMarker(handler.glifVersion, handler.name, handler.elements, hasOutline)
+    if hasOutline:
+        text = text.replace(tobytes(_glifOutlineMarker), tobytes(xmlLineBreak.join(outline), "utf-8"), 1)
+    return text, imageFileName
+
+class _GLIFExpatHandler(object):
+
+    def __init__(self, glifPath):
+        self.glifPath = glifPath
+        self.glifVersion = None
+        self.name = None
+        # the completed top level elements other than the outline
+        self.elements = []
+        # the outline's lines, or None if there is no outline
+        self.outline = None
+        self.impliedAnchors = []
+        self._depth = 0
+        self._builder = None
+        self._inOutline = False
+        # the lines of the contour being parsed. this is
+        # None outside of a contour and False if the contour
+        # contains an invalid point.
+        self._contour = None
+        self._contourIdentifier = None
+        self._firstPoint = None
+        self._writer = XMLWriter(declaration=None)
+
+    def startElement(self, tag, attrs):
+        self._depth += 1
+        depth = self._depth
+        if "}" in tag:
+            tag = "{" + tag
+        if self._builder is not None:
+            self._builder.start(tag, attrs)
+        elif depth == 4:
+            if tag == "point" and self._contour is not None and self._contour is not False:
+                self._point(attrs)
+        elif depth == 3:
+            if self._inOutline:
+                if tag == "contour":
+                    self._contour = []
+                    self._contourIdentifier = attrs.get("identifier")
+                elif tag == "component":
+                    self._component(attrs)
+        elif depth == 2:
+            if tag == "outline":
+                # like the tree engine, only the last outline is used
+                self._inOutline = True
+                self.outline = []
+                self.impliedAnchors = []
+            else:
+                self._builder = ET.TreeBuilder()
+                self._builder.start(tag, attrs)
+        elif depth == 1:
+            # INVALID DATA POSSIBILITY: format version that can't be converted to int
+            glifVersion = attrs.get("format")
+            if glifVersion is None:
+                raise UFONormalizerError("Undefined GLIF format: %s" % self.glifPath)
+            self.glifVersion = int(glifVersion)
+            self.name = attrs.get("name")
+
+    def endElement(self, tag):
+        depth = self._depth
+        self._depth -= 1
+        if "}" in tag:
+            tag = "{" + tag
+        if self._builder is not None:
+            element = self._builder.end(tag)
+            if depth == 2:
+                self.elements.append(element)
+                self._builder = None
+        elif depth == 3:
+            if self._contour is not None:
+                self._endContour()
+        elif depth == 2:
+            self._inOutline = False
+
+    def characterData(self, data):
+        if self._builder is not None:
+            self._builder.data(data)
+
+    def _point(self, attrs):
+        # INVALID DATA POSSIBILITY: unknown point type
+        x = attrs.get("x")
+        y = attrs.get("y")
+        typ = attrs.get("type", "offcurve")
+        if not x or not y or typ not in _glifPointTypes:
+            identifier = None
+            if self.glifVersion >= 2:
+                identifier = _getGlifPointIdentifierOnly(attrs)
+            if identifier is None:
+                self._contour = False
+            else:
+                self._contour.append("\t\t\t<point identifier=\"%s\"/>" % xmlEscapeText(identifier))
+            return
+        name = attrs.get("name")
+        if name is None:
+            before = "\t\t\t<point "
+        else:
+            before = "\t\t\t<point name=\"%s\" " % xmlEscapeText(name)
+        after = []
+        if typ != "offcurve":
+            after.append(" type=\"%s\"" % typ)
+            if attrs.get("smooth") == "yes":
+                after.append(" smooth=\"yes\"")
+        if self.glifVersion >= 2:
+            identifier = attrs.get("identifier")
+            if identifier is not None:
+                after.append(" identifier=\"%s\"" % xmlEscapeText(identifier))
+        after.append("/>")
+        try:
+            line = self._pointLine(before, x, y, "".join(after))
+        except ValueError:
+            self._contour = False
+            return
+        if not self._contour:
+            self._firstPoint = (typ, before, x, y)
+        self._contour.append(line)
+
+    def _pointLine(self, before, x, y, after):
+        # the coordinates are the attribute text. a
+        # ValueError is raised if they are not numbers.
+        return "%sx=\"%s\" y=\"%s\"%s" % (before, xmlConvertCoordinate(x), xmlConvertCoordinate(y), after)
+
+    def _endContour(self):
+        lines = self._contour
+        self._contour = None
+        if not lines:
+            return
+        if self.glifVersion == 1:
+            if len(lines) == 1 and self._firstPoint[0] == "move":
+                # implied anchor
+                typ, before, x, y = self._firstPoint
+                point = self._pointLine(before, x, y, " type=\"move\"/>")
+                self.impliedAnchors.extend(["\t\t<contour>", point, "\t\t</contour>"])
+                return
+            self.outline.append("\t\t<contour>")
+        elif self._contourIdentifier is not None:
+            self.outline.append("\t\t<contour identifier=\"%s\">" % xmlEscapeText(self._contourIdentifier))
+        else:
+            self.outline.append("\t\t<contour>")
+        self.outline.extend(lines)
+        self.outline.append("\t\t</contour>")
+
+    def _component(self, attrs):
+        element = ET.Element("component", attrs)
+        if self.glifVersion == 1:
+            component = _normalizeGlifComponentFormat1(element)
+        else:
+            component = _normalizeGlifComponentFormat2(element)
+        if component is None:
+            return
+        self.outline.append("\t\t<component %s/>" % self._writer.attributesToString(component))
+
+class _GLIFVectorizedHandler(_GLIFExpatHandler):
+
+    """
+    Collect the coordinate text of all points while parsing
+    and convert it in one go when the outline is complete.
+    Until then, point lines are placeholders.
+    """
+
+    def __init__(self, glifPath):
+        _GLIFExpatHandler.__init__(self, glifPath)
+        self._coordinates = []
+
+    def _pointLine(self, before, x, y, after):
+        coordinates = self._coordinates
+        coordinates.append(x)
+        coordinates.append(y)
+        return (before, len(coordinates) - 2, after)
+
+    def formatOutline(self, outline):
+        coordinates = _convertCoordinates(self._coordinates)
+        lines = []
+        for line in outline:
+            if type(line) is tuple:
+                before, index, after = line
+                line = "%sx=\"%s\" y=\"%s\"%s" % (before, coordinates[index], coordinates[index + 1], after)
+            lines.append(line)
+        return lines
+
+def _convertCoordinates(texts):
+    """
+    Format a list of coordinate texts like xmlConvertCoordinate.
+    If NumPy is installed, parsing, removing duplicates and
+    formatting integral values is done with arrays. A
+    ValueError is raised if any text is not a number.
+
+    >>> texts = ["1", "2.50", "-0", "1e3", "1", "0.1", "1.00000000001", "nan"]
+    >>> _convertCoordinates(texts) == [xmlConvertCoordinate(text) for text in texts]
+    True
+    >>> _convertCoordinates(["1", "a"]) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    ValueError: could not convert string to float: ...
+
+    Infinite values don't cause a warning.
+
+    >>> import warnings
+    >>> with warnings.catch_warnings(record=True) as caught:
+    ...     warnings.simplefilter("always")
+    ...     texts = ["inf", "-inf", "nan", "1"]
+    ...     _convertCoordinates(texts) == [xmlConvertCoordinate(text) for text in texts]
+    True
+    >>> len(caught)
+    0
+    """
+    if numpy is None or not texts:
+        return [xmlConvertCoordinate(text) for text in texts]
+    values = numpy.array(texts, dtype=float)
+    values, indexes = numpy.unique(values, return_inverse=True)
+    # the remainder of an infinite value is nan
+    with numpy.errstate(invalid="ignore"):
+        integral = (values % 1 == 0) & (numpy.abs(values) < 2.0 ** 53)
+    formatted = numpy.empty(len(values), dtype=object)
+    formatted[integral] = values[integral].astype(numpy.int64).astype(str)
+    for index in numpy.flatnonzero(~integral):
+        formatted[index] = xmlConvertFloat(float(values[index]))
+    return formatted[indexes].tolist()
+
+def _normalizeGlifUnicode(element, writer):
+    """
+    - Don't write unicode element if hex attribute is not defined.
+    - Don't write unicode element if value for hex value is not a proper hex value.
+    - Write hex value as all uppercase, zero padded string.
+
+    without hex
+    -----------
+    >>> element = ET.fromstring("<unicode />")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u''
+    True
+
+    >>> element = ET.fromstring("<unicode hex=''/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u''
+    True
+
+    >>> element = ET.fromstring("<unicode hexagon=''/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u''
+    True
+
+    >>> element = ET.fromstring("<unicode hex='xyz'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u''
+    True
+
+    with hex
+    --------
+    >>> element = ET.fromstring("<unicode hex='0041'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u'<unicode hex="0041"/>'
+    True
+
+    >>> element = ET.fromstring("<unicode hex='41'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u'<unicode hex="0041"/>'
+    True
+
+    >>> element = ET.fromstring("<unicode hex='ea'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u'<unicode hex="00EA"/>'
+    True
+
+    >>> element = ET.fromstring("<unicode hex='2Af'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u'<unicode hex="02AF"/>'
+    True
+
+    >>> element = ET.fromstring("<unicode hex='0000fFfF'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u'<unicode hex="FFFF"/>'
+    True
+
+    >>> element = ET.fromstring("<unicode hex='10000'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u'<unicode hex="10000"/>'
+    True
+
+    >>> element = ET.fromstring("<unicode hex='abcde'/>")
+    >>> writer = XMLWriter(declaration=None)
+    >>> _normalizeGlifUnicode(element, writer)
+    >>> writer.getText() == u'<unicode hex="ABCDE"/>'
     True
     """
     v = element.attrib.get("hex")
@@ -1501,7 +3059,7 @@ def _normalizeGlifOutlineFormat1(element, writer):
             contour = _normalizeGlifContourFormat1(subElement)
             if contour is None:
                 continue
-            if contour["type"] == "contour":
+            if contour.tag == "contour":
                 outline.append(contour)
             else:
                 anchors.append(contour)
@@ -1515,28 +3073,159 @@ def _normalizeGlifOutlineFormat1(element, writer):
         return
     writer.beginElement("outline")
     for obj in outline:
-        t = obj.pop("type")
-        if t == "contour":
-            writer.beginElement("contour")
-            for point in obj["points"]:
-                writer.simpleElement("point", attrs=point)
-            writer.endElement("contour")
-        elif t == "component":
-            writer.simpleElement("component", attrs=obj)
+        _writeGlifOutlineObject(obj, writer)
     for anchor in anchors:
-        t = anchor.pop("type")
-        writer.beginElement("contour")
-        attrs = dict(
-            type="move",
-            x=anchor["x"],
-            y=anchor["y"]
-        )
-        if "name" in anchor:
-            attrs["name"] = anchor["name"]
-        writer.simpleElement("point", attrs=attrs)
-        writer.endElement("contour")
+        _writeGlifImpliedAnchor(anchor, writer)
     writer.endElement("outline")
 
+def _writeGlifOutlineObject(obj, writer):
+    # write a contour or component made by the contour and
+    # component normalization functions of either format.
+    if obj.tag == "contour":
+        if obj.identifier is None:
+            writer.beginElement("contour")
+        else:
+            writer.beginElement("contour", attrs=dict(identifier=obj.identifier))
+        for point in obj.points:
+            writer.raw("<point %s/>" % point.attributesToString())
+        writer.endElement("contour")
+    elif obj.tag == "component":
+        writer.simpleElement("component", attrs=obj)
+
+def _writeGlifImpliedAnchor(anchor, writer):
+    # format 1 anchors are written as single point contours
+    writer.beginElement("contour")
+    writer.raw("<point %s/>" % anchor.attributesToString())
+    writer.endElement("contour")
+
+# Outline records
+
+# These hold the normalized outline objects until they are
+# written. A font can have millions of points, so they use
+# __slots__ instead of dicts. items returns the attributes
+# that are written, in the same form as a dict's items, so
+# a record can be given to XMLWriter.simpleElement.
+
+_glifInternedPointTypes = dict((typ, typ) for typ in ("move", "line", "curve", "qcurve"))
+
+class _GlifPoint(object):
+
+    """
+    A point. type is None for off curve points.
+
+    >>> point = _GlifPoint(1.0, 2.5, "curve", True, "a&b", "i1")
+    >>> point.attributesToString()
+    'name="a&amp;b" x="1" y="2.5" type="curve" smooth="yes" identifier="i1"'
+    >>> point.attributesToString() == XMLWriter(declaration=None).attributesToString(dict(point.items()))
+    True
+
+    A format 2 point with no coordinates only has an identifier.
+
+    >>> _GlifPoint(None, None, identifier="i1").attributesToString()
+    'identifier="i1"'
+    """
+
+    __slots__ = ("x", "y", "type", "smooth", "name", "identifier")
+    tag = "point"
+
+    def __init__(self, x, y, typ=None, smooth=False, name=None, identifier=None):
+        self.x = x
+        self.y = y
+        self.type = typ
+        self.smooth = smooth
+        self.name = name
+        self.identifier = identifier
+
+    def items(self):
+        if self.x is None:
+            return [("identifier", self.identifier)]
+        items = [("x", self.x), ("y", self.y)]
+        if self.type is not None:
+            items.append(("type", self.type))
+            if self.smooth:
+                items.append(("smooth", "yes"))
+        if self.name is not None:
+            items.append(("name", self.name))
+        if self.identifier is not None:
+            items.append(("identifier", self.identifier))
+        return items
+
+    def attributesToString(self):
+        # the attributes are always in this order so
+        # XMLWriter.attributesToString isn't needed
+        if self.x is None:
+            return "identifier=\"%s\"" % xmlEscapeText(self.identifier)
+        text = "x=\"%s\" y=\"%s\"" % (xmlConvertCoordinate(self.x), xmlConvertCoordinate(self.y))
+        if self.name is not None:
+            text = "name=\"%s\" %s" % (xmlEscapeText(self.name), text)
+        if self.type is not None:
+            text += " type=\"%s\"" % self.type
+            if self.smooth:
+                text += " smooth=\"yes\""
+        if self.identifier is not None:
+            text += " identifier=\"%s\"" % xmlEscapeText(self.identifier)
+        return text
+
+
+class _GlifImpliedAnchor(object):
+
+    """
+    A format 1 anchor: a contour with a single move point.
+    """
+
+    __slots__ = ("x", "y", "name")
+    tag = "anchor"
+
+    def __init__(self, x, y, name=None):
+        self.x = x
+        self.y = y
+        self.name = name
+
+    def items(self):
+        items = [("x", self.x), ("y", self.y)]
+        if self.name is not None:
+            items.append(("name", self.name))
+        return items
+
+    def attributesToString(self):
+        return _GlifPoint(self.x, self.y, "move", name=self.name).attributesToString()
+
+
+class _GlifContour(object):
+
+    __slots__ = ("points", "identifier")
+    tag = "contour"
+
+    def __init__(self, points, identifier=None):
+        self.points = points
+        self.identifier = identifier
+
+
+class _GlifComponent(object):
+
+    """
+    A component. transformation holds the attributes with
+    values that are not the default. base is None for a
+    format 2 component that only has an identifier.
+    """
+
+    __slots__ = ("base", "transformation", "identifier")
+    tag = "component"
+
+    def __init__(self, base, transformation, identifier=None):
+        self.base = base
+        self.transformation = transformation
+        self.identifier = identifier
+
+    def items(self):
+        items = []
+        if self.base is not None:
+            items.append(("base", self.base))
+        items.extend(self.transformation.items())
+        if self.identifier is not None:
+            items.append(("identifier", self.identifier))
+        return items
+
 def _normalizeGlifContourFormat1(element):
     r"""
     - Don't write unknown subelements.
@@ -1594,8 +3283,11 @@ def _normalizeGlifContourFormat1(element):
     ... </contour>
     ... '''
     >>> element = ET.fromstring(contour)
-    >>> sorted(_normalizeGlifContourFormat1(element).items())
-    [('name', 'anchor1'), ('type', 'anchor'), ('x', 0.0), ('y', 0.0)]
+    >>> anchor = _normalizeGlifContourFormat1(element)
+    >>> anchor.tag
+    'anchor'
+    >>> sorted(anchor.items())
+    [('name', 'anchor1'), ('x', 0.0), ('y', 0.0)]
 
     implied anchor with empty name
     ------------------------------
@@ -1605,8 +3297,11 @@ def _normalizeGlifContourFormat1(element):
     ... </contour>
     ... '''
     >>> element = ET.fromstring(contour)
-    >>> sorted(_normalizeGlifContourFormat1(element).items())
-    [('name', ''), ('type', 'anchor'), ('x', 0.0), ('y', 0.0)]
+    >>> anchor = _normalizeGlifContourFormat1(element)
+    >>> anchor.tag
+    'anchor'
+    >>> sorted(anchor.items())
+    [('name', ''), ('x', 0.0), ('y', 0.0)]
 
     implied anchor without name
     ---------------------------
@@ -1616,8 +3311,11 @@ def _normalizeGlifContourFormat1(element):
     ... </contour>
     ... '''
     >>> element = ET.fromstring(contour)
-    >>> sorted(_normalizeGlifContourFormat1(element).items())
-    [('type', 'anchor'), ('x', 0.0), ('y', 0.0)]
+    >>> anchor = _normalizeGlifContourFormat1(element)
+    >>> anchor.tag
+    'anchor'
+    >>> sorted(anchor.items())
+    [('x', 0.0), ('y', 0.0)]
 
     normal
     ------
@@ -1628,11 +3326,11 @@ def _normalizeGlifContourFormat1(element):
     ... '''
     >>> element = ET.fromstring(contour)
     >>> result = _normalizeGlifContourFormat1(element)
-    >>> result["type"]
+    >>> result.tag
     'contour'
-    >>> len(result["points"])
+    >>> len(result.points)
     1
-    >>> sorted(result["points"][0].items())
+    >>> sorted(result.points[0].items())
     [('type', 'line'), ('x', 0.0), ('y', 0.0)]
 
     >>> contour = '''
@@ -1643,13 +3341,13 @@ def _normalizeGlifContourFormat1(element):
     ... '''
     >>> element = ET.fromstring(contour)
     >>> result = _normalizeGlifContourFormat1(element)
-    >>> result["type"]
+    >>> result.tag
     'contour'
-    >>> len(result["points"])
+    >>> len(result.points)
     2
-    >>> sorted(result["points"][0].items())
+    >>> sorted(result.points[0].items())
     [('type', 'move'), ('x', 0.0), ('y', 0.0)]
-    >>> sorted(result["points"][1].items())
+    >>> sorted(result.points[1].items())
     [('type', 'line'), ('x', 1.0), ('y', 1.0)]
     """
     # INVALID DATA POSSIBILITY: unknown child element
@@ -1659,20 +3357,18 @@ def _normalizeGlifContourFormat1(element):
         tag = subElement.tag
         if tag != "point":
             continue
-        attrs = _normalizeGlifPointAttributesFormat1(subElement)
-        if not attrs:
+        point = _normalizeGlifPointAttributesFormat1(subElement)
+        if point is None:
             return
-        points.append(attrs)
+        points.append(point)
     if not points:
         return
     # anchor
-    if len(points) == 1 and points[0].get("type") == "move":
-        anchor = points[0]
-        anchor["type"] = "anchor"
-        return anchor
+    if len(points) == 1 and points[0].type == "move":
+        point = points[0]
+        return _GlifImpliedAnchor(point.x, point.y, point.name)
     # contour
-    contour = dict(type="contour", points=points)
-    return contour
+    return _GlifContour(points)
 
 def _normalizeGlifPointAttributesFormat1(element):
     """
@@ -1695,15 +3391,13 @@ def _normalizeGlifPointAttributesFormat1(element):
     ----
     >>> point = "<point y='2.5' type='line' name='test' smooth='yes'/>"
     >>> element = ET.fromstring(point)
-    >>> sorted(_normalizeGlifPointAttributesFormat1(element).items())
-    []
+    >>> _normalizeGlifPointAttributesFormat1(element)
 
     no y
     ----
     >>> point = "<point x='1' type='line' name='test' smooth='yes'/>"
     >>> element = ET.fromstring(point)
-    >>> sorted(_normalizeGlifPointAttributesFormat1(element).items())
-    []
+    >>> _normalizeGlifPointAttributesFormat1(element)
 
     invalid x
     ---------
@@ -1805,8 +3499,7 @@ def _normalizeGlifPointAttributesFormat1(element):
 
     >>> point = "<point x='1' y='2.5' type='invalid'/>"
     >>> element = ET.fromstring(point)
-    >>> sorted(_normalizeGlifPointAttributesFormat1(element).items())
-    []
+    >>> _normalizeGlifPointAttributesFormat1(element)
 
     subelement
     ----------
@@ -1819,31 +3512,27 @@ def _normalizeGlifPointAttributesFormat1(element):
     # INVALID DATA POSSIBILITY: no y defined
     # INVALID DATA POSSIBILITY: x or y that can't be converted to float
     # INVALID DATA POSSIBILITY: duplicate attributes
-    x = element.attrib.get("x")
-    y = element.attrib.get("y")
+    attrib = element.attrib
+    x = attrib.get("x")
+    y = attrib.get("y")
     if not x or not y:
-        return {}
+        return
     try:
         x = float(x)
         y = float(y)
     except ValueError:
         return
-    attrs = dict(
-        x=x,
-        y=y
-    )
-    typ = element.attrib.get("type", "offcurve")
-    if typ not in ("move", "line", "curve", "qcurve", "offcurve"):
-        return {}
-    if typ != "offcurve":
-        attrs["type"] = typ
-        smooth = element.attrib.get("smooth")
-        if smooth == "yes":
-            attrs["smooth"] = "yes"
-    name = element.attrib.get("name")
-    if name is not None:
-        attrs["name"] = name
-    return attrs
+    typ = attrib.get("type")
+    smooth = False
+    if typ is not None and typ != "offcurve":
+        # use the shared string instead of the parsed one
+        typ = _glifInternedPointTypes.get(typ)
+        if typ is None:
+            return
+        smooth = attrib.get("smooth") == "yes"
+    else:
+        typ = None
+    return _GlifPoint(x, y, typ, smooth, attrib.get("name"))
 
 def _normalizeGlifComponentFormat1(element):
     """
@@ -1855,7 +3544,7 @@ def _normalizeGlifComponentFormat1(element):
     >>> component = "<component base='test' xScale='10' xyScale='2.2' yxScale='3' yScale='4.4' xOffset='5' yOffset='6.6'/>"
     >>> element = ET.fromstring(component)
     >>> sorted(_normalizeGlifComponentFormat1(element).items())
-    [('base', 'test'), ('type', 'component'), ('xOffset', 5.0), ('xScale', 10.0), ('xyScale', 2.2), ('yOffset', 6.6), ('yScale', 4.4), ('yxScale', 3.0)]
+    [('base', 'test'), ('xOffset', 5.0), ('xScale', 10.0), ('xyScale', 2.2), ('yOffset', 6.6), ('yScale', 4.4), ('yxScale', 3.0)]
 
     no base
     -------
@@ -1868,15 +3557,11 @@ def _normalizeGlifComponentFormat1(element):
     >>> component = "<component base='test'><foo/></component>"
     >>> element = ET.fromstring(component)
     >>> sorted(_normalizeGlifComponentFormat1(element).items())
-    [('base', 'test'), ('type', 'component')]
+    [('base', 'test')]
     """
     # INVALID DATA POSSIBILITY: no base defined
     # INVALID DATA POSSIBILITY: unknown child element
-    component = _normalizeGlifComponentAttributesFormat1(element)
-    if not component:
-        return
-    component["type"] = "component"
-    return component
+    return _normalizeGlifComponentAttributesFormat1(element)
 
 def _normalizeGlifComponentAttributesFormat1(element):
     """
@@ -1894,8 +3579,7 @@ def _normalizeGlifComponentAttributesFormat1(element):
     -------
     >>> component = "<component xScale='10' xyScale='2.2' yxScale='3' yScale='4.4' xOffset='5' yOffset='6.6'/>"
     >>> element = ET.fromstring(component)
-    >>> sorted(_normalizeGlifComponentAttributesFormat1(element).items())
-    []
+    >>> _normalizeGlifComponentAttributesFormat1(element)
 
     no transformation
     -----------------
@@ -1915,13 +3599,8 @@ def _normalizeGlifComponentAttributesFormat1(element):
     # INVALID DATA POSSIBILITY: duplicate attributes
     base = element.attrib.get("base")
     if not base:
-        return {}
-    attrs = dict(
-        base=element.attrib["base"]
-    )
-    transformation = _normalizeGlifTransformation(element)
-    attrs.update(transformation)
-    return attrs
+        return
+    return _GlifComponent(base, _normalizeGlifTransformation(element))
 
 def _normalizeGlifOutlineFormat2(element, writer):
     r"""
@@ -2002,18 +3681,7 @@ def _normalizeGlifOutlineFormat2(element, writer):
         return
     writer.beginElement("outline")
     for obj in outline:
-        t = obj.pop("type")
-        if t == "contour":
-            attrs = {}
-            identifier = obj.get("identifier")
-            if identifier is not None:
-                attrs["identifier"] = identifier
-            writer.beginElement("contour", attrs=attrs)
-            for point in obj["points"]:
-                writer.simpleElement("point", attrs=point)
-            writer.endElement("contour")
-        elif t == "component":
-            writer.simpleElement("component", attrs=obj)
+        _writeGlifOutlineObject(obj, writer)
     writer.endElement("outline")
 
 def _normalizeGlifContourFormat2(element):
@@ -2058,13 +3726,13 @@ def _normalizeGlifContourFormat2(element):
     ... '''
     >>> element = ET.fromstring(contour)
     >>> result = _normalizeGlifContourFormat2(element)
-    >>> result["type"]
+    >>> result.tag
     'contour'
-    >>> result["identifier"]
+    >>> result.identifier
     'test'
-    >>> len(result["points"])
+    >>> len(result.points)
     1
-    >>> sorted(result["points"][0].items())
+    >>> sorted(result.points[0].items())
     [('type', 'line'), ('x', 0.0), ('y', 0.0)]
 
     >>> contour = '''
@@ -2075,15 +3743,15 @@ def _normalizeGlifContourFormat2(element):
     ... '''
     >>> element = ET.fromstring(contour)
     >>> result = _normalizeGlifContourFormat2(element)
-    >>> result["type"]
+    >>> result.tag
     'contour'
-    >>> result["identifier"]
+    >>> result.identifier
     'test'
-    >>> len(result["points"])
+    >>> len(result.points)
     2
-    >>> sorted(result["points"][0].items())
+    >>> sorted(result.points[0].items())
     [('type', 'move'), ('x', 0.0), ('y', 0.0)]
-    >>> sorted(result["points"][1].items())
+    >>> sorted(result.points[1].items())
     [('type', 'line'), ('x', 1.0), ('y', 1.0)]
     """
     # INVALID DATA POSSIBILITY: unknown child element
@@ -2093,17 +3761,13 @@ def _normalizeGlifContourFormat2(element):
         tag = subElement.tag
         if tag != "point":
             continue
-        attrs = _normalizeGlifPointAttributesFormat2(subElement)
-        if not attrs:
+        point = _normalizeGlifPointAttributesFormat2(subElement)
+        if point is None:
             return
-        points.append(attrs)
+        points.append(point)
     if not points:
         return
-    contour = dict(type="contour", points=points)
-    identifier = element.attrib.get("identifier")
-    if identifier is not None:
-        contour["identifier"] = identifier
-    return contour
+    return _GlifContour(points, element.attrib.get("identifier"))
 
 def _normalizeGlifPointAttributesFormat2(element):
     """
@@ -2115,12 +3779,60 @@ def _normalizeGlifPointAttributesFormat2(element):
     >>> element = ET.fromstring(point)
     >>> sorted(_normalizeGlifPointAttributesFormat2(element).items())
     [('identifier', 'TEST'), ('name', 'test'), ('smooth', 'yes'), ('type', 'line'), ('x', 1.0), ('y', 2.5)]
+
+    no x or unknown type
+    --------------------
+    >>> point = "<point y='2.5' identifier='TEST'/>"
+    >>> element = ET.fromstring(point)
+    >>> _normalizeGlifPointAttributesFormat2(element).items() == [("identifier", "TEST")]
+    True
+    >>> point = "<point x='1' y='2.5' type='invalid' identifier='TEST'/>"
+    >>> element = ET.fromstring(point)
+    >>> _normalizeGlifPointAttributesFormat2(element).attributesToString()
+    'identifier="TEST"'
+    >>> point = "<point y='2.5'/>"
+    >>> element = ET.fromstring(point)
+    >>> _normalizeGlifPointAttributesFormat2(element)
+
+    invalid x
+    ---------
+    >>> point = "<point x='a' y='2.5' identifier='TEST'/>"
+    >>> element = ET.fromstring(point)
+    >>> _normalizeGlifPointAttributesFormat2(element)
     """
-    attrs = _normalizeGlifPointAttributesFormat1(element)
-    identifier = element.attrib.get("identifier")
-    if identifier is not None:
-        attrs["identifier"] = identifier
-    return attrs
+    point = _normalizeGlifPointAttributesFormat1(element)
+    if point is not None:
+        point.identifier = element.attrib.get("identifier")
+    else:
+        identifier = _getGlifPointIdentifierOnly(element.attrib)
+        if identifier is not None:
+            point = _GlifPoint(None, None, identifier=identifier)
+    return point
+
+def _getGlifPointIdentifierOnly(attrib):
+    """
+    A format 2 point with no coordinates or an unknown type
+    is written with only its identifier. This returns that
+    identifier, or None if the point should be dropped.
+
+    >>> _getGlifPointIdentifierOnly(dict(y="1", identifier="a")) == "a"
+    True
+    >>> _getGlifPointIdentifierOnly(dict(y="1"))
+    >>> _getGlifPointIdentifierOnly(dict(x="a", y="1", type="invalid", identifier="a"))
+    """
+    identifier = attrib.get("identifier")
+    if identifier is None:
+        return
+    x = attrib.get("x")
+    y = attrib.get("y")
+    if x and y:
+        # INVALID DATA POSSIBILITY: x or y that can't be converted to float
+        try:
+            float(x)
+            float(y)
+        except ValueError:
+            return
+    return identifier
 
 def _normalizeGlifComponentFormat2(element):
     """
@@ -2128,11 +3840,7 @@ def _normalizeGlifComponentFormat2(element):
     """
     # INVALID DATA POSSIBILITY: no base defined
     # INVALID DATA POSSIBILITY: unknown child element
-    component = _normalizeGlifComponentAttributesFormat2(element)
-    if not component:
-        return
-    component["type"] = "component"
-    return component
+    return _normalizeGlifComponentAttributesFormat2(element)
 
 def _normalizeGlifComponentAttributesFormat2(element):
     """
@@ -2144,12 +3852,26 @@ def _normalizeGlifComponentAttributesFormat2(element):
     >>> element = ET.fromstring(component)
     >>> sorted(_normalizeGlifComponentAttributesFormat2(element).items())
     [('base', 'test'), ('identifier', 'test'), ('xOffset', 5.0), ('xScale', 10.0), ('xyScale', 2.2), ('yOffset', 6.6), ('yScale', 4.4), ('yxScale', 3.0)]
+
+    no base
+    -------
+    >>> component = "<component xOffset='5' identifier='test'/>"
+    >>> element = ET.fromstring(component)
+    >>> _normalizeGlifComponentAttributesFormat2(element).items() == [("identifier", "test")]
+    True
+    >>> component = "<component xOffset='5'/>"
+    >>> element = ET.fromstring(component)
+    >>> _normalizeGlifComponentAttributesFormat2(element)
     """
-    attrs = _normalizeGlifComponentAttributesFormat1(element)
+    component = _normalizeGlifComponentAttributesFormat1(element)
     identifier = element.attrib.get("identifier")
-    if identifier is not None:
-        attrs["identifier"] = identifier
-    return attrs
+    if component is not None:
+        component.identifier = identifier
+    elif identifier is not None:
+        # a component with no base is written
+        # with only its identifier.
+        component = _GlifComponent(None, {}, identifier)
+    return component
 
 _glifDefaultTransformation = dict(
     xScale=1,
@@ -2235,9 +3957,9 @@ def _normalizeColorString(value):
     return ",".join(color)
 
 # Adapted from plistlib.datetime._date_from_string()
+_dateParser = re.compile(r"(?P<year>\d\d\d\d)(?:-(?P<month>\d\d)(?:-(?P<day>\d\d)(?:T(?P<hour>\d\d)(?::(?P<minute>\d\d)(?::(?P<second>\d\d))?)?)?)?)?Z")
+
 def _dateFromString(text):
-    import re
-    _dateParser = re.compile(r"(?P<year>\d\d\d\d)(?:-(?P<month>\d\d)(?:-(?P<day>\d\d)(?:T(?P<hour>\d\d)(?::(?P<minute>\d\d)(?::(?P<second>\d\d))?)?)?)?)?Z")
     gd = _dateParser.match(text).groupdict()
     lst = []
     for key in ('year', 'month', 'day', 'hour', 'minute', 'second'):
@@ -2269,6 +3991,9 @@ def _convertPlistElementToObject(element):
     >>> element = ET.fromstring("<string>foo</string>")
     >>> _convertPlistElementToObject(element)
     'foo'
+    >>> element = ET.fromstring("<string></string>")
+    >>> _convertPlistElementToObject(element)
+    ''
     >>> element = ET.fromstring("<date>2015-07-05T22:16:18Z</date>")
     >>> _convertPlistElementToObject(element)
     datetime.datetime(2015, 7, 5, 22, 16, 18)
@@ -2285,7 +4010,7 @@ def _convertPlistElementToObject(element):
     >>> _convertPlistElementToObject(element)
     1
     >>> element = ET.fromstring("<data>YWJj</data>")
-    >>> _convertPlistElementToObject(element) == plistlib.Data(b'abc')
+    >>> _convertPlistElementToObject(element) == PlistData(b'abc')
     True
     """
     # INVALID DATA POSSIBILITY: invalid value string
@@ -2300,24 +4025,246 @@ def _convertPlistElementToObject(element):
         key = None
         for subElement in element:
             if subElement.tag == "key":
-                key = subElement.text
+                key = subElement.text or ""
             else:
                 obj[key] = _convertPlistElementToObject(subElement)
-    elif tag == "string":
-        return element.text
-    elif tag == "data":
-        return plistlib.Data.fromBase64(element.text)
-    elif tag == "date":
-        return _dateFromString(element.text)
+    else:
+        obj = _convertPlistValue(tag, element.text or "")
+    return obj
+
+def _convertPlistValue(tag, text):
+    # convert the text of an element other than
+    # dict, array or key to a Python object.
+    # INVALID DATA POSSIBILITY: invalid value string
+    if tag == "string":
+        return text
+    elif tag == "integer":
+        return int(text)
+    elif tag == "real":
+        return float(text)
     elif tag == "true":
         return True
     elif tag == "false":
         return False
-    elif tag == "real":
-        return float(element.text)
-    elif tag == "integer":
-        return int(element.text)
-    return obj
+    elif tag == "date":
+        return _dateFromString(text)
+    elif tag == "data":
+        return PlistData.fromBase64(text)
+    return None
+
+class PlistData(object):
+
+    """
+    Binary data in a property list. This is used instead of
+    plistlib.Data, which isn't in current versions of Python.
+
+    >>> data = PlistData.fromBase64("YWJj")
+    >>> data == PlistData(b"abc")
+    True
+    >>> data.asBase64(maxlinelength=8) == b"YWJj\\n"
+    True
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def fromBase64(cls, data):
+        return cls(binascii.a2b_base64(tobytes(data)))
+
+    def asBase64(self, maxlinelength=76):
+        maxbinsize = (maxlinelength // 4) * 3
+        pieces = []
+        for i in range(0, len(self.data), maxbinsize):
+            pieces.append(binascii.b2a_base64(self.data[i:i + maxbinsize]))
+        return b"".join(pieces)
+
+    def __eq__(self, other):
+        return isinstance(other, PlistData) and self.data == other.data
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.data)
+
+# Other types that are written as data.
+_plistDataTypes = (PlistData,)
+if hasattr(plistlib, "Data"):
+    _plistDataTypes += (plistlib.Data,)
+if bytes is not str:
+    _plistDataTypes += (bytes,)
+
+# Property List Reader
+
+# Property lists written by the normalizer, and by most other
+# tools, use a small, regular part of XML. They are read with
+# regular expressions instead of being parsed into elements.
+# Anything else, including invalid XML, is left to the
+# XML backend.
+
+class _PlistTokenizerError(Exception): pass
+
+_plistPrologPattern = re.compile(r'[ \t\r\n]*(<\?xml[^>]*\?>)?[ \t\r\n]*(?:<!DOCTYPE[^>\[]*>)?[ \t\r\n]*<plist(?:[ \t\r\n][^>]*)?>')
+_plistEncodingPattern = re.compile(r'encoding=["\']([^"\']*)')
+_plistTokenPattern = re.compile(
+    r'[ \t\n]*(?:'
+    r'<(key|string|integer|real|date|data)>([^<]*)</\1>'
+    r'|<(true|false|key|string|data)/>'
+    r'|<(array|dict)>'
+    r'|</(array|dict)>'
+    r'|<(array|dict)/>'
+    r')'
+)
+_plistStringArrayPattern = re.compile(r'<array>((?:[ \t\n]*<string>[^<]*</string>)*)[ \t\n]*</array>')
+_plistStringPattern = re.compile(r'<string>([^<]*)</string>')
+_plistEntityPattern = re.compile(r'&(lt|gt|amp|quot|apos);')
+_plistEntities = dict(lt="<", gt=">", amp="&", quot="\"", apos="'")
+
+def _readPlistFromBytes(data):
+    """
+    Read a property list.
+
+    >>> _readPlistFromBytes(b'<plist version="1.0"><dict><key>a</key><string></string></dict></plist>') == {"a": ""}
+    True
+    >>> _readPlistFromBytes(b'<plist version="1.0"/>') is None
+    True
+
+    The fast reader and the XML backend give the same results.
+
+    >>> text = normalizePropertyList(dict(
+    ...     a=["x", "y&z", "", "<"],
+    ...     b=[1, 2.5, True, False, PlistData(b"abc"), datetime.datetime(2015, 7, 5, 22, 16, 18)],
+    ...     c=dict(d=[], e={}, f=[[], ["g"]]),
+    ... ))
+    >>> data = tobytes(text, "utf-8")
+    >>> _readPlistFromBytes(data) == _readPlistWithBackend(data)
+    True
+    >>> data = data.replace(b"<string></string>", b"<string/>").replace(b"<dict>\\n\\t\\t</dict>", b"<dict/>")
+    >>> _readPlistFromBytes(data) == _readPlistWithBackend(data)
+    True
+    >>> _readPlistWithTokenizer(data) == _readPlistWithBackend(data)
+    True
+
+    >>> data = b'<plist version="1.0"><dict><key>a</key><!-- comment --><string>&#65;</string></dict></plist>'
+    >>> _readPlistWithTokenizer(data)
+    Traceback (most recent call last):
+        ...
+    _PlistTokenizerError
+    >>> _readPlistFromBytes(data)
+    {'a': 'A'}
+    """
+    data = tobytes(data, "utf-8")
+    try:
+        return _readPlistWithTokenizer(data)
+    except _PlistTokenizerError:
+        return _readPlistWithBackend(data)
+
+def _readPlistWithBackend(data):
+    root = ET.fromstring(data)
+    if root.tag == "plist":
+        if not len(root):
+            return None
+        root = root[0]
+    return _convertPlistElementToObject(root)
+
+def _plistUnescape(text):
+    if len(_plistEntityPattern.findall(text)) != text.count("&"):
+        # character references or unknown entities
+        raise _PlistTokenizerError
+    return _plistEntityPattern.sub(lambda match: _plistEntities[match.group(1)], text)
+
+def _readPlistWithTokenizer(data):
+    # this gives the same result as _readPlistWithBackend
+    # or raises _PlistTokenizerError.
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        raise _PlistTokenizerError
+    if "\r" in text:
+        raise _PlistTokenizerError
+    prolog = _plistPrologPattern.match(text)
+    if prolog is None:
+        raise _PlistTokenizerError
+    if prolog.group(1):
+        encoding = _plistEncodingPattern.search(prolog.group(1))
+        if encoding is not None and encoding.group(1).lower() not in ("utf-8", "utf8"):
+            raise _PlistTokenizerError
+    end = text.rfind("</plist>")
+    if end < prolog.end() or text[end + 8:].strip(" \t\n"):
+        raise _PlistTokenizerError
+    root = None
+    hasRoot = False
+    # the open containers and the key of each
+    # dict that contains another container.
+    stack = []
+    keys = []
+    key = None
+    position = prolog.end()
+    match = _plistTokenPattern.match
+    while True:
+        token = match(text, position)
+        if token is None:
+            break
+        position = token.end()
+        tag, value, emptyTag, openTag, closeTag, emptyContainer = token.groups()
+        if closeTag is not None:
+            if not stack or (closeTag == "dict") != (type(stack[-1]) is dict):
+                raise _PlistTokenizerError
+            del stack[-1]
+            key = keys.pop()
+            continue
+        if openTag is not None:
+            if openTag == "dict":
+                obj = {}
+            else:
+                strings = _plistStringArrayPattern.match(text, token.start(4) - 1)
+                if strings is None:
+                    obj = []
+                else:
+                    # an array of strings, such as a glyph order
+                    obj = _plistStringPattern.findall(strings.group(1))
+                    if "&" in strings.group(1):
+                        obj = [_plistUnescape(string) for string in obj]
+                    position = strings.end()
+                    openTag = None
+        elif emptyContainer is not None:
+            if emptyContainer == "dict":
+                obj = {}
+            else:
+                obj = []
+        else:
+            if tag is None:
+                tag = emptyTag
+                value = ""
+            elif "&" in value:
+                value = _plistUnescape(value)
+            if tag == "key":
+                if stack and type(stack[-1]) is dict:
+                    key = value
+                    continue
+                obj = None
+            else:
+                obj = _convertPlistValue(tag, value)
+        if stack:
+            container = stack[-1]
+            if type(container) is dict:
+                container[key] = obj
+            else:
+                container.append(obj)
+        elif hasRoot:
+            # only the first object is used
+            raise _PlistTokenizerError
+        else:
+            root = obj
+            hasRoot = True
+        if openTag is not None:
+            stack.append(obj)
+            keys.append(key)
+            key = None
+    if stack or text[position:end].strip(" \t\n"):
+        raise _PlistTokenizerError
+    return root
 
 # XML Writer
 
@@ -2350,30 +4297,95 @@ for index, attr in enumerate(xmlAttributeOrder):
     d[attr] = index
 xmlAttributeOrder = d
 
+# The number of pending lines that are encoded together.
+xmlWriterBufferLength = 4096
+
+# line break + indentation for each indent level
+_xmlLinePrefixes = [xmlLineBreak]
+# several UFOs may be written at the same time
+_xmlLinePrefixesLock = threading.Lock()
+
+def _getXMLLinePrefix(indentLevel):
+    """
+    >>> _getXMLLinePrefix(3) == xmlLineBreak + xmlIndent * 3
+    True
+    """
+    if len(_xmlLinePrefixes) <= indentLevel:
+        with _xmlLinePrefixesLock:
+            while len(_xmlLinePrefixes) <= indentLevel:
+                _xmlLinePrefixes.append(xmlLineBreak + xmlIndent * len(_xmlLinePrefixes))
+    return _xmlLinePrefixes[indentLevel]
+
 class XMLWriter(object):
 
-    def __init__(self, isPropertyList=False, declaration=xmlDeclaration):
-        self._lines = []
+    """
+    Write lines of XML as UTF-8. The encoded data is kept in
+    memory unless a stream is given. In that case, it is
+    written to the stream in batches and flush must be
+    called when writing is complete.
+
+    >>> import io
+    >>> stream = io.BytesIO()
+    >>> writer = XMLWriter(declaration=None, stream=stream)
+    >>> writer.beginElement("a")
+    >>> writer.simpleElement("b", value="c")
+    >>> writer.endElement("a")
+    >>> writer.flush()
+    >>> stream.getvalue() == b'<a>\\n\\t<b>c</b>\\n</a>'
+    True
+    """
+
+    def __init__(self, isPropertyList=False, declaration=xmlDeclaration, indentLevel=0, stream=None):
+        self._stream = stream
+        self._buffer = bytearray()
+        self._parts = []
+        self._lineCount = 0
         if declaration:
-            self._lines.append(declaration)
+            self._rawLine(declaration)
         if isPropertyList:
-            self._lines.append(plistDocType)
-        self._indentLevel = 0
+            self._rawLine(plistDocType)
+        self._indentLevel = indentLevel
+        self._linePrefix = _getXMLLinePrefix(indentLevel)
         self._stack = []
 
     # text retrieval
 
-    def getText(self):
+    def getBytes(self):
         assert not self._stack
-        return xmlLineBreak.join(self._lines)
+        assert self._stream is None
+        self.flush()
+        return bytes(self._buffer)
+
+    def getText(self):
+        return self.getBytes().decode("utf-8")
+
+    def flush(self):
+        if self._parts:
+            data = "".join(self._parts).encode("utf-8")
+            del self._parts[:]
+            if self._stream is None:
+                self._buffer += data
+            else:
+                self._stream.write(data)
 
     # writing
 
+    def _rawLine(self, line):
+        if self._lineCount:
+            self._parts.append(xmlLineBreak)
+        self._parts.append(line)
+        self._lineCount += 1
+
     def raw(self, line):
-        if self._indentLevel:
-            i = xmlIndent * self._indentLevel
-            line = i + line
-        self._lines.append(line)
+        parts = self._parts
+        if self._lineCount:
+            parts.append(self._linePrefix)
+        elif self._indentLevel:
+            parts.append(self._linePrefix[1:])
+        parts.append(line)
+        self._lineCount += 1
+        if len(parts) >= xmlWriterBufferLength:
+            self.flush()
 
     def data(self, text):
         line = "<![CDATA[%s]]>" % text
@@ -2420,12 +4432,14 @@ class XMLWriter(object):
         self.raw(line)
         self._stack.append(tag)
         self._indentLevel += 1
+        self._linePrefix = _getXMLLinePrefix(self._indentLevel)
 
     def endElement(self, tag):
         assert self._stack
         assert self._stack[-1] == tag
         del self._stack[-1]
         self._indentLevel -= 1
+        self._linePrefix = _getXMLLinePrefix(self._indentLevel)
         line = "</%s>" % (tag)
         self.raw(line)
 
@@ -2504,6 +4518,11 @@ class XMLWriter(object):
         >>> writer.getText() == u'<string>1.000</string>'
         True
 
+        >>> writer = XMLWriter(declaration=None)
+        >>> writer.propertyListObject({"a&b" : "<c>"})
+        >>> writer.getText() == u'<dict>\\n\\t<key>a&amp;b</key>\\n\\t<string>&lt;c&gt;</string>\\n</dict>'
+        True
+
         >>> writer = XMLWriter(declaration=None)
         >>> writer.propertyListObject("")
         >>> writer.getText() == u'<string></string>'
@@ -2602,7 +4621,7 @@ class XMLWriter(object):
         Data
         ----
         >>> writer = XMLWriter(declaration=None)
-        >>> data = plistlib.Data(tobytes("abc"))
+        >>> data = PlistData(tobytes("abc"))
         >>> writer.propertyListObject(data)
         >>> writer.getText() == u'<data>\\n\\tYWJj\\n</data>'
         True
@@ -2636,7 +4655,7 @@ class XMLWriter(object):
             self._plistInt(data)
         elif isinstance(data, float):
             self._plistFloat(data)
-        elif isinstance(data, plistlib.Data):
+        elif isinstance(data, _plistDataTypes):
             self._plistData(data)
         elif isinstance(data, datetime.datetime):
             self._plistDate(data)
@@ -2652,12 +4671,14 @@ class XMLWriter(object):
     def _plistDict(self, data):
         self.beginElement("dict")
         for key, value in sorted(data.items()):
+            if key is not None:
+                key = xmlEscapeText(key)
             self.simpleElement("key", value=key)
             self.propertyListObject(value)
         self.endElement("dict")
 
     def _plistString(self, data):
-        self.simpleElement("string", value=data)
+        self.simpleElement("string", value=xmlEscapeText(data))
 
     def _plistBoolean(self, data):
         if data:
@@ -2666,7 +4687,7 @@ class XMLWriter(object):
             self.simpleElement("false")
 
     def _plistFloat(self, data):
-        data = xmlConvertFloat(data)
+        data = xmlConvertCoordinate(data)
         self.simpleElement("real", value=data)
 
     def _plistInt(self, data):
@@ -2678,6 +4699,8 @@ class XMLWriter(object):
         self.simpleElement("date", value=data)
 
     def _plistData(self, data):
+        if not isinstance(data, PlistData):
+            data = PlistData(getattr(data, "data", data))
         self.beginElement("data")
         data = data.asBase64(maxlinelength=xmlTextMaxLineLength)
         for line in tostr(data).splitlines():
@@ -2803,12 +4826,60 @@ def xmlConvertValue(value):
     '10000000000'
     """
     if isinstance(value, float):
-        return xmlConvertFloat(value)
+        return xmlConvertCoordinate(value)
     elif isinstance(value, int):
         return xmlConvertInt(value)
     value = xmlEscapeText(value)
     return value
 
+# The most values that xmlConvertCoordinate will remember.
+xmlCoordinateCacheSize = 8192
+
+_xmlCoordinateCache = {}
+
+def xmlConvertCoordinate(value):
+    """
+    Format a float, or the text of a number, exactly as
+    xmlConvertFloat formats the float. Integral values
+    skip the decimal formatting and results are cached
+    since the same coordinates appear again and again.
+
+    >>> xmlConvertCoordinate(2.0)
+    '2'
+    >>> xmlConvertCoordinate(-0.0)
+    '0'
+    >>> xmlConvertCoordinate(1e+20)
+    '100000000000000000000'
+    >>> xmlConvertCoordinate(1.00000000001)
+    '1'
+    >>> xmlConvertCoordinate(2.05)
+    '2.05'
+    >>> xmlConvertCoordinate("2.50")
+    '2.5'
+    >>> xmlConvertCoordinate("-10")
+    '-10'
+    >>> xmlConvertCoordinate("a") # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    ValueError: could not convert string to float: ...
+    >>> values = [i / 8.0 for i in range(-8000, 8000)] + [1e-11, 1e15 + 0.5, 123456.789]
+    >>> [xmlConvertCoordinate(value) for value in values] == [xmlConvertFloat(value) for value in values]
+    True
+    """
+    text = _xmlCoordinateCache.get(value)
+    if text is None:
+        key = value
+        if isinstance(value, basestring):
+            value = float(value)
+        if value % 1 == 0:
+            text = "%d" % value
+        else:
+            text = xmlConvertFloat(value)
+        if len(_xmlCoordinateCache) >= xmlCoordinateCacheSize:
+            _xmlCoordinateCache.clear()
+        _xmlCoordinateCache[key] = text
+    return text
+
 def xmlConvertFloat(value):
     """
     >>> xmlConvertFloat(1.0)
@@ -2867,6 +4938,162 @@ def xmlConvertInt(value):
     """
     return str(value)
 
+# ------------
+# UFO Sessions
+# ------------
+
+class UFOSession(object):
+
+    """
+    Cache what is read from a UFO while it is normalized.
+
+    While a session is open, the subpath functions keep
+    the contents and the parsed data of property lists and
+    the listings of directories in the UFO, so a file that
+    is needed by several steps is only read and parsed
+    once. Each read of a property list gets its own copy
+    of the data. Anything that is written, renamed or
+    removed with the subpath functions is forgotten.
+    Files that are written in another way must be given
+    to invalidate.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> ufoPath = _makeTestUFO(directory, glyphCount=2)
+    >>> with UFOSession(ufoPath):
+    ...     lib = subpathReadPlist(ufoPath, "lib.plist")
+    ...     lib["test"] = 1
+    ...     _countCallsTo("_readPlistFromBytes", subpathReadPlist, ufoPath, "lib.plist")
+    ...     "test" in subpathReadPlist(ufoPath, "lib.plist")
+    ...     subpathWritePlist(lib, ufoPath, "lib.plist")
+    ...     subpathReadPlist(ufoPath, "lib.plist")["test"]
+    ...     subpathExists(ufoPath, "lib.plist")
+    ...     subpathRemoveFile(ufoPath, "lib.plist")
+    ...     subpathExists(ufoPath, "lib.plist")
+    0
+    False
+    1
+    True
+    False
+
+    When a UFO is normalized, each of its property
+    lists is only parsed once.
+
+    >>> normalizeUFO(ufoPath, changeDetector="contentHash")
+    >>> _countCalls("_readPlistFromBytes", ufoPath, changeDetector="contentHash")
+    7
+    >>> shutil.rmtree(directory)
+    """
+
+    def __init__(self, ufoPath):
+        self.ufoPath = ufoPath
+        self._prefix = os.path.join(ufoPath, "")
+        # sessions aren't shared with worker processes
+        self._processID = os.getpid()
+        # file path : contents
+        self._files = {}
+        # file path : (marshalled data, data)
+        self._plists = {}
+        # directory path : {file name : stat result}
+        self._listings = {}
+
+    def __enter__(self):
+        global _ufoSessions
+        with _ufoSessionsLock:
+            _ufoSessions = _ufoSessions + [self]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        global _ufoSessions
+        with _ufoSessionsLock:
+            _ufoSessions = [session for session in _ufoSessions if session is not self]
+        self._files.clear()
+        self._plists.clear()
+        self._listings.clear()
+
+    def contains(self, path):
+        if self._processID != os.getpid():
+            return False
+        return path == self.ufoPath or path.startswith(self._prefix)
+
+    def exists(self, path):
+        directory, fileName = os.path.split(path)
+        listing = self._listings.get(directory)
+        if listing is not None and fileName in listing:
+            return True
+        return path in self._files or os.path.exists(path)
+
+    def readFile(self, path):
+        text = self._files.get(path)
+        if text is None:
+            f = open(path, "rb")
+            text = f.read()
+            f.close()
+            # only property lists are needed more than once
+            if path.endswith(".plist") and len(text) < plistStreamingThreshold:
+                self._files[path] = text
+        return text
+
+    def readPlist(self, path):
+        cached = self._plists.get(path)
+        if cached is None:
+            data = _readPlistFromBytes(self.readFile(path))
+            if path not in self._files:
+                return data
+            try:
+                marshalled = marshal.dumps(data)
+            except ValueError:
+                # dates and data can't be marshalled
+                marshalled = None
+            cached = self._plists[path] = (marshalled, data)
+        marshalled, data = cached
+        if marshalled is None:
+            return copy.deepcopy(data)
+        return marshal.loads(marshalled)
+
+    def scanDirectory(self, path):
+        listing = self._listings.get(path)
+        if listing is None:
+            listing = self._listings[path] = _scanDirectory(path)
+        return dict(listing)
+
+    def fileWritten(self, path, data):
+        self.invalidate(path)
+        if path.endswith(".plist") and len(data) < plistStreamingThreshold:
+            self._files[path] = data
+
+    def invalidate(self, path):
+        """
+        Forget a file or a directory and
+        everything in it.
+        """
+        prefix = os.path.join(path, "")
+        for cache in (self._files, self._plists, self._listings):
+            for key in list(cache.keys()):
+                if key == path or key.startswith(prefix):
+                    del cache[key]
+        self._listings.pop(os.path.dirname(path), None)
+
+# The open sessions. This is replaced instead of
+# changed so that it can be read without the lock.
+_ufoSessions = []
+_ufoSessionsLock = threading.Lock()
+
+def _getUFOSession(path):
+    for session in _ufoSessions:
+        if session.contains(path):
+            return session
+    return None
+
+def _invalidateUFOSession(path):
+    # call after writing a file without the subpath functions
+    session = _getUFOSession(path)
+    if session is not None:
+        session.invalidate(path)
+
 # ---------------
 # Path Operations
 # ---------------
@@ -2879,6 +5106,216 @@ def duplicateUFO(inPath, outPath):
         shutil.rmtree(outPath)
     shutil.copytree(inPath, outPath)
 
+def mirrorUFO(inPath, outPath):
+    """
+    Make the output path match a UFO, copying only what
+    is missing or out of date. A GLIF or plist file in the
+    output is out of date if the source file has been
+    modified or replaced since the output file was written.
+    The source file's change time is checked as well as its
+    mod time because git checkout and cp -p can restore a
+    file with an older mod time. Other
+    files are never modified by the normalizer, so they
+    are hard linked when possible and replaced when their
+    size or mod time differ. Anything in the output that
+    is not in the UFO is removed.
+
+    The normalizer renames GLIF files and layer directories.
+    While the contents.plist or layercontents.plist of a
+    directory is unchanged in the UFO, the one in the output
+    gives the names that the UFO's files were given, and the
+    files are compared under those names. Otherwise, when
+    the GLIF files, plist files or subdirectories in a
+    directory are not the same in the output and in the
+    UFO, the names can't be trusted and all of those are
+    copied again.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> ufoPath = _makeTestUFO(directory, glyphCount=5)
+    >>> outputPath = os.path.join(directory, "Output.ufo")
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    10
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    0
+    >>> subpathWriteFile(_testGLIF % dict(name="a3", x=100), ufoPath, "glyphs", "a3.glif")
+    >>> os.utime(subpathJoin(ufoPath, "glyphs", "a3.glif"), (2000000000, 2000000000))
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    1
+    >>> subpathWriteFile(_testGLIF % dict(name="a4", x=100), ufoPath, "glyphs", "a4.glif")
+    >>> for fileName in ("a3.glif", "a4.glif"):
+    ...     os.utime(subpathJoin(ufoPath, "glyphs", fileName), (1000000000, 1000000000))
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    2
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    0
+    >>> subpathWriteFile("", ufoPath, "glyphs", "stray.txt")
+    >>> mirrorUFO(ufoPath, outputPath)
+    >>> subpathExists(outputPath, "glyphs", "stray.txt")
+    True
+    >>> subpathRemoveFile(ufoPath, "glyphs", "stray.txt")
+    >>> mirrorUFO(ufoPath, outputPath)
+    >>> subpathExists(outputPath, "glyphs", "stray.txt")
+    False
+    >>> st = os.stat(subpathJoin(outputPath, "images", "sketch.png"))
+    >>> st.st_mtime == os.stat(subpathJoin(ufoPath, "images", "sketch.png")).st_mtime
+    True
+
+    non-normalized names
+    --------------------
+    >>> ufoPath = _makeTestUFO(directory, glyphCount=5, fileName="Names.ufo")
+    >>> subpathRenameDirectory(ufoPath, "glyphs.background", "glyphs.bg")
+    >>> subpathWritePlist([["public.default", "glyphs"], ["background", "glyphs.bg"]], ufoPath, "layercontents.plist")
+    >>> subpathRenameFile(ufoPath, ("glyphs", "a1.glif"), ("glyphs", "b.glif"))
+    >>> glyphMapping = subpathReadPlist(ufoPath, "glyphs", "contents.plist")
+    >>> glyphMapping["a1"] = "b.glif"
+    >>> subpathWritePlist(glyphMapping, ufoPath, "glyphs", "contents.plist")
+    >>> outputPath = os.path.join(directory, "NamesOutput.ufo")
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    10
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    0
+    >>> subpathExists(outputPath, "glyphs.background", "a1.glif"), subpathExists(outputPath, "glyphs", "b.glif")
+    (True, False)
+    >>> subpathWriteFile(_testGLIF % dict(name="a1", x=100), ufoPath, "glyphs", "b.glif")
+    >>> os.utime(subpathJoin(ufoPath, "glyphs", "b.glif"), (1000000000, 1000000000))
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    1
+    >>> b'x="100"' in subpathReadFile(outputPath, "glyphs", "a1.glif")
+    True
+    >>> _countNormalizedGLIFs(ufoPath, outputPath=outputPath)
+    0
+    >>> shutil.rmtree(directory)
+    """
+    if os.path.exists(outPath) and not os.path.isdir(outPath):
+        os.remove(outPath)
+    _mirrorDirectory(inPath, outPath, contentsFileName="layercontents.plist")
+
+def _mirrorDirectory(inPath, outPath, force=False, contentsFileName=None):
+    if not os.path.exists(outPath):
+        os.mkdir(outPath)
+        _syncDirectory(os.path.dirname(outPath))
+    inStats = subpathScanDirectory(inPath)
+    outStats = subpathScanDirectory(outPath)
+    # the output names of the source files
+    outNames = None
+    if contentsFileName is not None and not force:
+        outNames = _getMirrorOutputNames(inPath, outPath, inStats, outStats, contentsFileName)
+    trustNames = outNames is not None
+    if not trustNames:
+        outNames = dict((fileName, fileName) for fileName in inStats)
+    outFileNames = set(outNames.values())
+    kept = set()
+    for fileName, outStat in outStats.items():
+        if fileName not in outFileNames:
+            # the normalizer's state has to survive
+            if _isNormalizerStateFile(outPath, fileName):
+                kept.add(fileName)
+                continue
+            _mirrorRemove(os.path.join(outPath, fileName), outStat)
+    if not trustNames:
+        inListing = set(fileName for fileName, st in inStats.items() if _isMirrorTracked(fileName, st))
+        outListing = set(fileName for fileName, st in outStats.items() if _isMirrorTracked(fileName, st))
+        if inListing != outListing - kept:
+            force = True
+    # the layer directories in the UFO
+    layerDirectories = set()
+    if contentsFileName == "layercontents.plist":
+        layerDirectories.add("glyphs")
+        if "layercontents.plist" in inStats:
+            layerDirectories.update(layerDirectory for layerName, layerDirectory in subpathReadPlist(inPath, "layercontents.plist"))
+    for fileName, inStat in sorted(inStats.items()):
+        inFilePath = os.path.join(inPath, fileName)
+        outFilePath = os.path.join(outPath, outNames[fileName])
+        outStat = outStats.get(outNames[fileName])
+        isDirectory = stat.S_ISDIR(inStat.st_mode)
+        if outStat is not None and stat.S_ISDIR(outStat.st_mode) != isDirectory:
+            _mirrorRemove(outFilePath, outStat)
+            outStat = None
+        if isDirectory:
+            if fileName in layerDirectories:
+                _mirrorDirectory(inFilePath, outFilePath, force, "contents.plist")
+            else:
+                _mirrorDirectory(inFilePath, outFilePath, force)
+            continue
+        normalizable = _isMirrorTracked(fileName, inStat)
+        if outStat is not None:
+            if normalizable:
+                if _isMirrorCurrent(inStat, outStat) and not force:
+                    continue
+            elif (outStat.st_size, outStat.st_mtime) == (inStat.st_size, inStat.st_mtime):
+                continue
+            os.remove(outFilePath)
+        if normalizable:
+            # these may be rewritten, so they can't be links
+            shutil.copy2(inFilePath, outFilePath)
+        else:
+            _linkOrCopyFile(inFilePath, outFilePath)
+        _syncCopiedFile(outFilePath)
+        _syncDirectory(outPath)
+
+def _isMirrorCurrent(inStat, outStat):
+    # the output's change time is when it was
+    # copied or normalized.
+    return outStat.st_ctime >= max(inStat.st_mtime, inStat.st_ctime)
+
+def _getMirrorOutputNames(inPath, outPath, inStats, outStats, contentsFileName):
+    # if the contents file in the source hasn't changed
+    # since the one in the output was written, the output's
+    # contents file maps the same keys to the names that the
+    # normalizer gave the files. returns a dict of source
+    # names to output names or None if it can't be used.
+    inStat = inStats.get(contentsFileName)
+    outStat = outStats.get(contentsFileName)
+    if inStat is None or outStat is None or not _isMirrorCurrent(inStat, outStat):
+        return None
+    inContents = dict(subpathReadPlist(inPath, contentsFileName))
+    outContents = dict(subpathReadPlist(outPath, contentsFileName))
+    outNames = dict((fileName, fileName) for fileName in inStats)
+    for key, fileName in inContents.items():
+        if fileName in outNames and key in outContents:
+            outNames[fileName] = outContents[key]
+    # another file in the source may have a name that
+    # the normalizer gave to a file
+    if len(set(fileName.lower() for fileName in outNames.values())) != len(outNames):
+        return None
+    return outNames
+
+def _isMirrorTracked(fileName, st):
+    # the files and directories that the normalizer may write or rename
+    if stat.S_ISDIR(st.st_mode):
+        return True
+    return os.path.splitext(fileName)[-1].lower() in (".glif", ".plist")
+
+def _isNormalizerStateFile(directory, fileName):
+    # a lib.plist or layerinfo.plist that only
+    # exists to hold the state stored in the UFO.
+    if fileName not in ("lib.plist", "layerinfo.plist"):
+        return False
+    data = subpathReadPlist(directory, fileName)
+    if fileName == "layerinfo.plist":
+        if set(data.keys()) - set(["lib"]):
+            return False
+        data = data.get("lib", {})
+    return not set(data.keys()) - set([modTimeLibKey, imageReferencesLibKey])
+
+def _mirrorRemove(path, st):
+    if stat.S_ISDIR(st.st_mode):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+def _linkOrCopyFile(inPath, outPath):
+    link = getattr(os, "link", None)
+    if link is not None:
+        try:
+            link(inPath, outPath)
+            return
+        except OSError:
+            # different devices or no hard link support
+            pass
+    shutil.copy2(inPath, outPath)
+
 def subpathJoin(ufoPath, *subpath):
     """
     Join path parts.
@@ -2898,6 +5335,9 @@ def subpathExists(ufoPath, *subpath):
     Get a boolean indicating if a path exists.
     """
     path = subpathJoin(ufoPath, *subpath)
+    session = _getUFOSession(path)
+    if session is not None:
+        return session.exists(path)
     return os.path.exists(path)
 
 # read
@@ -2907,6 +5347,9 @@ def subpathReadFile(ufoPath, *subpath):
     Read the contents of a file.
     """
     path = subpathJoin(ufoPath, *subpath)
+    session = _getUFOSession(path)
+    if session is not None:
+        return session.readFile(path)
     f = open(path, "rb")
     text = f.read()
     f.close()
@@ -2917,39 +5360,117 @@ def subpathReadPlist(ufoPath, *subpath):
     Read the contents of a property list
     and convert it into a Python object.
     """
+    path = subpathJoin(ufoPath, *subpath)
+    session = _getUFOSession(path)
+    if session is not None:
+        return session.readPlist(path)
     text = subpathReadFile(ufoPath, *subpath)
     return _readPlistFromBytes(text)
 
 # write
 
-def subpathWriteFile(data, ufoPath, *subpath):
+def subpathWriteFile(data, ufoPath, *subpath, **kwargs):
     """
     Write data to a file.
 
     This will only modify the file if the
     file contains data that is different
-    from the new data.
+    from the new data. If the caller has already
+    read the file, the data that was read can be
+    given as existing so that the file isn't read
+    again. Text is written as UTF-8.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> subpathWriteFile(u"abc", directory, "a.txt")
+    >>> modTime = subpathGetModTime(directory, "a.txt")
+    >>> os.utime(subpathJoin(directory, "a.txt"), (0, 0))
+    >>> subpathWriteFile(u"abc", directory, "a.txt")
+    >>> subpathGetModTime(directory, "a.txt")
+    0.0
+    >>> subpathWriteFile(b"xyz", directory, "a.txt", existing=b"xyz")
+    >>> subpathReadFile(directory, "a.txt") == b"abc"
+    True
+    >>> subpathWriteFile(b"xyz", directory, "a.txt", existing=b"abc")
+    >>> subpathReadFile(directory, "a.txt") == b"xyz"
+    True
+
+    The file is written to a temporary file that then
+    replaces it, so the file is never partly written.
+
+    >>> os.chmod(subpathJoin(directory, "a.txt"), 0o640)
+    >>> subpathWriteFile(b"abc", directory, "a.txt")
+    >>> os.listdir(directory)
+    ['a.txt']
+    >>> stat.S_IMODE(os.stat(subpathJoin(directory, "a.txt")).st_mode) == 0o640
+    True
+    >>> shutil.rmtree(directory)
     """
     path = subpathJoin(ufoPath, *subpath)
-    if subpathExists(ufoPath, *subpath):
+    data = tobytes(data, "utf-8")
+    if "existing" in kwargs:
+        existing = kwargs["existing"]
+    elif subpathExists(ufoPath, *subpath):
         existing = subpathReadFile(ufoPath, *subpath)
     else:
         existing = None
     if data != existing:
-        f = open(path, "wb")
-        f.write(tobytes(data))
-        f.close()
+        _writeFileAtomically(path, [data])
+        session = _getUFOSession(path)
+        if session is not None:
+            session.fileWritten(path, data)
+
+_writeTempNamePattern = ".org.unifiedfontobject.normalizer.%d.%d.tmp"
+_writeTempCounter = itertools.count()
+
+def _writeFileAtomically(path, chunks):
+    # write the chunks to a temporary file in the same
+    # directory and replace the file with it.
+    directory = os.path.dirname(path)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    while True:
+        tempPath = os.path.join(directory, _writeTempNamePattern % (os.getpid(), next(_writeTempCounter)))
+        try:
+            fd = os.open(tempPath, flags, 0o666)
+            break
+        except OSError as e:
+            # left behind by an interrupted run
+            if e.errno != errno.EEXIST:
+                raise
+    try:
+        f = os.fdopen(fd, "wb")
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+            if _syncEachFile():
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+        try:
+            shutil.copymode(path, tempPath)
+        except OSError:
+            # a new file
+            pass
+        _replaceFile(tempPath, path)
+    except BaseException:
+        try:
+            os.remove(tempPath)
+        except OSError:
+            pass
+        raise
+    _syncDirectory(directory)
 
 def subpathWritePlist(data, ufoPath, *subpath):
     """
-    Write a Python object to a property list.
-    THIS DOES NOT WRITE NORMALIZED OUTPUT.
+    Write a Python object to a normalized
+    property list.
 
     This will only modify the file if the
     file contains data that is different
     from the new data.
     """
-    data = _writePlistToBytes(data)
+    data = _normalizePropertyListToBytes(data)
     subpathWriteFile(data, ufoPath, *subpath)
 
 # rename
@@ -2964,7 +5485,10 @@ def subpathRenameFile(ufoPath, fromSubpath, toSubpath):
         toSubpath = [toSubpath]
     inPath = subpathJoin(ufoPath, *fromSubpath)
     outPath = subpathJoin(ufoPath, *toSubpath)
-    os.rename(inPath, outPath)
+    _replaceFile(inPath, outPath)
+    _invalidateUFOSession(inPath)
+    _invalidateUFOSession(outPath)
+    _syncDirectory(os.path.dirname(outPath))
 
 def subpathRenameDirectory(ufoPath, fromSubpath, toSubpath):
     """
@@ -2977,6 +5501,145 @@ def subpathRenameDirectory(ufoPath, fromSubpath, toSubpath):
     inPath = subpathJoin(ufoPath, *fromSubpath)
     outPath = subpathJoin(ufoPath, *toSubpath)
     shutil.move(inPath, outPath)
+    _invalidateUFOSession(inPath)
+    _invalidateUFOSession(outPath)
+    _syncDirectory(os.path.dirname(outPath))
+
+def subpathRenameMany(ufoPath, directorySubpath, renames, renameFunction=None):
+    """
+    Rename files, or directories if renameFunction is
+    subpathRenameDirectory, in a directory following the
+    plan made by planRenames. Returns the number of renames
+    that were saved by not moving every file through a
+    temporary name.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> for fileName in ("a", "b", "c", "d"):
+    ...     subpathWriteFile(fileName, directory, fileName)
+    >>> subpathRenameMany(directory, (), [("a", "b"), ("b", "a"), ("c", "e"), ("d", "d")])
+    2
+    >>> [(fileName, subpathReadFile(directory, fileName)) for fileName in sorted(os.listdir(directory))] == [("a", b"b"), ("b", b"a"), ("d", b"d"), ("e", b"c")]
+    True
+    >>> shutil.rmtree(directory)
+    """
+    if renameFunction is None:
+        renameFunction = subpathRenameFile
+    directorySubpath = tuple(directorySubpath)
+    plan = planRenames(renames)
+    for fromName, toName in plan:
+        renameFunction(ufoPath, directorySubpath + (fromName,), directorySubpath + (toName,))
+    renameCount = len([oldName for oldName, newName in renames if oldName != newName])
+    return 2 * renameCount - len(plan)
+
+# os.replace is not available in Python 2. os.rename
+# replaces the destination everywhere except Windows,
+# where the destination has to be removed first. that
+# isn't atomic, so a crash between the two can leave
+# the destination missing.
+
+def _replaceFileByRemoving(fromPath, toPath):
+    try:
+        os.rename(fromPath, toPath)
+    except OSError:
+        # only remove the destination if that is why the
+        # rename failed. a case only rename finds the source
+        # as the destination.
+        if not os.path.exists(fromPath) or not os.path.exists(toPath):
+            raise
+        if os.path.normcase(fromPath) == os.path.normcase(toPath):
+            raise
+        os.remove(toPath)
+        os.rename(fromPath, toPath)
+
+if hasattr(os, "replace"):
+    _replaceFile = os.replace
+elif os.name == "nt":
+    _replaceFile = _replaceFileByRemoving
+else:
+    _replaceFile = os.rename
+
+_renameTempNamePattern = "org.unifiedfontobject.normalizer.%d"
+
+def planRenames(renames):
+    """
+    Plan the renames that give files in one directory new
+    names. renames is a list of (old name, new name) tuples
+    and the new names must be unique. The plan is a list of
+    (from name, to name) tuples that can be done in order
+    without a file replacing another file that is still
+    waiting to be renamed. A file is only renamed through a
+    temporary name when it is part of a cycle of renames.
+
+    >>> planRenames([("a", "b"), ("b", "c"), ("d", "d")])
+    [('b', 'c'), ('a', 'b')]
+    >>> planRenames([("a", "b"), ("b", "a"), ("c", "e")])
+    [('a', 'org.unifiedfontobject.normalizer.0'), ('b', 'a'), ('org.unifiedfontobject.normalizer.0', 'b'), ('c', 'e')]
+
+    Names are compared without case because the file
+    system may not distinguish them.
+
+    >>> planRenames([("a", "B"), ("b", "c")])
+    [('b', 'c'), ('a', 'B')]
+    >>> planRenames([("a", "A"), ("b", "a")])
+    [('a', 'A'), ('b', 'a')]
+
+    If old names only differ by case, every file is
+    renamed through a temporary name.
+
+    >>> planRenames([("a", "b"), ("A", "c")])
+    [('a', 'org.unifiedfontobject.normalizer.0'), ('A', 'org.unifiedfontobject.normalizer.1'), ('org.unifiedfontobject.normalizer.0', 'b'), ('org.unifiedfontobject.normalizer.1', 'c')]
+    """
+    renames = [(oldName, newName) for oldName, newName in renames if oldName != newName]
+    usedNames = set()
+    for oldName, newName in renames:
+        usedNames.add(oldName.lower())
+        usedNames.add(newName.lower())
+    tempNames = _iterRenameTempNames(usedNames)
+    # the renames by case-folded old name
+    pending = OrderedDict()
+    for oldName, newName in renames:
+        pending[oldName.lower()] = (oldName, newName)
+    if len(pending) != len(renames):
+        toTemp = []
+        fromTemp = []
+        for oldName, newName in renames:
+            tempName = next(tempNames)
+            toTemp.append((oldName, tempName))
+            fromTemp.append((tempName, newName))
+        return toTemp + fromTemp
+    plan = []
+    for key in list(pending.keys()):
+        if key not in pending:
+            continue
+        # follow the renames that are in the way
+        chain = [key]
+        while True:
+            blocker = pending[chain[-1]][1].lower()
+            if blocker not in pending or blocker == chain[-1]:
+                break
+            if blocker in chain:
+                # new names are unique so this is a cycle that
+                # starts at the first rename in the chain. it is
+                # broken by moving that file out of the way.
+                oldName, newName = pending.pop(blocker)
+                tempName = next(tempNames)
+                plan.append((oldName, tempName))
+                pending[tempName.lower()] = (tempName, newName)
+                chain[0] = tempName.lower()
+                break
+            chain.append(blocker)
+        for link in reversed(chain):
+            plan.append(pending.pop(link))
+    return plan
+
+def _iterRenameTempNames(usedNames):
+    index = 0
+    while True:
+        tempName = _renameTempNamePattern % index
+        index += 1
+        if tempName.lower() not in usedNames:
+            yield tempName
 
 # remove
 
@@ -2987,6 +5650,8 @@ def subpathRemoveFile(ufoPath, *subpath):
     if subpathExists(ufoPath, *subpath):
         path = subpathJoin(ufoPath, *subpath)
         os.remove(path)
+        _invalidateUFOSession(path)
+        _syncDirectory(os.path.dirname(path))
 
 # mod times
 
@@ -2997,61 +5662,958 @@ def subpathGetModTime(ufoPath, *subpath):
     path = subpathJoin(ufoPath, *subpath)
     return os.path.getmtime(path)
 
+def subpathGetContentHash(ufoPath, *subpath):
+    """
+    Get a hash of the contents of a file.
+    """
+    data = subpathReadFile(ufoPath, *subpath)
+    return contentHash(data)
+
+def subpathGetSignature(changeDetector, ufoPath, *subpath):
+    """
+    Get the value that the given change detector records
+    for a file. This is prefixed with the fingerprint of
+    the rules that the file is normalized with.
+    """
+    return _getSignature(changeDetector, ufoPath, subpath)
+
+def _getSignature(changeDetector, ufoPath, subpath, st=None, data=None):
+    # st is the file's stat result and data is
+    # the file's contents if they are already known.
+    if changeDetector == "contentHash":
+        if data is None:
+            signature = subpathGetContentHash(ufoPath, *subpath)
+        else:
+            signature = contentHash(data)
+    else:
+        if st is None:
+            modTime = subpathGetModTime(ufoPath, *subpath)
+        else:
+            modTime = st.st_mtime
+        signature = _formatModTime(modTime)
+    return getRuleFingerprint(subpath[-1]) + ":" + signature
+
 def subpathNeedsRefresh(modTimes, ufoPath, *subPath):
     """
     Determine if a file needs to be refreshed.
-    Returns True if the file's latest modification time is different
-    from its previous modification time.
+    Returns True if the file's latest signature (modification
+    time or content hash) is different from its previous signature.
     """
+    return _needsRefresh(modTimes, ufoPath, subPath)
+
+def _needsRefresh(modTimes, ufoPath, subPath, st=None):
+    # st is the file's stat result if it is already known
     previous = modTimes.get(subPath[-1])
     if previous is None:
         return True
-    latest = subpathGetModTime(ufoPath, *subPath)
+    # the file must be normalized with new rules
+    if not previous.startswith(getRuleFingerprint(subPath[-1]) + ":"):
+        return True
+    changeDetector = _getChangeDetector(modTimes)
+    latest = _getSignature(changeDetector, ufoPath, subPath, st)
     return latest != previous
 
+# directories
+
+def subpathScanDirectory(ufoPath, *subpath):
+    """
+    Get a mapping of file names to stat results for
+    everything in a directory. This is done with one
+    pass over the directory so that checking a whole
+    layer doesn't need a path lookup for every file.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> subpathWriteFile(b"abc", directory, "a.glif")
+    >>> os.mkdir(os.path.join(directory, "b"))
+    >>> stats = subpathScanDirectory(directory)
+    >>> sorted(stats.keys())
+    ['a.glif', 'b']
+    >>> stats["a.glif"].st_size
+    3
+    >>> stats["a.glif"].st_mtime == subpathGetModTime(directory, "a.glif")
+    True
+    >>> shutil.rmtree(directory)
+    """
+    path = ufoPath
+    if subpath:
+        path = subpathJoin(ufoPath, *subpath)
+    session = _getUFOSession(path)
+    if session is not None:
+        return session.scanDirectory(path)
+    return _scanDirectory(path)
+
+def _scanDirectory(path):
+    stats = {}
+    if scandir is not None:
+        for entry in scandir(path):
+            stats[entry.name] = entry.stat()
+    else:
+        for fileName in os.listdir(path):
+            stats[fileName] = os.stat(os.path.join(path, fileName))
+    return stats
+
+# durability
+
+# How the files that are written are made durable:
+# none - leave it to the operating system.
+# file - sync each file and its directory when it is written.
+# batch - sync each file when it is written and sync the
+#         directories that were written to once, when
+#         syncWrites is called at the end of the run. a run
+#         writes many files to a few directories.
+writeDurabilities = ("none", "file", "batch")
+writeDurability = "none"
+
+# the directories that batch has yet to sync
+_unsyncedDirectories = set()
+_unsyncedDirectoriesLock = threading.Lock()
+
+def setWriteDurability(name):
+    """
+    Set how written files are made durable.
+
+    >>> setWriteDurability("batch")
+    >>> getWriteDurability()
+    'batch'
+    >>> setWriteDurability("foo")
+    Traceback (most recent call last):
+        ...
+    UFONormalizerError: Unknown write durability: foo
+    >>> setWriteDurability("none")
+    """
+    global writeDurability
+    if name not in writeDurabilities:
+        raise UFONormalizerError("Unknown write durability: %s" % name)
+    writeDurability = name
+
+def getWriteDurability():
+    """
+    Get how written files are made durable.
+    """
+    return writeDurability
+
+def syncWrites():
+    """
+    Sync the directories that have been written to since
+    the last call when the write durability is batch. Only
+    the files that were written and their directories are
+    synced, not everything on the system.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> setWriteDurability("batch")
+    >>> synced = []
+    >>> fsync = os.fsync
+    >>> os.fsync = synced.append
+    >>> for fileName in ("a.txt", "b.txt"):
+    ...     subpathWriteFile(b"abc", directory, fileName)
+    >>> directory in _unsyncedDirectories
+    True
+    >>> syncWrites()
+    >>> os.fsync = fsync
+    >>> directory in _unsyncedDirectories
+    False
+    >>> len(synced) == (2 if os.name == "nt" else 3)
+    True
+    >>> setWriteDurability("none")
+    >>> shutil.rmtree(directory)
+    """
+    with _unsyncedDirectoriesLock:
+        directories = sorted(_unsyncedDirectories)
+        _unsyncedDirectories.clear()
+    # the files were synced when they were written
+    for directory in directories:
+        if os.path.isdir(directory):
+            _fsyncDirectory(directory)
+
+def _syncEachFile():
+    return writeDurability in ("file", "batch")
+
+def _syncCopiedFile(path):
+    # call after a file has been copied or linked
+    # without _writeFileAtomically.
+    if _syncEachFile():
+        # Windows can only sync files that are open for writing
+        fd = os.open(path, os.O_RDWR if os.name == "nt" else os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _syncDirectory(directory):
+    # call after a file in the directory has been
+    # written, renamed or removed.
+    if writeDurability == "file":
+        _fsyncDirectory(directory)
+    elif writeDurability == "batch":
+        with _unsyncedDirectoriesLock:
+            _unsyncedDirectories.add(directory)
+
+def _fsyncDirectory(directory):
+    # directories can't be opened on Windows
+    if os.name == "nt":
+        return
+    fd = os.open(directory or os.curdir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# -------------------
+# Parallel Processing
+# -------------------
+
+# The number of GLIF files handed to a worker process at a time.
+glifChunkSize = 32
+
+def createWorkerPool(jobs):
+    """
+    Create a process pool for normalizing GLIF files.
+    A jobs value of 0 or less will use one process per CPU.
+    Returns None if the work should be done in this process.
+
+    >>> createWorkerPool(1) is None
+    True
+    >>> createWorkerPool(None) is None
+    True
+
+    The workers use the XML backend and write durability
+    of this process.
+
+    >>> setWriteDurability("batch")
+    >>> pool = createWorkerPool(2)
+    >>> pool.apply(getWriteDurability)
+    'batch'
+    >>> pool.apply(_getXMLBackendName) == getXMLBackend().name
+    True
+    >>> pool.close()
+    >>> pool.join()
+    >>> setWriteDurability("none")
+    """
+    jobs = getWorkerCount(jobs)
+    if jobs == 1:
+        return None
+    # processes that are spawned instead of forked
+    # don't inherit the settings of this process.
+    settings = (getXMLBackend().name, getWriteDurability())
+    return multiprocessing.Pool(jobs, initializer=_initializeWorker, initargs=settings)
+
+def _initializeWorker(xmlBackendName, durability):
+    setXMLBackend(xmlBackendName)
+    setWriteDurability(durability)
+
+def _getXMLBackendName():
+    return getXMLBackend().name
+
+def getWorkerCount(jobs):
+    """
+    Get the number of processes for a jobs value.
+
+    >>> getWorkerCount(None)
+    1
+    >>> getWorkerCount(0) == multiprocessing.cpu_count()
+    True
+    """
+    if jobs is None:
+        jobs = 1
+    if jobs < 1:
+        jobs = multiprocessing.cpu_count()
+    return jobs
+
+def normalizeGLIFFiles(ufoPath, layerDirectory, fileNames, pool=None, changeDetector="modTime", glifEngine=None):
+    """
+    Normalize GLIF files in a layer directory. glifEngine
+    is the engine given to normalizeGLIF. If it is None,
+    the engine is chosen by file size.
+
+    This returns a list of (file name, image file name, signature)
+    tuples in the same order as fileNames, regardless of how the
+    work was distributed. This keeps the stored results identical
+    to those of a serial run.
+
+    >>> import tempfile
+    >>> glifFolderPath = os.path.join(_testDataDirectory, 'glif')
+    >>> fileNames = ['format1.glif', 'format2.glif']
+    >>> directory = tempfile.mkdtemp()
+    >>> serialDirectory = os.path.join(directory, 'serial')
+    >>> parallelDirectory = os.path.join(directory, 'parallel')
+    >>> for d in (serialDirectory, parallelDirectory):
+    ...     d = shutil.copytree(glifFolderPath, os.path.join(d, 'glyphs'))
+    >>> serial = normalizeGLIFFiles(serialDirectory, 'glyphs', fileNames)
+    >>> [(fileName, imageFileName) for fileName, imageFileName, signature in serial] == [('format1.glif', None), ('format2.glif', 'period sketch.png')]
+    True
+    >>> pool = createWorkerPool(2)
+    >>> parallel = normalizeGLIFFiles(parallelDirectory, 'glyphs', fileNames, pool=pool, glifEngine="numpy")
+    >>> pool.close()
+    >>> pool.join()
+    >>> [result[:2] for result in parallel] == [result[:2] for result in serial]
+    True
+    >>> all(subpathReadFile(serialDirectory, 'glyphs', fileName) == subpathReadFile(parallelDirectory, 'glyphs', fileName) for fileName in fileNames)
+    True
+    >>> shutil.rmtree(directory)
+    """
+    tasks = [(ufoPath, layerDirectory, fileName, changeDetector, glifEngine) for fileName in fileNames]
+    if pool is None or len(tasks) < 2:
+        results = [_normalizeGLIFTask(task) for task in tasks]
+    else:
+        results = list(pool.imap(_normalizeGLIFTask, tasks, glifChunkSize))
+    # the files may have been written by other processes
+    if results:
+        layerPath = subpathJoin(ufoPath, layerDirectory)
+        _invalidateUFOSession(layerPath)
+        _syncDirectory(layerPath)
+    return results
+
+def _normalizeGLIFTask(task):
+    # this is called in the worker processes so it
+    # must be a module level function that can be pickled.
+    ufoPath, layerDirectory, fileName, changeDetector, glifEngine = task
+    subpath = (layerDirectory, fileName)
+    imageFileName, data = _normalizeGLIFFile(ufoPath, subpath, glifEngine)
+    signature = _getSignature(changeDetector, ufoPath, subpath, data=data)
+    return fileName, imageFileName, signature
+
+# -------------------
+# Normalization Rules
+# -------------------
+
+# The normalization rules are grouped into sets and each set
+# has a version. The version of a set must be increased when
+# a change to the normalizer changes the output of its rules.
+# The fingerprint of the rule versions that a file depends on
+# is stored with the file's mod time, so after an upgrade only
+# the files whose rules have changed will be normalized again.
+
+normalizationRuleVersions = dict(
+    # XML formatting: indentation, escaping, attribute order and numbers
+    xml=1,
+    # property list structure
+    propertyList=2,
+    # fontinfo.plist specific values
+    fontInfo=1,
+    # layerinfo.plist specific values
+    layerInfo=1,
+    # GLIF elements other than the outline and the lib
+    glif=1,
+    # GLIF contours, points and components
+    glifOutline=1,
+    # GLIF lib
+    glifLib=2,
+    # user name to file name conversion
+    fileNames=2,
+)
+
+# file names or extensions -> the rule sets the files depend on
+normalizationRuleDependencies = {
+    ".glif" : ("xml", "propertyList", "glif", "glifOutline", "glifLib"),
+    ".plist" : ("xml", "propertyList"),
+    "fontinfo.plist" : ("xml", "propertyList", "fontInfo"),
+    "layerinfo.plist" : ("xml", "propertyList", "layerInfo"),
+    "contents.plist" : ("xml", "propertyList", "fileNames"),
+    "layercontents.plist" : ("xml", "propertyList", "fileNames"),
+}
+
+def getRuleFingerprint(fileName):
+    """
+    Get a fingerprint of the versions of the rule
+    sets that a file is normalized with.
+
+    >>> len(getRuleFingerprint("a.glif"))
+    8
+    >>> getRuleFingerprint("a.glif") == getRuleFingerprint("glyphs/b.glif")
+    True
+    >>> getRuleFingerprint("groups.plist") == getRuleFingerprint("kerning.plist")
+    True
+    >>> getRuleFingerprint("groups.plist") == getRuleFingerprint("fontinfo.plist")
+    False
+
+    >>> fingerprints = [getRuleFingerprint(fileName) for fileName in ("a.glif", "fontinfo.plist")]
+    >>> normalizationRuleVersions["fontInfo"] += 1
+    >>> getRuleFingerprint("a.glif") == fingerprints[0]
+    True
+    >>> getRuleFingerprint("fontinfo.plist") == fingerprints[1]
+    False
+    >>> normalizationRuleVersions["fontInfo"] -= 1
+    """
+    # this is called for every file, so the fingerprints
+    # are cached until the rule versions are changed.
+    if _ruleFingerprintVersions != normalizationRuleVersions:
+        _ruleFingerprintCache.clear()
+        _ruleFingerprintVersions.clear()
+        _ruleFingerprintVersions.update(normalizationRuleVersions)
+    baseName = os.path.basename(fileName)
+    if baseName in normalizationRuleDependencies:
+        key = baseName
+    else:
+        key = os.path.splitext(baseName)[-1]
+    fingerprint = _ruleFingerprintCache.get(key)
+    if fingerprint is None:
+        ruleSets = normalizationRuleDependencies.get(key, ())
+        text = ";".join("%s=%d" % (ruleSet, normalizationRuleVersions[ruleSet]) for ruleSet in ruleSets)
+        fingerprint = hashlib.md5(tobytes(text)).hexdigest()[:8]
+        _ruleFingerprintCache[key] = fingerprint
+    return fingerprint
+
+_ruleFingerprintCache = {}
+_ruleFingerprintVersions = {}
+
 # ---------------
 # Store Mod Times
 # ---------------
 
+# Modified files are detected either by their modification
+# times or by a hash of their contents. The mod times are
+# cheaper to get, but they change whenever a file is copied
+# or checked out. The content hashes survive that.
+
+changeDetectors = ("modTime", "contentHash")
+
+try:
+    hashlib.blake2b
+
+    def contentHash(data):
+        """
+        Get a hash of the data.
+
+        >>> len(contentHash(b"abc"))
+        32
+        >>> contentHash(b"abc") == contentHash("abc")
+        True
+        """
+        return hashlib.blake2b(tobytes(data), digest_size=16).hexdigest()
+
+    contentHashName = "blake2b"
+except AttributeError:
+    def contentHash(data):
+        return hashlib.md5(tobytes(data)).hexdigest()
+
+    contentHashName = "md5"
+
+class FileSignatures(dict):
+
+    """
+    A mapping of file names to the signatures that were
+    recorded for the files during the previous normalization.
+    The signatures are either mod times or content hashes,
+    depending on the change detector.
+    """
+
+    def __init__(self, changeDetector="modTime"):
+        super(FileSignatures, self).__init__()
+        self.changeDetector = changeDetector
+
+def _getChangeDetector(modTimes):
+    # plain dicts are used when the signatures will be thrown away
+    return getattr(modTimes, "changeDetector", "modTime")
+
+def _getChangeDetectorTag(changeDetector):
+    """
+    Get the tag that identifies how signatures were made.
+
+    >>> _getChangeDetectorTag("modTime")
+    'modTime'
+    >>> _getChangeDetectorTag("contentHash") == "contentHash " + contentHashName
+    True
+    """
+    if changeDetector == "contentHash":
+        return "%s %s" % (changeDetector, contentHashName)
+    return changeDetector
+
 def storeModTimes(lib, modTimes):
     """
     Write the file mod times to the lib.
+
+    >>> lib = {}
+    >>> modTimes = FileSignatures()
+    >>> modTimes["a.glif"] = "a1b2c3d4:1436134578.1"
+    >>> storeModTimes(lib, modTimes)
+    >>> readModTimes(lib) == modTimes
+    True
+    >>> readModTimes(lib, "contentHash")
+    {}
+
+    >>> modTimes = FileSignatures("contentHash")
+    >>> modTimes["a b.glif"] = "a1b2c3d4:" + contentHash(b"abc")
+    >>> storeModTimes(lib, modTimes)
+    >>> readModTimes(lib, "contentHash") == modTimes
+    True
+    >>> readModTimes(lib)
+    {}
     """
     lines = [
         "version: %s" % __version__
     ]
-    for fileName, modTime in sorted(modTimes.items()):
-        line = "%.1f %s" % (modTime, fileName)
+    changeDetector = _getChangeDetector(modTimes)
+    # mod times are stored without a detector line so
+    # that older versions of the normalizer can read them.
+    if changeDetector != "modTime":
+        lines.append("detector: %s" % _getChangeDetectorTag(changeDetector))
+    for fileName, signature in sorted(modTimes.items()):
+        line = "%s %s" % (signature, fileName)
         lines.append(line)
     text = "\n".join(lines)
     lib[modTimeLibKey] = text
 
-def readModTimes(lib):
+def _formatModTime(modTime):
+    """
+    Format a mod time for storage.
+
+    >>> _formatModTime(1436134578.123456)
+    '1436134578.1'
+    """
+    return "%.1f" % modTime
+
+def readModTimes(lib, changeDetector="modTime"):
     """
     Read the file mod times from the lib.
+    If they were not recorded by the given change
+    detector, nothing will be returned.
+
+    The normalizer version that stored the mod times
+    is not checked. Each mod time carries the fingerprint
+    of the rules used to normalize its file and
+    subpathNeedsRefresh compares that to the current
+    rules instead.
     """
-    # TO DO: a version mismatch causing a complete
-    # renomalization of existing files sucks. but,
-    # I haven't been able to come up with a better
-    # solution. maybe we could keep track of what
-    # would need new normalization from version to
-    # version and only trigger it as needed. most
-    # new versions aren't going to require a complete
-    # rerun of everything.
+    modTimes = FileSignatures(changeDetector)
     text = lib.get(modTimeLibKey)
     if not text:
-        return {}
+        return modTimes
     lines = text.splitlines()
-    version = lines.pop(0).split(":")[-1].strip()
-    if version != __version__:
-        return {}
-    modTimes = {}
+    # version line
+    lines.pop(0)
+    storedChangeDetector = "modTime"
+    if lines and lines[0].startswith("detector:"):
+        storedChangeDetector = lines.pop(0).split(":", 1)[-1].strip()
+    if storedChangeDetector != _getChangeDetectorTag(changeDetector):
+        return modTimes
     for line in lines:
-        modTime, fileName = line.split(" ", 1)
-        modTime = float(modTime)
-        modTimes[fileName] = modTime
+        signature, fileName = line.split(" ", 1)
+        modTimes[fileName] = signature
     return modTimes
 
+# ------------
+# State Stores
+# ------------
+
+# The data used to find modified files is kept in a state
+# store. The state is grouped into scopes: "" for the top
+# level files and the layer directory name for each layer.
+# A state store implements these methods:
+#
+# readModTimes(ufoPath, scope, changeDetector)
+# readImageReferences(ufoPath, scope)
+# storeState(ufoPath, scope, modTimes, imageReferences=None)
+# readSummary(ufoPath, scope)
+# storeSummary(ufoPath, scope, summary)
+# readFileNames(key)
+# readFileNamesKey(ufoPath, scope, version)
+# storeFileNames(ufoPath, scope, key, version, fileNames, isClashFree)
+# commit()
+# close()
+#
+# The file names are the glyph file names made for a glyph set.
+# key identifies the glyph set and readFileNames returns a tuple
+# of the file names dict and isClashFree or None. version is the
+# version of the fileNames rules that the file names were made
+# with. readFileNamesKey only returns the key of the glyph set
+# that was last stored for the scope if it has the same version.
+# Stores that can't hold them return None.
+#
+# The storesStateInUFO attribute indicates if storing
+# the state modifies lib.plist and layerinfo.plist.
+# Directory summaries can't be used by stores that do
+# because storing a summary would change the files
+# that it summarizes.
+
+class LibStateStore(object):
+
+    """
+    Store the state in the UFO. The top level state goes
+    into lib.plist and the layer state goes into the lib
+    in the layer's layerinfo.plist.
+    """
+
+    storesStateInUFO = True
+
+    def _getLibLocation(self, scope):
+        if scope:
+            return (scope, "layerinfo.plist")
+        return ("lib.plist",)
+
+    def _readPlist(self, ufoPath, scope):
+        location = self._getLibLocation(scope)
+        if not subpathExists(ufoPath, *location):
+            return {}
+        return subpathReadPlist(ufoPath, *location)
+
+    def _readLib(self, ufoPath, scope):
+        data = self._readPlist(ufoPath, scope)
+        if scope:
+            return data.get("lib", {})
+        return data
+
+    def readModTimes(self, ufoPath, scope, changeDetector="modTime"):
+        return readModTimes(self._readLib(ufoPath, scope), changeDetector)
+
+    def readImageReferences(self, ufoPath, scope):
+        return readImageReferences(self._readLib(ufoPath, scope))
+
+    def storeState(self, ufoPath, scope, modTimes, imageReferences=None):
+        data = self._readPlist(ufoPath, scope)
+        if scope:
+            lib = data.get("lib", {})
+            data["lib"] = lib
+        else:
+            lib = data
+        storeModTimes(lib, modTimes)
+        if imageReferences is not None:
+            storeImageReferences(lib, imageReferences)
+        subpathWritePlist(data, ufoPath, *self._getLibLocation(scope))
+
+    def readSummary(self, ufoPath, scope):
+        return None
+
+    def storeSummary(self, ufoPath, scope, summary):
+        pass
+
+    def readFileNames(self, key):
+        return None
+
+    def readFileNamesKey(self, ufoPath, scope, version):
+        return None
+
+    def storeFileNames(self, ufoPath, scope, key, version, fileNames, isClashFree):
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+class SQLiteStateStore(object):
+
+    """
+    Store the state in an SQLite database outside of the UFO.
+    This keeps lib.plist and layerinfo.plist from being
+    modified when only the state has changed. One database
+    can hold the state of any number of UFOs and the store
+    can be shared by threads that normalize different UFOs.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> ufoPath = _makeTestUFO(directory, glyphCount=5)
+    >>> stateStore = SQLiteStateStore(os.path.join(directory, "state.db"))
+    >>> _countNormalizedGLIFs(ufoPath, stateStore=stateStore)
+    10
+    >>> libModTime = subpathGetModTime(ufoPath, "lib.plist")
+    >>> _countNormalizedGLIFs(ufoPath, stateStore=stateStore)
+    0
+    >>> subpathGetModTime(ufoPath, "lib.plist") == libModTime
+    True
+    >>> modTimeLibKey in subpathReadPlist(ufoPath, "lib.plist")
+    False
+    >>> sorted(stateStore.readModTimes(ufoPath, "glyphs").keys()) == ["a0.glif", "a1.glif", "a2.glif", "a3.glif", "a4.glif", "contents.plist"]
+    True
+    >>> subpathExists(ufoPath, "glyphs", "layerinfo.plist")
+    False
+    >>> stateStore.readImageReferences(ufoPath, "glyphs") == {"a0.glif": "sketch.png"}
+    True
+    >>> subpathWriteFile(_testGLIF % dict(name="a3", x=1), ufoPath, "glyphs", "a3.glif")
+    >>> os.utime(subpathJoin(ufoPath, "glyphs", "a3.glif"), (0, 0))
+    >>> _countNormalizedGLIFs(ufoPath, stateStore=stateStore)
+    1
+
+    directory summaries
+    -------------------
+    >>> _countCalls("subpathReadPlist", ufoPath, stateStore=stateStore)
+    0
+    >>> subpathWriteFile(_testGLIF % dict(name="a3", x=2), ufoPath, "glyphs.background", "a3.glif")
+    >>> _countCalls("normalizeGlyphNames", ufoPath, stateStore=stateStore)
+    1
+    >>> _countCalls("subpathReadPlist", ufoPath, stateStore=stateStore)
+    0
+    >>> _countCalls("subpathReadPlist", ufoPath, stateStore=stateStore, trustDirectoryModTimes=True) > 0
+    True
+    >>> _countCalls("subpathReadPlist", ufoPath, stateStore=stateStore, trustDirectoryModTimes=True)
+    0
+    >>> subpathWriteFile(_testGLIF % dict(name="a4", x=1), ufoPath, "glyphs", "a4.tmp")
+    >>> subpathRenameFile(ufoPath, ("glyphs", "a4.tmp"), ("glyphs", "a4.glif"))
+    >>> _countCalls("normalizeGlyphNames", ufoPath, stateStore=stateStore, trustDirectoryModTimes=True)
+    1
+    >>> stateStore.close()
+    >>> shutil.rmtree(directory)
+    """
+
+    storesStateInUFO = False
+
+    _schema = """
+    CREATE TABLE IF NOT EXISTS scopes (
+        ufo TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        version TEXT NOT NULL,
+        changeDetector TEXT NOT NULL,
+        imageReferences TEXT,
+        PRIMARY KEY (ufo, scope)
+    );
+    CREATE TABLE IF NOT EXISTS files (
+        ufo TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        fileName TEXT NOT NULL,
+        signature TEXT NOT NULL,
+        PRIMARY KEY (ufo, scope, fileName)
+    );
+    CREATE TABLE IF NOT EXISTS summaries (
+        ufo TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        PRIMARY KEY (ufo, scope)
+    );
+    CREATE TABLE IF NOT EXISTS fileNames (
+        key TEXT NOT NULL,
+        isClashFree INTEGER NOT NULL,
+        fileNames TEXT NOT NULL,
+        PRIMARY KEY (key)
+    );
+    CREATE TABLE IF NOT EXISTS glyphSets (
+        ufo TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (ufo, scope)
+    );
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        # the connection is only used while holding the lock.
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(self._schema)
+        # the signatures as they were read, by (ufo, scope).
+        # these are used to only write what has changed.
+        self._read = {}
+
+    def _getUFOKey(self, ufoPath):
+        return os.path.realpath(ufoPath)
+
+    def _readScope(self, ufo, scope):
+        cursor = self._connection.execute(
+            "SELECT version, changeDetector, imageReferences FROM scopes WHERE ufo = ? AND scope = ?",
+            (ufo, scope)
+        )
+        return cursor.fetchone()
+
+    def readModTimes(self, ufoPath, scope, changeDetector="modTime"):
+        with self._lock:
+            ufo = self._getUFOKey(ufoPath)
+            modTimes = FileSignatures(changeDetector)
+            row = self._readScope(ufo, scope)
+            if row is not None and row[1] == _getChangeDetectorTag(changeDetector):
+                cursor = self._connection.execute(
+                    "SELECT fileName, signature FROM files WHERE ufo = ? AND scope = ?",
+                    (ufo, scope)
+                )
+                for fileName, signature in cursor:
+                    modTimes[fileName] = signature
+            self._read[ufo, scope] = dict(modTimes)
+            return modTimes
+
+    def readImageReferences(self, ufoPath, scope):
+        with self._lock:
+            row = self._readScope(self._getUFOKey(ufoPath), scope)
+            if row is None or row[2] is None:
+                return None
+            return json.loads(row[2])
+
+    def storeState(self, ufoPath, scope, modTimes, imageReferences=None):
+        with self._lock:
+            ufo = self._getUFOKey(ufoPath)
+            changeDetectorTag = _getChangeDetectorTag(_getChangeDetector(modTimes))
+            previous = self._read.pop((ufo, scope), None)
+            row = self._readScope(ufo, scope)
+            if previous is None or row is None or row[1] != changeDetectorTag:
+                # the stored signatures are unknown or
+                # unusable, so replace all of them.
+                self._connection.execute("DELETE FROM files WHERE ufo = ? AND scope = ?", (ufo, scope))
+                previous = {}
+            changed = [
+                (ufo, scope, fileName, signature)
+                for fileName, signature in modTimes.items()
+                if previous.get(fileName) != signature
+            ]
+            removed = [
+                (ufo, scope, fileName)
+                for fileName in previous
+                if fileName not in modTimes
+            ]
+            self._connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", changed)
+            self._connection.executemany("DELETE FROM files WHERE ufo = ? AND scope = ? AND fileName = ?", removed)
+            if imageReferences is not None:
+                imageReferences = json.dumps(imageReferences, sort_keys=True)
+            elif row is not None:
+                imageReferences = row[2]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO scopes VALUES (?, ?, ?, ?, ?)",
+                (ufo, scope, __version__, changeDetectorTag, imageReferences)
+            )
+
+    def readSummary(self, ufoPath, scope):
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT summary FROM summaries WHERE ufo = ? AND scope = ?",
+                (self._getUFOKey(ufoPath), scope)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return row[0]
+
+    def storeSummary(self, ufoPath, scope, summary):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)",
+                (self._getUFOKey(ufoPath), scope, summary)
+            )
+
+    def readFileNames(self, key):
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT fileNames, isClashFree FROM fileNames WHERE key = ?",
+                (key,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return json.loads(row[0]), bool(row[1])
+
+    def readFileNamesKey(self, ufoPath, scope, version):
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT key FROM glyphSets WHERE ufo = ? AND scope = ? AND version = ?",
+                (self._getUFOKey(ufoPath), scope, version)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return row[0]
+
+    def storeFileNames(self, ufoPath, scope, key, version, fileNames, isClashFree):
+        with self._lock:
+            ufo = self._getUFOKey(ufoPath)
+            cursor = self._connection.execute("SELECT key FROM glyphSets WHERE ufo = ? AND scope = ?", (ufo, scope))
+            row = cursor.fetchone()
+            if row is not None and row[0] == key:
+                return
+            self._connection.execute("INSERT OR REPLACE INTO glyphSets VALUES (?, ?, ?, ?)", (ufo, scope, key, version))
+            cursor = self._connection.execute("SELECT 1 FROM fileNames WHERE key = ?", (key,))
+            if cursor.fetchone() is None:
+                self._connection.execute(
+                    "INSERT INTO fileNames VALUES (?, ?, ?)",
+                    (key, int(isClashFree), json.dumps(fileNames, sort_keys=True))
+                )
+            # forget the file names that no layer uses
+            self._connection.execute("DELETE FROM fileNames WHERE key NOT IN (SELECT key FROM glyphSets)")
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+# -------------------
+# Directory Summaries
+# -------------------
+
+# A summary is a hash of the names, sizes and mod times of
+# the files in a directory. The UFO summary is a hash of
+# the top level files and the summaries of the layer and
+# images directories. If a summary matches the one stored
+# after the previous normalization, nothing in it can have
+# changed and no file needs to be read.
+#
+# When directory mod times are trusted, a directory's
+# summary is only its mod time. That changes when files
+# are added, removed or replaced, which is what editors
+# and version control systems do, but not when a file is
+# modified in place.
+
+def _getStatSignature(st):
+    modTime = getattr(st, "st_mtime_ns", None)
+    if modTime is None:
+        modTime = repr(st.st_mtime)
+    return "%d %s" % (st.st_size, modTime)
+
+def _hashSummaryEntries(entries):
+    return contentHash(u"\n".join(entries).encode("utf-8"))
+
+def _getSummaryFingerprint(changeDetector):
+    # anything that affects what would be normalized
+    # must invalidate the stored summaries.
+    rules = ";".join("%s=%d" % (ruleSet, version) for ruleSet, version in sorted(normalizationRuleVersions.items()))
+    return "%s %s %s" % (__version__, _getChangeDetectorTag(changeDetector), rules)
+
+def getDirectorySummary(path, changeDetector="modTime", trustDirectoryModTimes=False):
+    """
+    Get a summary of the files in a directory.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> subpathWriteFile("a", directory, "a.txt")
+    >>> summary = getDirectorySummary(directory)
+    >>> getDirectorySummary(directory) == summary
+    True
+    >>> getDirectorySummary(directory, "contentHash") == summary
+    False
+    >>> subpathWriteFile("ab", directory, "a.txt")
+    >>> getDirectorySummary(directory) == summary
+    False
+    >>> shutil.rmtree(directory)
+    """
+    entries = [_getSummaryFingerprint(changeDetector)]
+    if trustDirectoryModTimes:
+        entries.append(_getStatSignature(os.stat(path)))
+    else:
+        for fileName, st in sorted(subpathScanDirectory(path).items()):
+            entries.append(u"%s %s" % (tounicode(fileName, "utf-8"), _getStatSignature(st)))
+    return _hashSummaryEntries(entries)
+
+def getUFOSummary(ufoPath, changeDetector="modTime", trustDirectoryModTimes=False):
+    """
+    Get a summary of the files in a UFO.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> ufoPath = _makeTestUFO(directory, glyphCount=2)
+    >>> summary = getUFOSummary(ufoPath)
+    >>> getUFOSummary(ufoPath) == summary
+    True
+    >>> trustedSummary = getUFOSummary(ufoPath, trustDirectoryModTimes=True)
+    >>> subpathWriteFile(_testGLIF % dict(name="a1", x=100), ufoPath, "glyphs", "a1.glif")
+    >>> getUFOSummary(ufoPath) == summary
+    False
+    >>> subpathWriteFile(_testGLIF % dict(name="a2", x=100), ufoPath, "glyphs", "a2.glif")
+    >>> getUFOSummary(ufoPath, trustDirectoryModTimes=True) == trustedSummary
+    False
+    >>> shutil.rmtree(directory)
+    """
+    entries = [_getSummaryFingerprint(changeDetector)]
+    for fileName, st in sorted(subpathScanDirectory(ufoPath).items()):
+        if stat.S_ISDIR(st.st_mode):
+            # only the directories that the normalizer touches
+            if not fileName.startswith("glyphs") and fileName != "images":
+                continue
+            path = os.path.join(ufoPath, fileName)
+            signature = getDirectorySummary(path, changeDetector, trustDirectoryModTimes)
+        else:
+            signature = _getStatSignature(st)
+        entries.append(u"%s %s" % (tounicode(fileName, "utf-8"), signature))
+    return _hashSummaryEntries(entries)
+
 # ----------------
 # Image Management
 # ----------------
@@ -3069,9 +6631,7 @@ def purgeImagesDirectory(ufoPath, toPurge):
     Purge specified images from the images directory.
     """
     for fileName in toPurge:
-        if subpathExists(ufoPath, *["images", fileName]):
-            path = subpathJoin(ufoPath, *["images", fileName])
-            os.remove(path)
+        subpathRemoveFile(ufoPath, "images", fileName)
 
 def storeImageReferences(lib, imageReferences):
     """
@@ -3099,6 +6659,32 @@ reservedFileNames = "CON PRN AUX CLOCK$ NUL A:-Z: COM1".lower().split(" ")
 reservedFileNames += "LPT1 LPT2 LPT3 COM2 COM3 COM4".lower().split(" ")
 maxFileNameLength = 255
 
+class NameTranslationError(UFONormalizerError): pass
+
+class _UserNameCharacterMap(dict):
+
+    """
+    A str.translate table for filtering user names. Illegal
+    characters are replaced with _ and _ is added after all
+    non-lower characters. Characters that are not in the
+    table are added the first time that they are found.
+    """
+
+    def __missing__(self, code):
+        character = unichr(code)
+        if character in illegalCharacters:
+            value = u"_"
+        elif character != character.lower():
+            value = character + u"_"
+        else:
+            value = character
+        self[code] = value
+        return value
+
+_userNameCharacterMap = _UserNameCharacterMap()
+for code in range(128):
+    _userNameCharacterMap[code]
+
 def userNameToFileName(userName, existing=[], prefix="", suffix=""):
     """
     existing should be a case-insensitive list
@@ -3152,29 +6738,29 @@ def userNameToFileName(userName, existing=[], prefix="", suffix=""):
     True
     >>> userNameToFileName(u"a", [u"a"]) == u"a000000000000001"
     True
+    >>> userNameToFileName(u"\xc9\xe9") == u"\xc9_\xe9"
+    True
     """
+    userName = _filterUserName(userName, prefix, suffix)
+    # test for clash
+    fullName = prefix + userName + suffix
+    if fullName.lower() in existing:
+        fullName = handleClash1(userName, existing, prefix, suffix)
+    # finished
+    return fullName
+
+def _filterUserName(userName, prefix, suffix):
     # the incoming name must be a unicode string
     assert isinstance(userName, unicode), "The value for userName must be a unicode string."
-    # establish the prefix and suffix lengths
-    prefixLength = len(prefix)
-    suffixLength = len(suffix)
     # replace an initial period with an _
     # if no prefix is to be added
     if not prefix and userName[0] == ".":
         userName = "_" + userName[1:]
-    # filter the user name
-    filteredUserName = []
-    for character in userName:
-        # replace illegal characters with _
-        if character in illegalCharacters:
-            character = "_"
-        # add _ to all non-lower characters
-        elif character != character.lower():
-            character += "_"
-        filteredUserName.append(character)
-    userName = "".join(filteredUserName)
+    # replace illegal characters with _ and
+    # add _ to all non-lower characters
+    userName = userName.translate(_userNameCharacterMap)
     # clip to 255
-    sliceLength = maxFileNameLength - prefixLength - suffixLength
+    sliceLength = maxFileNameLength - len(prefix) - len(suffix)
     userName = userName[:sliceLength]
     # test for illegal files names
     parts = []
@@ -3182,13 +6768,102 @@ def userNameToFileName(userName, existing=[], prefix="", suffix=""):
         if part.lower() in reservedFileNames:
             part = "_" + part
         parts.append(part)
-    userName = ".".join(parts)
-    # test for clash
-    fullName = prefix + userName + suffix
-    if fullName.lower() in existing:
-        fullName = handleClash1(userName, existing, prefix, suffix)
-    # finished
-    return fullName
+    return ".".join(parts)
+
+class FileNameMapper(object):
+
+    """
+    Make unique file names for a series of user names.
+
+    The file names are the same as those returned by
+    userNameToFileName when it is given the lower case
+    versions of the file names made before. The next
+    counter to try is kept for each clashing name, so
+    a clash is resolved without trying all of the
+    counters that have already been used.
+
+    >>> mapper = FileNameMapper(suffix=".glif")
+    >>> [mapper.makeFileName(userName) for userName in (u"a", u"A", u"a_", u"a_")] == [u"a.glif", u"A_.glif", u"a_000000000000001.glif", u"a_000000000000002.glif"]
+    True
+    >>> mapper.addFileName(u"b000000000000001.glif")
+    >>> mapper.makeFileName(u"b") == userNameToFileName(u"b", [u"b"], suffix=".glif")
+    True
+    >>> mapper.makeFileName(u"b") == u"b000000000000002.glif"
+    True
+
+    >>> names = [u"a", u"A", u"a*", u"a.alt", u"A.alt", u".notdef", u"con", u"a_"] * 3
+    >>> existing = []
+    >>> expected = []
+    >>> for name in names:
+    ...     fileName = userNameToFileName(name, existing, prefix="glyphs.")
+    ...     existing.append(fileName.lower())
+    ...     expected.append(fileName)
+    >>> mapper = FileNameMapper(prefix="glyphs.")
+    >>> [mapper.makeFileName(name) for name in names] == expected
+    True
+    """
+
+    def __init__(self, prefix="", suffix=""):
+        self.prefix = prefix
+        self.suffix = suffix
+        # the lower case file names
+        self._existing = set()
+        # the next handleClash1 counter for each lower case user name
+        self._clashCounters = {}
+        # the next handleClash2 counter
+        self._fallbackCounter = 1
+        # the number of names that clashed
+        self.clashCount = 0
+
+    def addFileName(self, fileName):
+        """
+        Add a file name that must not be made.
+        """
+        self._existing.add(fileName.lower())
+
+    def makeFileName(self, userName):
+        """
+        Make a file name for userName.
+        """
+        userName = _filterUserName(userName, self.prefix, self.suffix)
+        fullName = self.prefix + userName + self.suffix
+        if fullName.lower() in self._existing:
+            self.clashCount += 1
+            fullName = self._handleClash1(userName)
+        self._existing.add(fullName.lower())
+        return fullName
+
+    def _handleClash1(self, userName):
+        # this is the same as handleClash1
+        prefix = self.prefix
+        suffix = self.suffix
+        length = len(prefix) + len(userName) + len(suffix) + 15
+        if length > maxFileNameLength:
+            userName = userName[:maxFileNameLength - length]
+        key = userName.lower()
+        counter = self._clashCounters.get(key, 1)
+        while counter < 999999999999999:
+            fullName = prefix + userName + str(counter).zfill(15) + suffix
+            counter += 1
+            if fullName.lower() not in self._existing:
+                self._clashCounters[key] = counter
+                return fullName
+        self._clashCounters[key] = counter
+        return self._handleClash2()
+
+    def _handleClash2(self):
+        # this is the same as handleClash2
+        prefix = self.prefix
+        suffix = self.suffix
+        maxValue = int("9" * (maxFileNameLength - len(prefix) - len(suffix)))
+        counter = self._fallbackCounter
+        while counter < maxValue:
+            fullName = prefix + str(counter) + suffix
+            counter += 1
+            if fullName.lower() not in self._existing:
+                self._fallbackCounter = counter
+                return fullName
+        raise NameTranslationError("No unique name could be found.")
 
 def handleClash1(userName, existing=[], prefix="", suffix=""):
     """
@@ -3297,6 +6972,383 @@ def handleClash2(existing=[], prefix="", suffix=""):
 # Testing
 # -------
 
+# __file__ may be relative to the working directory,
+# which the tests change.
+_testDataDirectory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+_testGLIF = """<?xml version="1.0" encoding="UTF-8"?>
+<glyph name="%(name)s" format="2">
+	<advance width="500"/>
+	<outline>
+		<contour>
+			<point x="%(x)s" y="0" type="line"/>
+			<point x="100" y="100" type="line"/>
+			<point x="100" y="0.50" type="line"/>
+		</contour>
+	</outline>
+</glyph>
+"""
+
+_testDesignspace = """<?xml version="1.0" encoding="UTF-8"?>
+<designspace format="4.1">
+	<sources>
+		<source filename="Light.ufo" name="Light"/>
+		<source filename="Bold.ufo" name="Bold"/>
+		<source filename="Bold.ufo" name="Bold Background" layer="background"/>
+	</sources>
+	<instances>
+		<instance filename="instances/Regular.ufo" name="Regular"/>
+	</instances>
+</designspace>
+"""
+
+def _makeTestUFO(directory, glyphCount=100, fileName="Test.ufo"):
+    """
+    Make a UFO 3 with a default layer and a background
+    layer. Each layer contains glyphCount glyphs with
+    non-normalized data and the first glyph in the default
+    layer references an image.
+    """
+    ufoPath = os.path.join(directory, fileName)
+    os.mkdir(ufoPath)
+    subpathWriteFile(normalizePropertyList(dict(creator="test", formatVersion=3)), ufoPath, "metainfo.plist")
+    layerContents = [("public.default", "glyphs"), ("background", "glyphs.background")]
+    subpathWriteFile(normalizePropertyList(layerContents), ufoPath, "layercontents.plist")
+    glyphOrder = ["a%d" % index for index in range(glyphCount)]
+    subpathWriteFile(normalizePropertyList({"public.glyphOrder": glyphOrder}), ufoPath, "lib.plist")
+    os.mkdir(subpathJoin(ufoPath, "images"))
+    subpathWriteFile("", ufoPath, "images", "sketch.png")
+    for layerName, layerDirectory in layerContents:
+        os.mkdir(subpathJoin(ufoPath, layerDirectory))
+        glyphMapping = {}
+        for index in range(glyphCount):
+            glyphName = "a%d" % index
+            fileName = glyphName + ".glif"
+            glyphMapping[glyphName] = fileName
+            text = _testGLIF % dict(name=glyphName, x=index)
+            if index == 0 and layerDirectory == "glyphs":
+                text = text.replace("<outline>", "<image fileName=\"sketch.png\"/>\n\t<outline>")
+            subpathWriteFile(text, ufoPath, layerDirectory, fileName)
+        subpathWriteFile(normalizePropertyList(glyphMapping), ufoPath, layerDirectory, "contents.plist")
+    return ufoPath
+
+def _testUnnormalizeGLIF(text):
+    """
+    Change the formatting of normalized GLIF data
+    without changing what it describes.
+    """
+    text = tounicode(text, "utf-8")
+    return text.replace(xmlIndent, "    ").replace("/>", " />")
+
+def _countNormalizedGLIFs(ufoPath, **kwargs):
+    """
+    Normalize a UFO and return the number of GLIF files
+    that were normalized. This only counts work done in
+    this process so it should not be used with jobs.
+    """
+    return _countCalls("_normalizeGLIFFile", ufoPath, **kwargs)
+
+def _countCalls(functionName, ufoPath, **kwargs):
+    """
+    Normalize a UFO and return the number of times
+    the named module level function was called.
+    """
+    return _countCallsTo(functionName, normalizeUFO, ufoPath, **kwargs)
+
+def _countCallsTo(functionName, function, *args, **kwargs):
+    """
+    Call function and return the number of times
+    the named module level function was called.
+    """
+    counter = []
+    original = globals()[functionName]
+    def countingFunction(*args, **kwargs):
+        counter.append(args)
+        return original(*args, **kwargs)
+    globals()[functionName] = countingFunction
+    try:
+        function(*args, **kwargs)
+    finally:
+        globals()[functionName] = original
+    return len(counter)
+
+def benchmarkIncrementalNormalization(glyphCount=5000):
+    """
+    Time a full normalization of a generated UFO followed
+    by a normalization of the same, unchanged UFO. The
+    second run should do close to no work. With a state
+    file, the second run only compares directory summaries.
+    Each configuration starts with a new UFO and state file.
+    """
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        configurations = [
+            ("", False, False),
+            (", state file", True, False),
+            (", trusted directory mod times", True, True),
+        ]
+        for index, (description, useStateFile, trustDirectoryModTimes) in enumerate(configurations):
+            configurationDirectory = os.path.join(directory, str(index))
+            os.mkdir(configurationDirectory)
+            ufoPath = _makeTestUFO(configurationDirectory, glyphCount=glyphCount)
+            kwargs = dict(trustDirectoryModTimes=trustDirectoryModTimes)
+            stateStore = None
+            if useStateFile:
+                stateStore = SQLiteStateStore(os.path.join(configurationDirectory, "state.db"))
+                kwargs["stateStore"] = stateStore
+            try:
+                for title in ("first run", "second run"):
+                    s = time.time()
+                    count = _countNormalizedGLIFs(ufoPath, **kwargs)
+                    t = time.time() - s
+                    print("incremental normalization%s, %s: %d GLIFs normalized in %.4f seconds" % (description, title, count, t))
+            finally:
+                if stateStore is not None:
+                    stateStore.close()
+    finally:
+        shutil.rmtree(directory)
+
+def benchmarkXMLBackends(ufoPath, backends=None, engines=None):
+    """
+    Time the normalization of all GLIF files in a copy
+    of a UFO with each XML backend and GLIF engine.
+    The results are printed in GLIF files per second.
+    """
+    import tempfile
+    if backends is None:
+        backends = getXMLBackendNames()
+    if engines is None:
+        engines = glifEngines
+    previous = getXMLBackend().name
+    directory = tempfile.mkdtemp()
+    try:
+        for backend in backends:
+            setXMLBackend(backend)
+            for engine in engines:
+                outPath = os.path.join(directory, os.path.basename(ufoPath))
+                shutil.copytree(ufoPath, outPath)
+                glifPaths = []
+                for layerDirectory in sorted(os.listdir(outPath)):
+                    if not layerDirectory.startswith("glyphs"):
+                        continue
+                    if not os.path.isdir(subpathJoin(outPath, layerDirectory)):
+                        continue
+                    for fileName in sorted(os.listdir(subpathJoin(outPath, layerDirectory))):
+                        if fileName.endswith(".glif"):
+                            glifPaths.append((layerDirectory, fileName))
+                s = time.time()
+                for subpath in glifPaths:
+                    normalizeGLIF(outPath, *subpath, engine=engine)
+                t = time.time() - s
+                rate = len(glifPaths) / t if t else 0
+                print("%s backend, %s engine: %d GLIFs in %.4f seconds (%.0f GLIFs per second)" % (backend, engine, len(glifPaths), t, rate))
+                shutil.rmtree(outPath)
+    finally:
+        setXMLBackend(previous)
+        shutil.rmtree(directory)
+
+def benchmarkCoordinateFormatting(ufoPath=None, repeat=5):
+    """
+    Time the formatting of the coordinates found in the
+    GLIF files of a UFO with xmlConvertFloat and with
+    xmlConvertCoordinate. A generated UFO is used if
+    no UFO is given.
+    """
+    import re
+    import tempfile
+    directory = None
+    if ufoPath is None:
+        directory = tempfile.mkdtemp()
+        ufoPath = _makeTestUFO(directory, glyphCount=1000)
+    try:
+        pattern = re.compile(r'\s(?:x|y|xOffset|yOffset|width|height)="([^"]*)"')
+        values = []
+        for layerDirectory in sorted(os.listdir(ufoPath)):
+            if not layerDirectory.startswith("glyphs"):
+                continue
+            if not os.path.isdir(subpathJoin(ufoPath, layerDirectory)):
+                continue
+            for fileName in sorted(os.listdir(subpathJoin(ufoPath, layerDirectory))):
+                if fileName.endswith(".glif"):
+                    text = tounicode(subpathReadFile(ufoPath, layerDirectory, fileName), "utf-8")
+                    values.extend(pattern.findall(text))
+        floats = []
+        for value in values:
+            try:
+                floats.append(float(value))
+            except ValueError:
+                continue
+        for title, function, data in (
+                ("xmlConvertFloat", xmlConvertFloat, floats),
+                ("xmlConvertCoordinate", xmlConvertCoordinate, floats),
+                ("xmlConvertCoordinate from text", xmlConvertCoordinate, values)
+            ):
+            _xmlCoordinateCache.clear()
+            s = time.time()
+            for i in range(repeat):
+                for value in data:
+                    try:
+                        function(value)
+                    except ValueError:
+                        pass
+            t = time.time() - s
+            print("coordinate formatting, %s: %d values in %.4f seconds" % (title, len(data) * repeat, t))
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+def benchmarkOutlineAllocations(contourCount=100, pointCount=100):
+    """
+    Report the memory blocks and bytes held by the normalized
+    outline objects of one generated glyph before it is written.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        # not available before Python 3.4
+        return
+    lines = ["<outline>"]
+    for contourIndex in range(contourCount):
+        lines.append("<contour>")
+        for pointIndex in range(pointCount):
+            lines.append("<point x=\"%d\" y=\"%d.5\" type=\"curve\" smooth=\"yes\"/>" % (pointIndex, contourIndex))
+        lines.append("</contour>")
+    lines.append("<component base=\"a\" xOffset=\"10\"/>")
+    lines.append("</outline>")
+    element = ET.fromstring("\n".join(lines))
+    tracemalloc.start()
+    try:
+        outline = []
+        for subElement in element:
+            if subElement.tag == "contour":
+                outline.append(_normalizeGlifContourFormat2(subElement))
+            else:
+                outline.append(_normalizeGlifComponentFormat2(subElement))
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    statistics = snapshot.filter_traces([tracemalloc.Filter(True, __file__)]).statistics("filename")
+    count = sum(statistic.count for statistic in statistics)
+    size = sum(statistic.size for statistic in statistics)
+    print("outline allocations, %d points: %d blocks, %d bytes per glyph" % (contourCount * pointCount, count, size))
+
+def benchmarkPropertyListReading(glyphCount=60000):
+    """
+    Time reading a lib.plist with a long glyph order and
+    a kerning.plist with the property list reader and
+    with the XML backend.
+    """
+    glyphOrder = ["glyph%d" % i for i in range(glyphCount)]
+    kerning = {}
+    for i in range(glyphCount // 200):
+        kerning["public.kern1.%d" % i] = dict(("public.kern2.%d" % j, i - j) for j in range(100))
+    for fileName, obj in (("lib.plist", {"public.glyphOrder": glyphOrder}), ("kerning.plist", kerning)):
+        data = _normalizePropertyListToBytes(obj)
+        for title, function in (("reader", _readPlistFromBytes), ("%s backend" % ET.name, _readPlistWithBackend)):
+            s = time.time()
+            function(data)
+            t = time.time() - s
+            print("property list reading, %s, %s: %.4f seconds" % (fileName, title, t))
+
+def benchmarkPropertyListStreaming(pairCount=100000):
+    """
+    Report the time and the peak memory traced while a generated
+    kerning.plist is normalized in memory and while streaming.
+    """
+    import tempfile
+    try:
+        import tracemalloc
+    except ImportError:
+        # not available before Python 3.4
+        return
+    directory = tempfile.mkdtemp()
+    previous = plistStreamingThreshold
+    try:
+        kerning = {}
+        for i in range(pairCount // 100):
+            kerning["public.kern1.%d" % i] = dict(("public.kern2.%d" % j, i - j) for j in range(100))
+        data = _normalizePropertyListToBytes(kerning).replace(tobytes(xmlLineBreak), b"")
+        del kerning
+        for title, threshold in (("in memory", len(data) + 1), ("streaming", 0)):
+            globals()["plistStreamingThreshold"] = threshold
+            subpathWriteFile(data, directory, "kerning.plist")
+            s = time.time()
+            normalizeKerningPlist(directory, {})
+            t = time.time() - s
+            subpathWriteFile(data, directory, "kerning.plist")
+            tracemalloc.start()
+            try:
+                normalizeKerningPlist(directory, {})
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            print("property list normalization, %d pairs, %s: %.4f seconds, %d bytes peak" % (pairCount, title, t, peak))
+    finally:
+        globals()["plistStreamingThreshold"] = previous
+        shutil.rmtree(directory)
+
+def benchmarkFileNameMapping(nameCount=100000, baselineCount=1000):
+    """
+    Time making file names for generated user names that
+    all clash with each other with userNameToFileName and
+    with FileNameMapper.
+    """
+    # each digit is replaced with a character that becomes _
+    characters = u"*|:<>?[]+/"
+    userNames = [u"a" + u"".join(characters[int(digit)] for digit in str(i)) for i in range(nameCount)]
+    s = time.time()
+    existing = set()
+    for userName in userNames[:baselineCount]:
+        existing.add(userNameToFileName(userName, existing, suffix=".glif").lower())
+    t = time.time() - s
+    print("file name mapping, %d clashing names, userNameToFileName: %.4f seconds" % (baselineCount, t))
+    s = time.time()
+    mapper = FileNameMapper(suffix=".glif")
+    for userName in userNames:
+        mapper.makeFileName(userName)
+    t = time.time() - s
+    print("file name mapping, %d clashing names, FileNameMapper: %.4f seconds" % (nameCount, t))
+
+def benchmarkGlyphRenames(glyphCount=5000):
+    """
+    Time normalizing the file names of a layer where every
+    GLIF file has a non-standard name and report the number
+    of renames. Half of the files are in cycles of two.
+    """
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        os.mkdir(subpathJoin(directory, "glyphs"))
+        glyphMapping = {}
+        for index in range(glyphCount):
+            glyphName = "A%d" % index
+            if index % 2:
+                # take the standard name of the next glyph
+                fileName = "A_%d.glif" % (index + 1)
+            elif index % 4:
+                fileName = "A_%d.glif" % (index - 1)
+            else:
+                fileName = "x%d.glif" % index
+            glyphMapping[glyphName] = fileName
+            subpathWriteFile(glyphName, directory, "glyphs", fileName)
+        subpathWritePlist(glyphMapping, directory, "glyphs", "contents.plist")
+        renames = []
+        original = subpathRenameFile
+        def countingFunction(*args):
+            renames.append(args)
+            return original(*args)
+        globals()["subpathRenameFile"] = countingFunction
+        try:
+            s = time.time()
+            normalizeGlyphNames(directory, "glyphs")
+            t = time.time() - s
+        finally:
+            globals()["subpathRenameFile"] = original
+        print("glyph renames, %d glyphs: %d renames instead of %d, %.4f seconds" % (glyphCount, len(renames), 2 * glyphCount, t))
+    finally:
+        shutil.rmtree(directory)
+
 def _runProfile(outPath):
     normalizeUFO(outPath)
 
@@ -3317,6 +7369,27 @@ def runTests():
             shutil.rmtree(outPath)
         paths.append((inPath, outPath))
 
+    # incremental normalization test
+    benchmarkIncrementalNormalization()
+
+    # coordinate formatting test
+    benchmarkCoordinateFormatting()
+
+    # outline memory test
+    benchmarkOutlineAllocations()
+
+    # property list reading test
+    benchmarkPropertyListReading()
+
+    # property list streaming test
+    benchmarkPropertyListStreaming()
+
+    # file name mapping test
+    benchmarkFileNameMapping()
+
+    # rename planning test
+    benchmarkGlyphRenames()
+
     if paths:
         # profile test
         import cProfile